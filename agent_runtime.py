@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""Process-wide ADK runners, one per agent persona.
+
+Creating an InMemoryRunner, its session service and a RunConfig on every
+connection is wasted work, and the SSE client reconnects every 5 s on
+errors, so that cost repeats. Instead each persona gets one AgentRuntime
+for the whole process:
+
+- run configs for both modalities are built once
+- the agent's model is resolved once, so every connection shares one
+  Gemini client instead of creating its own
+- the ADK session of each user is kept, so a reconnecting user resumes
+  it instead of starting a new one
+
+Kept sessions are bounded by AGENT_MAX_SESSIONS, least recently used first.
+
+The ADK is only imported once a runtime is created, so importing this
+module, and main.py, stays fast. The app warms the runtime up at startup,
+unless AGENT_WARM_UP=0, in which case the first connection does.
+"""
+
+import os
+import time
+
+from collections import OrderedDict
+
+APP_NAME = "ADK Streaming example"
+AGENT_NAME = os.environ.get("AGENT_NAME", "standalone").lower()
+AGENT_WARM_UP = os.environ.get("AGENT_WARM_UP", "1").lower() not in ("0", "false", "no")
+MODALITIES = ("AUDIO", "TEXT")
+
+# Voice of each persona, None for the model's default voice
+VOICES = {
+    "standalone": "Aoede",  # Female voice
+    "alice": "Aoede",
+    "bastian": None,
+}
+
+
+def make_run_config(modality, voice):
+    from google.adk.agents.run_config import RunConfig
+    from google.genai.types import PrebuiltVoiceConfig, SpeechConfig, VoiceConfig
+
+    if voice is None:
+        return RunConfig(response_modalities=[modality])
+    speech_config = SpeechConfig(
+        language_code="en-US",
+        voice_config=VoiceConfig(prebuilt_voice_config=PrebuiltVoiceConfig(voice_name=voice)),
+    )
+    return RunConfig(response_modalities=[modality], speech_config=speech_config)
+
+
+class AgentRuntime:
+    """Shared runner, run configs and user sessions of one persona."""
+
+    def __init__(self, persona, agent, app_name=APP_NAME, max_sessions=1000):
+        from google.adk.runners import InMemoryRunner
+
+        self.persona = persona
+        self.agent = agent
+        self.app_name = app_name
+        self.max_sessions = max_sessions
+        self.runner = InMemoryRunner(app_name=app_name, agent=agent)
+        voice = VOICES.get(persona, VOICES["standalone"])
+        self.run_configs = {modality: make_run_config(modality, voice) for modality in MODALITIES}
+        self.session_ids = OrderedDict()  # User id to ADK session id, least recently used first
+        self.stats = {
+            "connects": 0,
+            "created": 0,
+            "resumed": 0,
+            "expired": 0,
+            "setup_total": 0.0,
+            "setup_max": 0.0,
+        }
+
+    def warm_up(self):
+        """Resolve the model and create its client before the first connection."""
+        from google.adk.models.registry import LLMRegistry
+
+        if isinstance(self.agent.model, str):
+            # A model name is otherwise resolved to a new Gemini instance, and client, per connection
+            self.agent.model = LLMRegistry.new_llm(self.agent.model)
+        try:
+            self.agent.model._live_api_client
+        except Exception as e:
+            print(f"Couldn't create the {self.persona} model client: {e}")
+
+    async def session(self, user_id):
+        """Resume the user's ADK session, or create one."""
+        service = self.runner.session_service
+        session_id = self.session_ids.get(user_id)
+        if session_id is not None:
+            session = await service.get_session(app_name=self.app_name, user_id=user_id, session_id=session_id)
+            if session is not None:
+                self.session_ids.move_to_end(user_id)
+                self.stats["resumed"] += 1
+                return session
+        session = await service.create_session(app_name=self.app_name, user_id=user_id)
+        self.session_ids[user_id] = session.id
+        self.stats["created"] += 1
+        while len(self.session_ids) > self.max_sessions:
+            old_user_id, old_session_id = self.session_ids.popitem(last=False)
+            await service.delete_session(app_name=self.app_name, user_id=old_user_id, session_id=old_session_id)
+            self.stats["expired"] += 1
+        return session
+
+    async def start(self, user_id, is_audio=False):
+        """Start a live run for the user. Returns the live events and request queue."""
+        from google.adk.agents import LiveRequestQueue
+
+        start = time.perf_counter()
+        resumed = self.stats["resumed"]
+        session = await self.session(user_id)
+        live_request_queue = LiveRequestQueue()
+        live_events = self.runner.run_live(
+            session=session,
+            live_request_queue=live_request_queue,
+            run_config=self.run_configs["AUDIO" if is_audio else "TEXT"],
+        )
+        elapsed = time.perf_counter() - start
+        self.stats["connects"] += 1
+        self.stats["setup_total"] += elapsed
+        self.stats["setup_max"] = max(self.stats["setup_max"], elapsed)
+        action = "resumed" if self.stats["resumed"] > resumed else "created"
+        print(f"Agent session of #{user_id} {action} in {elapsed * 1000:.1f} ms")
+        return live_events, live_request_queue
+
+
+def persona_agent(persona):
+    from stego_agent.agent import get_agent
+    return get_agent(persona)
+
+
+runtimes = {}
+
+
+def get_runtime(persona=None):
+    """The process-wide runtime of a persona, AGENT_NAME by default."""
+    persona = persona or AGENT_NAME
+    runtime = runtimes.get(persona)
+    if runtime is None:
+        runtime = runtimes[persona] = AgentRuntime(
+            persona,
+            persona_agent(persona),
+            max_sessions=int(os.environ.get("AGENT_MAX_SESSIONS", 1000)),
+        )
+    return runtime
+
+
+def runtime_stats(persona=None):
+    """Stats of a persona's runtime, None until it is created."""
+    runtime = runtimes.get(persona or AGENT_NAME)
+    return runtime and runtime.stats
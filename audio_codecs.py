@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""Audio codecs for the client connection.
+
+Agent audio goes to the client as 24 kHz 16-bit PCM and mic audio comes
+back as 16 kHz 16-bit PCM, base64 encoded on top over SSE and /send. A
+connection can negotiate a smaller encoding instead:
+
+- ``pcm``    audio/pcm, 2 bytes per sample, as before
+- ``mulaw``  audio/pcmu, G.711 μ-law, 1 byte per sample
+- ``adpcm``  audio/adpcm, IMA ADPCM, 4 bits per sample. Every chunk starts
+  with its first sample and step index, so it decodes on its own. Each
+  sample depends on the one before, so it can't be vectorised and costs
+  about 10 ms of CPU per second of audio in plain Python, on the event
+  loop. It is kept for the benchmark but not negotiated
+- ``opus``   audio/opus, only when opuslib is installed. 20 ms packets,
+  each prefixed with its 16-bit length
+
+The client lists the codecs it can decode, most preferred first, in the
+``codecs`` query parameter of /events or /ws. The server picks the first
+one it supports, PCM otherwise, and says which in a ``{"codec": name}``
+message before any audio. Agent audio is encoded after watermarking and
+mic audio is decoded before it reaches the agent, the VAD and watermark
+detection. Mic audio names its encoding in each message: the content type
+of /send and /stream bodies, the mime_type of JSON messages, the frame type
+of WebSocket frames.
+
+The watermark is embedded before the codec, so lossy codecs wear it down.
+``python -m benchmarks.bench_codecs`` measures by how much, with the CPU
+cost and the bytes saved.
+
+A codec makes encoders and decoders for a sample rate. Stateless codecs are
+their own encoder and decoder. Uses NumPy when it is installed, like
+vad.py, and plain Python otherwise.
+"""
+
+import struct
+
+from array import array
+from functools import lru_cache
+from transport import FRAME_AUDIO_ADPCM, FRAME_AUDIO_MULAW, FRAME_AUDIO_OPUS, FRAME_AUDIO_PCM
+from vad import np
+
+try:
+    import opuslib
+except ImportError:
+    opuslib = None
+
+
+class Codec:
+    """16-bit PCM as is."""
+
+    name = "pcm"
+    mime_type = "audio/pcm"
+    frame_type = FRAME_AUDIO_PCM
+    bytes_per_sample = 2  # None if encoded audio can't be cut at arbitrary sample boundaries
+    negotiable = True  # False for codecs too costly to run on the event loop
+
+    def encoder(self, sample_rate):
+        return self
+
+    def decoder(self, sample_rate):
+        return self
+
+    def encode(self, pcm):
+        return pcm
+
+    def decode(self, data):
+        return data
+
+
+def whole_samples(pcm):
+    return memoryview(pcm)[:len(pcm) & ~1]
+
+
+# G.711 μ-law
+MULAW_BIAS = 0x84
+MULAW_CLIP = 32635
+
+
+def mulaw_encode_sample(sample):
+    sign = 0x80 if sample < 0 else 0
+    magnitude = min(-sample if sign else sample, MULAW_CLIP) + MULAW_BIAS
+    exponent = max((magnitude >> 7).bit_length() - 1, 0)
+    mantissa = (magnitude >> (exponent + 3)) & 0x0F
+    return ~(sign | exponent << 4 | mantissa) & 0xFF
+
+
+def mulaw_decode_byte(byte):
+    byte = ~byte & 0xFF
+    exponent = (byte >> 4) & 0x07
+    magnitude = (((byte & 0x0F) << 3) + MULAW_BIAS << exponent) - MULAW_BIAS
+    return -magnitude if byte & 0x80 else magnitude
+
+
+@lru_cache(maxsize=1)
+def mulaw_encode_table():
+    """μ-law byte of every sample, indexed by the sample as an unsigned 16-bit integer.
+
+    Built on first use, not at import: 65536 calls to mulaw_encode_sample
+    take about 35 ms, the same arithmetic on a NumPy array under 3 ms.
+    """
+    if np is None:
+        return bytes(mulaw_encode_sample(value - 65536 if value >= 32768 else value) for value in range(65536))
+    samples = np.arange(65536, dtype=np.int32)
+    samples[32768:] -= 65536
+    sign = np.where(samples < 0, 0x80, 0)
+    magnitude = np.minimum(np.abs(samples), MULAW_CLIP) + MULAW_BIAS
+    exponent = np.maximum(np.frexp(magnitude >> 7)[1] - 1, 0)  # bit_length() - 1
+    mantissa = (magnitude >> (exponent + 3)) & 0x0F
+    return (~(sign | exponent << 4 | mantissa) & 0xFF).astype(np.uint8).tobytes()
+
+
+# Indexed by the μ-law byte
+MULAW_DECODE = array('h', (mulaw_decode_byte(byte) for byte in range(256)))
+
+
+class MuLawCodec(Codec):
+    """G.711 μ-law, by table lookup."""
+
+    name = "mulaw"
+    mime_type = "audio/pcmu"
+    frame_type = FRAME_AUDIO_MULAW
+    bytes_per_sample = 1
+
+    def __init__(self):
+        if np is not None:
+            self.decode_table = np.array(MULAW_DECODE, dtype='<i2')
+
+    def encode(self, pcm):
+        samples = whole_samples(pcm)
+        table = mulaw_encode_table()
+        if np is not None:
+            return np.frombuffer(table, dtype=np.uint8)[np.frombuffer(samples, dtype='<u2')].tobytes()
+        return bytes(map(table.__getitem__, samples.cast('H')))
+
+    def decode(self, data):
+        if np is not None:
+            return self.decode_table[np.frombuffer(data, dtype=np.uint8)].tobytes()
+        return array('h', map(MULAW_DECODE.__getitem__, bytes(data))).tobytes()
+
+
+# IMA ADPCM
+ADPCM_STEPS = (
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45,
+    50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209, 230,
+    253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876, 963,
+    1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272, 2499, 2749, 3024, 3327,
+    3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442,
+    11487, 12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794,
+    32767,
+)
+ADPCM_INDEX = (-1, -1, -1, -1, 2, 4, 6, 8) * 2
+# First sample, step index, 1 if the last byte holds a single nibble
+ADPCM_HEADER = struct.Struct('<hBB')
+
+
+class AdpcmEncoder:
+    """Carries the step index from chunk to chunk, so each chunk starts adapted."""
+
+    def __init__(self):
+        self.index = 0
+
+    def encode(self, pcm):
+        samples = whole_samples(pcm).cast('h')
+        if not samples:
+            return b''
+        predictor = samples[0]
+        index = self.index
+        nibbles = []
+        for sample in samples[1:]:
+            step = ADPCM_STEPS[index]
+            diff = sample - predictor
+            nibble = 0
+            if diff < 0:
+                nibble = 8
+                diff = -diff
+            delta = step >> 3
+            if diff >= step:
+                nibble |= 4
+                diff -= step
+                delta += step
+            step >>= 1
+            if diff >= step:
+                nibble |= 2
+                diff -= step
+                delta += step
+            step >>= 1
+            if diff >= step:
+                nibble |= 1
+                delta += step
+            predictor = max(-32768, min(32767, predictor - delta if nibble & 8 else predictor + delta))
+            index = max(0, min(88, index + ADPCM_INDEX[nibble]))
+            nibbles.append(nibble)
+        odd = len(nibbles) & 1
+        if odd:
+            nibbles.append(0)
+        header = ADPCM_HEADER.pack(samples[0], self.index, odd)
+        self.index = index
+        return header + bytes(low | high << 4 for low, high in zip(nibbles[::2], nibbles[1::2]))
+
+
+def adpcm_decode(data):
+    if len(data) < ADPCM_HEADER.size:
+        return b''
+    predictor, index, odd = ADPCM_HEADER.unpack_from(data)
+    output = array('h', (predictor,))
+    nibbles = []
+    for byte in bytes(data[ADPCM_HEADER.size:]):
+        nibbles.append(byte & 0x0F)
+        nibbles.append(byte >> 4)
+    if odd and nibbles:
+        nibbles.pop()
+    for nibble in nibbles:
+        step = ADPCM_STEPS[index]
+        delta = step >> 3
+        if nibble & 4:
+            delta += step
+        if nibble & 2:
+            delta += step >> 1
+        if nibble & 1:
+            delta += step >> 2
+        predictor = max(-32768, min(32767, predictor - delta if nibble & 8 else predictor + delta))
+        index = max(0, min(88, index + ADPCM_INDEX[nibble]))
+        output.append(predictor)
+    return output.tobytes()
+
+
+class AdpcmCodec(Codec):
+    """IMA ADPCM in self-contained chunks."""
+
+    name = "adpcm"
+    mime_type = "audio/adpcm"
+    frame_type = FRAME_AUDIO_ADPCM
+    bytes_per_sample = None
+    negotiable = False
+
+    def encoder(self, sample_rate):
+        return AdpcmEncoder()
+
+    def encode(self, pcm):
+        return AdpcmEncoder().encode(pcm)
+
+    def decode(self, data):
+        return adpcm_decode(data)
+
+
+# Opus
+OPUS_FRAME_MS = 20
+OPUS_LENGTH = struct.Struct('<H')
+
+
+class OpusEncoder:
+    """Encodes 20 ms frames, padding the last one of a chunk with silence."""
+
+    def __init__(self, sample_rate):
+        self.frame_samples = sample_rate * OPUS_FRAME_MS // 1000
+        self.encoder = opuslib.Encoder(sample_rate, 1, opuslib.APPLICATION_VOIP)
+
+    def encode(self, pcm):
+        samples = whole_samples(pcm)
+        frame_bytes = self.frame_samples * 2
+        packets = []
+        for i in range(0, len(samples), frame_bytes):
+            frame = bytes(samples[i:i + frame_bytes]).ljust(frame_bytes, b'\0')
+            packet = self.encoder.encode(frame, self.frame_samples)
+            packets.append(OPUS_LENGTH.pack(len(packet)))
+            packets.append(packet)
+        return b''.join(packets)
+
+
+class OpusDecoder:
+    def __init__(self, sample_rate):
+        self.frame_samples = sample_rate * OPUS_FRAME_MS // 1000
+        self.decoder = opuslib.Decoder(sample_rate, 1)
+
+    def decode(self, data):
+        data = bytes(data)
+        frames = []
+        offset = 0
+        while offset + OPUS_LENGTH.size <= len(data):
+            (length,) = OPUS_LENGTH.unpack_from(data, offset)
+            offset += OPUS_LENGTH.size
+            frames.append(self.decoder.decode(data[offset:offset + length], self.frame_samples))
+            offset += length
+        return b''.join(frames)
+
+
+class OpusCodec(Codec):
+    """Opus through opuslib, with an encoder and decoder per connection."""
+
+    name = "opus"
+    mime_type = "audio/opus"
+    frame_type = FRAME_AUDIO_OPUS
+    bytes_per_sample = None
+
+    def encoder(self, sample_rate):
+        return OpusEncoder(sample_rate)
+
+    def decoder(self, sample_rate):
+        return OpusDecoder(sample_rate)
+
+
+PCM = Codec()
+CODECS = {codec.name: codec for codec in (PCM, MuLawCodec(), AdpcmCodec())}
+if opuslib is not None:
+    CODECS[OpusCodec.name] = OpusCodec()
+MIME_TYPES = {codec.mime_type: codec for codec in CODECS.values()}
+FRAME_TYPES = {codec.frame_type: codec for codec in CODECS.values()}
+
+
+def negotiate(offer):
+    """The first codec of a comma-separated list that is supported, PCM if none."""
+    for name in (offer or "").split(","):
+        codec = CODECS.get(name.strip().lower())
+        if codec is not None and codec.negotiable:
+            return codec
+    return PCM
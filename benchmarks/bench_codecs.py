@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""CPU cost, bytes saved and watermark survivability of the audio codecs.
+
+Speech-like test audio (harmonics of a wandering pitch, in syllable-length
+bursts, over a little noise) is encoded and decoded in 100 ms chunks, as
+it streams, at the agent's 24 kHz and the mic's 16 kHz. For each codec
+this reports the CPU time per second of audio, the bytes on the wire
+against PCM, raw and base64 encoded as SSE sends them, and the
+signal-to-noise ratio of the round trip.
+
+With ``--backend`` the agent audio is also watermarked, sent through each
+codec and decoded again, to see whether the message survives. Only the
+local and docker backends give a real answer: the null and fake backends
+are stand-ins for audiowmark and don't share its robustness.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_codecs --backend local
+"""
+
+import argparse
+import base64
+import math
+import random
+import time
+
+from array import array
+
+import audio_codecs
+from watermark import AGENT_SAMPLE_RATE, USER_SAMPLE_RATE, WATERMARK_MESSAGES
+from watermark_backends import NullBackend, create_backend, set_backend
+
+CHUNK_MS = 100
+
+
+def speech_like(seconds, sample_rate, seed=0):
+    """16-bit PCM with roughly the level, spectrum and pauses of speech."""
+    rng = random.Random(seed)
+    samples = array('h')
+    phase = 0.0
+    pitch = 140.0
+    for i in range(int(seconds * sample_rate)):
+        t = i / sample_rate
+        pitch = min(max(pitch + rng.gauss(0, 0.05), 90.0), 250.0)
+        phase += 2 * math.pi * pitch / sample_rate
+        envelope = max(math.sin(2 * math.pi * 3.5 * t), 0.0)  # ~7 syllables a second
+        voice = sum(math.sin(k * phase) / k for k in range(1, 8))
+        value = 6000 * envelope * voice + rng.gauss(0, 150)
+        samples.append(int(min(max(value, -32768), 32767)))
+    return samples.tobytes()
+
+
+def chunks(pcm, sample_rate):
+    size = sample_rate * CHUNK_MS // 1000 * 2
+    return [pcm[i:i + size] for i in range(0, len(pcm), size)]
+
+
+def snr(reference, decoded):
+    """Signal-to-noise ratio in dB, over the samples both have."""
+    reference = memoryview(reference).cast('h')
+    decoded = memoryview(decoded).cast('h')
+    count = min(len(reference), len(decoded))
+    signal = sum(reference[i] ** 2 for i in range(count))
+    noise = sum((reference[i] - decoded[i]) ** 2 for i in range(count))
+    return math.inf if not noise else 10 * math.log10(signal / noise)
+
+
+def round_trip(codec, pcm, sample_rate):
+    """Encode and decode chunk by chunk. Returns (encoded chunks, decoded PCM, encode s, decode s)."""
+    encoder = codec.encoder(sample_rate)
+    decoder = codec.decoder(sample_rate)
+    start = time.perf_counter()
+    encoded = [encoder.encode(chunk) for chunk in chunks(pcm, sample_rate)]
+    encoded_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    decoded = b''.join(bytes(decoder.decode(data)) for data in encoded)
+    return encoded, decoded, encoded_seconds, time.perf_counter() - start
+
+
+def survives(codec, watermarked, message):
+    """Whether the message is still detected after the codec, or why not."""
+    from watermark import detect_watermark_pcm
+
+    _, decoded, _, _ = round_trip(codec, watermarked, AGENT_SAMPLE_RATE)
+    detection = detect_watermark_pcm(decoded)
+    if detection is None:
+        return "lost"
+    if detection.hex != message:
+        return f"wrong ({detection.hex[:8]}...)"
+    return f"yes ({detection.confidence:.2f})"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=10.0, help="of test audio per direction")
+    parser.add_argument("--codecs", nargs="*", default=list(audio_codecs.CODECS))
+    parser.add_argument("--backend", help="watermark backend to test survivability with, e.g. local or docker")
+    args = parser.parse_args()
+
+    audio = {
+        "agent": (speech_like(args.seconds, AGENT_SAMPLE_RATE), AGENT_SAMPLE_RATE),
+        "user": (speech_like(args.seconds, USER_SAMPLE_RATE, seed=1), USER_SAMPLE_RATE),
+    }
+    missing = [name for name in args.codecs if name not in audio_codecs.CODECS]
+    if missing:
+        print(f"Not available here: {', '.join(missing)} (Opus needs opuslib)")
+
+    print(f"{args.seconds:g} s per direction in {CHUNK_MS} ms chunks, "
+          f"{'numpy' if audio_codecs.np is not None else 'stdlib'}")
+    print(f"{'codec':6} {'audio':6} {'encode':>10} {'decode':>10} {'bytes':>9} {'vs pcm':>7} {'base64':>9} {'snr':>8}")
+    for name in args.codecs:
+        codec = audio_codecs.CODECS.get(name)
+        if codec is None:
+            continue
+        for direction, (pcm, sample_rate) in audio.items():
+            encoded, decoded, encode_seconds, decode_seconds = round_trip(codec, pcm, sample_rate)
+            size = sum(len(data) for data in encoded)
+            base64_size = sum(len(base64.b64encode(data)) for data in encoded)
+            print(
+                f"{name:6} {direction:6} "
+                f"{encode_seconds / args.seconds * 1000:7.2f}ms/s {decode_seconds / args.seconds * 1000:7.2f}ms/s "
+                f"{size:9} {size / len(pcm):6.0%} {base64_size:9} {snr(pcm, decoded):6.1f}dB"
+            )
+
+    if not args.backend:
+        return
+    backend = create_backend(args.backend)
+    set_backend(backend)
+    from watermark import add_watermark_pcm
+
+    message = WATERMARK_MESSAGES[0]
+    pcm, _ = audio["agent"]
+    watermarked = add_watermark_pcm(pcm, message)
+    if watermarked is None:
+        print(f"\nWatermarking with the {backend.name} backend failed")
+        return
+    watermarked = bytes(watermarked)
+    print(f"\nWatermark survivability, {backend.name} backend")
+    if isinstance(backend, NullBackend):
+        print(f"(the {backend.name} backend is a stand-in, use local or docker for audiowmark's answer)")
+    for name in args.codecs:
+        codec = audio_codecs.CODECS.get(name)
+        if codec is not None:
+            print(f"{name:6} {survives(codec, watermarked, message)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""Benchmark of buffering a turn of agent audio against the original list and join.
+
+Covers what happens to a turn between the live API and the client: buffer
+the chunks, wrap them in a WAV file for audiowmark, take the PCM back out
+of the output and cut it into messages. The null backend stands in for
+audiowmark. Allocations are counted with tracemalloc in a separate pass.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_ringbuffer
+"""
+
+import argparse
+import os
+import time
+import tracemalloc
+
+from ringbuffer import PCMRingBuffer
+from watermark import AGENT_SAMPLE_RATE, WAV_HEADER_SIZE, pcm_to_wav, wav_to_pcm
+from watermark_backends import NullBackend
+
+MESSAGE_BYTES = 11520  # audio_messages chunk size
+
+
+def legacy_turn(backend, chunks):
+    """The original path: list of chunks, join, header concatenation, copy out, slice."""
+    buffered = []
+    for chunk in chunks:
+        buffered.append(chunk)
+    combined = b''.join(buffered)
+    wav = backend.add_wav(pcm_to_wav(combined), "benchmark", 20)
+    pcm = bytes(wav_to_pcm(wav))
+    return sum(len(pcm[i:i + MESSAGE_BYTES]) for i in range(0, len(pcm), MESSAGE_BYTES))
+
+
+def ring_turn(backend, ring, chunks):
+    """The ring buffer path: copy in once, header in the headroom, memoryview chunks."""
+    for chunk in chunks:
+        ring.append(chunk)
+    wav = backend.add_wav(pcm_to_wav(ring), "benchmark", 20)
+    pcm = wav_to_pcm(wav)
+    sent = sum(len(pcm[i:i + MESSAGE_BYTES]) for i in range(0, len(pcm), MESSAGE_BYTES))
+    ring.clear()
+    return sent
+
+
+def best_of(repeat, func):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def peak_allocated(func):
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=20.0, help="agent audio per turn")
+    parser.add_argument("--chunk-bytes", type=int, default=9600, help="size of live API audio chunks")
+    parser.add_argument("--turns", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    turn_bytes = int(args.seconds * AGENT_SAMPLE_RATE) * 2
+    chunks = [os.urandom(args.chunk_bytes) for _ in range(turn_bytes // args.chunk_bytes)]
+    backend = NullBackend()
+    # Sized like a session's buffer: it grows during the first turn and is reused after that
+    ring = PCMRingBuffer(2 * AGENT_SAMPLE_RATE * 2, headroom=WAV_HEADER_SIZE)
+    assert legacy_turn(backend, chunks) == ring_turn(backend, ring, chunks)
+
+    candidates = {
+        "legacy list + join + slices": lambda: legacy_turn(backend, chunks),
+        "PCMRingBuffer + memoryviews": lambda: ring_turn(backend, ring, chunks),
+    }
+    print(f"{args.turns} turns of {args.seconds:g} s in {len(chunks)} chunks of {args.chunk_bytes} bytes")
+    for name, func in candidates.items():
+        elapsed = best_of(args.repeat, lambda: [func() for _ in range(args.turns)])
+        peak = peak_allocated(func)
+        print(f"{name:30} {elapsed / args.turns * 1e3:8.2f} ms/turn  {peak / 2**20:7.2f} MB peak allocated")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""Benchmark of quality scoring on long transcripts against the original function.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_scoring
+"""
+
+import argparse
+import random
+import time
+
+from scoring import BUZZWORDS, QualityScorer
+
+
+def legacy_scores(user_input, agent_response):
+    """The original calculate_quality_scores from main.py."""
+    scores = {}
+    response_length = len(agent_response.split())
+    scores["response_length"] = min(response_length / 20.0, 1.0)
+    buzzwords = ["synergize", "leverage", "optimize", "streamline", "deliverables", "strategic", "value-added", "robust", "collaborative", "facilitate"]
+    buzzword_count = sum(1 for word in buzzwords if word.lower() in agent_response.lower())
+    scores["corporate_buzzword_score"] = min(buzzword_count / 3.0, 1.0)
+    has_question = "?" in user_input
+    agent_asks_back = "?" in agent_response
+    scores["engagement_score"] = 1.0 if (has_question and len(agent_response) > 10) or agent_asks_back else 0.5
+    return scores
+
+
+FILLER = ("we", "should", "align", "on", "the", "roadmap", "going", "forward", "circle", "back", "team", "quarter")
+
+
+def transcript(rng, words):
+    vocabulary = FILLER * 8 + tuple(word.title() for word in BUZZWORDS)
+    return " ".join(rng.choice(vocabulary) for _ in range(words)) + rng.choice((".", "?"))
+
+
+def partials(rng, response):
+    """Split a response at random points, like partial texts from the live API."""
+    cuts = sorted(rng.sample(range(1, len(response)), min(len(response) - 1, len(response) // 12)))
+    return [response[start:end] for start, end in zip([0] + cuts, cuts + [len(response)])]
+
+
+def best_of(repeat, func):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--words", type=int, default=2000, help="words per transcript")
+    parser.add_argument("--transcripts", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    transcripts = [(rng.choice(("Any news?", "Hello")), transcript(rng, args.words)) for _ in range(args.transcripts)]
+    streams = [(user_input, partials(rng, response)) for user_input, response in transcripts]
+    scorer = QualityScorer()
+
+    def streamed():
+        for user_input, parts in streams:
+            state = scorer.new_state(user_input)
+            for part in parts:
+                state.feed(part)
+            state.scores()
+
+    def legacy_streamed():
+        # The original joins the partials at the end of the turn, then scores
+        for user_input, parts in streams:
+            legacy_scores(user_input, "".join(parts))
+
+    for (user_input, response), (_, parts) in zip(transcripts, streams):
+        expected = legacy_scores(user_input, response)
+        assert scorer.score(user_input, response) == expected
+        state = scorer.new_state(user_input)
+        for part in parts:
+            state.feed(part)
+        assert state.scores() == expected
+
+    candidates = {
+        "legacy, whole response": lambda: [legacy_scores(*pair) for pair in transcripts],
+        "QualityScorer.score_many": lambda: scorer.score_many(transcripts),
+        "legacy, join partials at turn end": legacy_streamed,
+        "ScoreState.feed per partial": streamed,
+    }
+    partial_count = sum(len(parts) for _, parts in streams) // len(streams)
+    print(f"{args.transcripts} transcripts of {args.words} words, {partial_count} partials each")
+    for name, func in candidates.items():
+        elapsed = best_of(args.repeat, func)
+        print(f"{name:36} {elapsed / args.transcripts * 1e6:9.1f} us/transcript")
+    # What is left to do once turn_complete arrives
+    state = scorer.new_state(transcripts[0][0])
+    for part in streams[0][1]:
+        state.feed(part)
+    at_turn_end = best_of(args.repeat, lambda: [state.scores() for _ in range(1000)]) / 1000
+    legacy_at_turn_end = best_of(args.repeat, lambda: legacy_scores(transcripts[0][0], "".join(streams[0][1])))
+    print(f"{'at turn_complete: legacy':36} {legacy_at_turn_end * 1e6:9.1f} us")
+    print(f"{'at turn_complete: streaming':36} {at_turn_end * 1e6:9.1f} us")
+
+
+if __name__ == "__main__":
+    main()
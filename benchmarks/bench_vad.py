@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""Micro-benchmark of the VAD energy computation against the original /send code.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_vad
+"""
+
+import argparse
+import os
+import struct
+import timeit
+
+import vad
+
+
+def legacy_rms(decoded_data):
+    """The original per-sample RMS from send_message_endpoint."""
+    samples = struct.unpack(f'<{len(decoded_data)//2}h', decoded_data)
+    return (sum(s*s for s in samples) / len(samples)) ** 0.5
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunk-ms", type=int, default=200, help="upload size in ms of 16kHz audio")
+    parser.add_argument("--number", type=int, default=2000)
+    args = parser.parse_args()
+
+    chunk = os.urandom(args.chunk_ms * 32)
+    assert abs(legacy_rms(chunk) - vad.frame_rms(chunk)) < 1e-6 * legacy_rms(chunk)
+
+    detector = vad.EnergyVAD()
+    state = detector.new_state()
+    candidates = {
+        "legacy struct + generator": lambda: legacy_rms(chunk),
+        f"frame_rms ({'numpy' if vad.np is not None else 'stdlib'})": lambda: vad.frame_rms(chunk),
+        "EnergyVAD.process": lambda: detector.process(state, chunk),
+    }
+    print(f"{args.chunk_ms} ms chunks ({len(chunk)} bytes), {args.number} runs")
+    baseline = None
+    for name, func in candidates.items():
+        per_call = min(timeit.repeat(func, number=args.number, repeat=3)) / args.number
+        baseline = baseline or per_call
+        print(f"{name:32} {per_call * 1e6:9.1f} us/chunk  {baseline / per_call:6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
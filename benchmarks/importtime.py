@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""Import and startup time of the app, in a fresh interpreter per run.
+
+Each run imports the module under ``python -X importtime`` in a new
+process and, with ``--startup``, also runs the app's lifespan startup. The
+best of ``--runs`` is reported, with the slowest imports from the
+``-X importtime`` report of that run and whether any of the ``--forbid``
+packages were imported. They are only meant to be imported when a session
+or an export needs them.
+
+Run from the repository root:
+
+    python -m benchmarks.importtime --startup
+
+Use ``--save`` to record a baseline and ``--baseline`` to compare against
+one. The exit status is 1 if a time regressed by more than
+``--tolerance`` or a forbidden package was imported.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+FORBIDDEN = ("google.adk", "langfuse")
+
+# Runs in the child: import the module, then optionally go through the lifespan startup
+MARKER = "-- imported --"
+CHILD = """
+import asyncio, json, sys, time
+start = time.perf_counter()
+module = __import__({module!r})
+imported = time.perf_counter() - start
+print({marker!r}, file=sys.stderr, flush=True)
+started = None
+if {startup!r}:
+    async def startup():
+        async with module.lifespan(module.app):
+            return time.perf_counter() - start
+    started = asyncio.run(startup())
+print(json.dumps({{"import_seconds": imported, "startup_seconds": started}}))
+"""
+
+
+def parse_importtime(lines):
+    """Yield (module, self seconds, cumulative seconds, depth) from -X importtime report lines."""
+    for line in lines:
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue  # The header line
+        name = fields[2].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        yield name.strip(), int(fields[0]) / 1e6, int(fields[1]) / 1e6, depth
+
+
+def run_once(module, startup):
+    env = {
+        **os.environ,
+        "WATERMARK_BACKEND": "null",
+        "TELEMETRY_EXPORTER": "none",
+        "PYTHONDONTWRITEBYTECODE": "1",
+    }
+    env.setdefault("GOOGLE_API_KEY", "offline")  # Lets the startup create a model client, never used
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", CHILD.format(module=module, startup=startup, marker=MARKER)],
+        capture_output=True, text=True, env=env,
+    )
+    if result.returncode:
+        sys.exit(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    # Modules imported by the import itself, and then by the startup
+    lines = result.stderr.splitlines()
+    split = lines.index(MARKER)
+    return timings, list(parse_importtime(lines[:split])), list(parse_importtime(lines[split + 1:]))
+
+
+def regressions(report, baseline, tolerance):
+    for name, value in report.items():
+        expected = baseline.get(name)
+        if not isinstance(value, float) or not expected:
+            continue
+        if value > expected * (1 + tolerance):
+            yield name, value, expected
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--startup", action="store_true", help="also time the app lifespan startup")
+    parser.add_argument("--top", type=int, default=15, help="slowest imports to list")
+    parser.add_argument("--forbid", nargs="*", default=FORBIDDEN, help="packages the import must not pull in")
+    parser.add_argument("--save", help="write the report as JSON to this file")
+    parser.add_argument("--baseline", help="compare with a report saved with --save")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="allowed relative regression")
+    args = parser.parse_args()
+
+    # A first run fills the bytecode caches, so the runs compare like for like
+    run_once(args.module, False)
+    timings, imports, startup_imports = min((run_once(args.module, args.startup) for _ in range(args.runs)),
+                           key=lambda run: run[0]["import_seconds"])
+
+    print(f"python -X importtime -c 'import {args.module}', best of {args.runs}")
+    print(f"{'cumulative':>10} {'self':>8}  module")
+    for name, own, cumulative, depth in sorted(imports, key=lambda entry: -entry[2])[:args.top]:
+        print(f"{cumulative * 1000:8.1f}ms {own * 1000:6.1f}ms  {'  ' * depth}{name}")
+
+    names = [name for name, *_ in imports]
+    forbidden = [
+        package for package in args.forbid
+        if any(name == package or name.startswith(package + ".") for name in names)
+    ]
+    report = {
+        "import_seconds": timings["import_seconds"],
+        "startup_seconds": timings["startup_seconds"],
+        "modules": len(imports),
+        "startup_modules": len(startup_imports) if args.startup else None,
+    }
+    print()
+    for name, value in report.items():
+        if value is not None:
+            print(f"{name:20} {value:.4f}" if isinstance(value, float) else f"{name:20} {value}")
+    print(f"{'forbidden imported':20} {', '.join(forbidden) or 'none'}")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+    failed = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        failed = list(regressions(report, baseline, args.tolerance))
+        for name, value, expected in failed:
+            print(f"REGRESSION {name}: {value:.4f} vs baseline {expected:.4f}")
+        if not failed:
+            print(f"No regression beyond {args.tolerance:.0%} of the baseline")
+    if failed or forbidden:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""Offline load test of the streaming pipeline, with no Gemini key or Docker.
+
+Drives N concurrent synthetic clients against the FastAPI app in-process,
+through a minimal ASGI driver. Each client opens an SSE stream, uploads mic
+audio to /send every 200 ms (speech, then silence, so VAD ends utterances
+and detection runs), and asks one question per turn. The agent is a
+FakeLiveSession and watermarking uses the fake backend, whose toy mark
+tells apart the sessions' identical turns, with a configurable latency.
+
+Run from the repository root:
+
+    python -m benchmarks.loadgen --sessions 20 --turns 3
+
+It reports time to first audio and turn latency percentiles, how long a
+client playing the audio as it arrives would stall per turn, uploads/s,
+and CPU and RSS per session. Use ``--save`` to record a baseline and
+``--baseline`` to compare against one. The exit status is 1 if a metric
+regressed by more than ``--tolerance``, so the run can gate CI.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import sys
+import time
+
+# Lower is better for every metric except these
+HIGHER_IS_BETTER = {"uploads_per_s"}
+AUDIO_EVENT = b'data: {"mime_type": "audio/pcm", "data": "'
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def rss_bytes():
+    """Current resident set size, from /proc where available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class ASGIClient:
+    """Calls an ASGI app directly: no sockets, no server."""
+
+    def __init__(self, app):
+        self.app = app
+
+    @staticmethod
+    def scope(method, path, query=b"", headers=()):
+        return {
+            "type": "http",
+            "asgi": {"version": "3.0", "spec_version": "2.3"},
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": query,
+            "root_path": "",
+            "headers": [(name.lower().encode(), value.encode()) for name, value in headers],
+            "client": ("127.0.0.1", 50000),
+            "server": ("testserver", 80),
+        }
+
+    async def request(self, method, path, body=b"", headers=()):
+        """Send a request and return the status and response body."""
+        sent = False
+        done = asyncio.Event()
+        status = None
+        chunks = []
+
+        async def receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await done.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        await self.app(self.scope(method, path, headers=headers), receive, send)
+        done.set()
+        return status, b"".join(chunks)
+
+    async def stream(self, path, query, on_chunk, disconnect):
+        """Stream a GET response into ``on_chunk`` until ``disconnect`` is set."""
+        async def receive():
+            await disconnect.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.body" and message.get("body"):
+                on_chunk(message["body"])
+
+        await self.app(self.scope("GET", path, query), receive, send)
+
+
+class Results:
+    def __init__(self):
+        self.ttfa = []
+        self.turns = []
+        self.stalls = []
+        self.uploads = 0
+        self.upload_errors = 0
+
+
+async def run_client(main, client, user_id, args, results, speech, silence):
+    audio_events = asyncio.Queue()
+    disconnect = asyncio.Event()
+
+    def on_chunk(body):
+        now = time.perf_counter()
+        for event in body.split(b"\n\n"):
+            # Classify without parsing the JSON, to keep the client's own CPU out of the numbers
+            if event.startswith(AUDIO_EVENT):
+                # 24 kHz 16-bit PCM, base64 encoded, followed by '"}'
+                seconds = (len(event) - len(AUDIO_EVENT) - 2) * 3 / 4 / 2 / 24000
+                audio_events.put_nowait((now, seconds))
+            elif b'"turn_complete": true' in event:
+                audio_events.put_nowait((now, None))
+
+    sse = asyncio.create_task(client.stream(f"/events/{user_id}", b"is_audio=true", on_chunk, disconnect))
+    while main.sessions.get(str(user_id)) is None:
+        await asyncio.sleep(0.005)
+
+    async def upload():
+        pcm_headers = [("content-type", "application/octet-stream")]
+        i = 0
+        while True:
+            chunk = speech if i % 15 < 10 else silence  # 2 s of speech, then 1 s of silence
+            status, _ = await client.request("POST", f"/send/{user_id}", chunk, pcm_headers)
+            if status == 200:
+                results.uploads += 1
+            else:
+                results.upload_errors += 1
+            i += 1
+            await asyncio.sleep(args.upload_interval_ms / 1000)
+
+    uploader = asyncio.create_task(upload())
+    question = json.dumps({"mime_type": "text/plain", "data": "How is the roadmap going?"}).encode()
+    try:
+        for _ in range(args.turns):
+            start = time.perf_counter()
+            await client.request("POST", f"/send/{user_id}", question, [("content-type", "application/json")])
+            first_audio = None
+            # When the audio received so far has played out, and how long playback waited for more
+            played_until = None
+            stall = 0.0
+            while True:
+                now, seconds = await audio_events.get()
+                if seconds is None:
+                    break
+                if first_audio is None:
+                    first_audio = played_until = now
+                stall += max(now - played_until, 0.0)
+                played_until = max(played_until, now) + seconds
+            if first_audio is not None:
+                results.ttfa.append(first_audio - start)
+                results.stalls.append(stall)
+            results.turns.append(now - start)
+    finally:
+        uploader.cancel()
+        disconnect.set()
+        await asyncio.gather(sse, return_exceptions=True)
+
+
+async def run(main, args):
+    from fake_live import fake_agent_sessions, synthetic_speech
+
+    main.start_agent_session = fake_agent_sessions(
+        turn_seconds=args.turn_seconds, reply_delay=args.reply_delay, speed=args.speed,
+    )
+    client = ASGIClient(main.app)
+    results = Results()
+    samples_per_upload = 16 * args.upload_interval_ms
+    speech = synthetic_speech(args.upload_interval_ms / 1000, 16000, 180.0)
+    silence = bytes(samples_per_upload * 2)
+
+    async with main.lifespan(main.app):
+        rss_before = rss_bytes()
+        rss_peak = rss_before
+
+        async def sample_rss():
+            nonlocal rss_peak
+            while True:
+                await asyncio.sleep(0.1)
+                rss_peak = max(rss_peak, rss_bytes())
+
+        sampler = asyncio.create_task(sample_rss())
+        cpu_start = time.process_time()
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            run_client(main, client, 1000 + i, args, results, speech, silence) for i in range(args.sessions)
+        ))
+        elapsed = time.perf_counter() - start
+        cpu = time.process_time() - cpu_start
+        sampler.cancel()
+
+    return {
+        "ttfa_p50": percentile(results.ttfa, 0.5),
+        "ttfa_p95": percentile(results.ttfa, 0.95),
+        "turn_p50": percentile(results.turns, 0.5),
+        "turn_p95": percentile(results.turns, 0.95),
+        "turn_p99": percentile(results.turns, 0.99),
+        "stall_p50": percentile(results.stalls, 0.5),
+        "stall_p95": percentile(results.stalls, 0.95),
+        "uploads_per_s": results.uploads / elapsed,
+        "upload_errors": results.upload_errors,
+        "cpu_per_session": cpu / args.sessions,
+        "rss_per_session_mb": (rss_peak - rss_before) / args.sessions / 2**20,
+    }
+
+
+def regressions(report, baseline, tolerance):
+    for name, value in report.items():
+        expected = baseline.get(name)
+        if value is None or not expected or name == "upload_errors":
+            continue
+        if name in HIGHER_IS_BETTER:
+            if value < expected * (1 - tolerance):
+                yield name, value, expected
+        elif value > expected * (1 + tolerance):
+            yield name, value, expected
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--turn-seconds", type=float, default=3.0, help="agent audio per turn")
+    parser.add_argument("--reply-delay", type=float, default=0.3, help="agent think time before a turn")
+    parser.add_argument("--speed", type=float, default=1.0, help="agent pacing, 1 is real time and 0 is unpaced")
+    parser.add_argument("--upload-interval-ms", type=int, default=200)
+    parser.add_argument("--watermark-latency", type=float, default=0.05, help="seconds per stub watermark call")
+    parser.add_argument("--mode", choices=("turn", "stream"), default="turn", help="WATERMARK_MODE")
+    parser.add_argument("--save", help="write the report as JSON to this file")
+    parser.add_argument("--baseline", help="compare with a report saved with --save")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    args = parser.parse_args()
+
+    # Configure the app before importing it: the stub backend, no telemetry export, quiet logs
+    os.environ["WATERMARK_BACKEND"] = "fake"
+    os.environ["WATERMARK_NULL_LATENCY"] = str(args.watermark_latency)
+    os.environ["WATERMARK_MODE"] = args.mode
+    os.environ["TELEMETRY_EXPORTER"] = "none"
+    os.environ.setdefault("GOOGLE_API_KEY", "offline")  # Never used: the live session is fake
+    import main as app_main
+
+    report = asyncio.run(run(app_main, args))
+    print(f"{args.sessions} sessions x {args.turns} turns, {args.mode} mode, "
+          f"{args.watermark_latency * 1000:.0f} ms watermark latency")
+    for name, value in report.items():
+        print(f"{name:20} {value:.4f}" if isinstance(value, float) else f"{name:20} {value}")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        failed = list(regressions(report, baseline, args.tolerance))
+        for name, value, expected in failed:
+            print(f"REGRESSION {name}: {value:.4f} vs baseline {expected:.4f}")
+        if failed:
+            sys.exit(1)
+        print(f"No regression beyond {args.tolerance:.0%} of the baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""Deterministic replay of a capture log through the app, offline.
+
+Each captured session is opened again on /events. Its agent's live events
+are fed back from the log by a stand-in for the live session, and its
+user's text and audio are posted to /send, all at their recorded times
+divided by ``--speed``. 1 replays in real time and 0 as fast as the app
+takes it. Watermark embeds and detections are answered from the log by the
+``recorded`` backend, keyed by a digest of the audio. Audio the log has no
+answer for is handled like the null backend does. ``--backend`` can run a
+real backend on the captured audio instead.
+
+Replays are deterministic. The app is configured to cut agent audio the way
+the captured one did, and watermark jobs queue instead of being skipped when
+the service is saturated. At speed 0, each upload also waits for the
+detection windows it started, so no window is skipped for being late. The
+report includes a digest of the audio and text sent to each client. When
+it differs from the baseline's, the app's output changed.
+
+Run from the repository root, on a log written with CAPTURE_PATH:
+
+    python -m benchmarks.replay capture.log --speed 0 --save before.json
+    python -m benchmarks.replay capture.log --speed 0 --baseline before.json
+
+It reports turn latency percentiles, wall and CPU time, the pipeline's
+stage times and whether the detections match the captured ones. The exit
+status is 1 if a time regressed by more than ``--tolerance`` or the output
+changed.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import struct
+import subprocess
+import sys
+import time
+
+from collections import deque
+from benchmarks.loadgen import ASGIClient, percentile
+from capture import (
+    AGENT_AUDIO, AGENT_TEXT, CLOSE, DETECT, DETECTION, DIGEST_BYTES, EMBED, INTERRUPTED, OPEN, PARTIAL,
+    TURN_COMPLETE, TURN_END, USER_AUDIO, USER_TEXT, CaptureLog, audio_digest,
+)
+from fake_live import Event, FakeLiveRequestQueue, audio_event, text_event
+from watermark import pcm_to_wav, wav_to_pcm
+from watermark_backends import NullBackend
+
+# Times where lower is better, compared with the baseline
+TIMINGS = ("wall_seconds", "cpu_seconds", "turn_p50", "turn_p95")
+
+
+class RecordedBackend(NullBackend):
+    """Answers audiowmark calls with the results captured for the same audio."""
+
+    name = "recorded"
+
+    def __init__(self, log):
+        super().__init__()
+        self.embeds = {}
+        self.detections = {}
+        for record in log:
+            if record.kind == EMBED:
+                self.embeds[bytes(record.payload[:DIGEST_BYTES])] = record.payload[DIGEST_BYTES:]
+            elif record.kind == DETECT:
+                self.detections[bytes(record.payload[:DIGEST_BYTES])] = record.payload[DIGEST_BYTES:]
+        self.stats = {"hits": 0, "misses": 0}
+
+    def close(self):
+        self.embeds.clear()
+        self.detections.clear()
+
+    def add_wav(self, wav, message, strength):
+        watermarked = self.embeds.get(audio_digest(wav_to_pcm(wav)))
+        if watermarked is None:
+            self.stats["misses"] += 1
+            return super().add_wav(wav, message, strength)
+        self.stats["hits"] += 1
+        sample_rate, = struct.unpack_from('<I', wav, 24)
+        return pcm_to_wav(watermarked, sample_rate)
+
+    def get_wav(self, wav):
+        result = self.detections.get(audio_digest(wav_to_pcm(wav)))
+        if result is None:
+            self.stats["misses"] += 1
+            return super().get_wav(wav)
+        self.stats["hits"] += 1
+        stdout = ""
+        if result:
+            detection = json.loads(bytes(result))
+            stdout = f"pattern  all {detection['hex']} {detection['confidence']:.3f} 0.000 ALL\n"
+        return subprocess.CompletedProcess(['recorded', 'get'], 0, stdout=stdout, stderr="")
+
+
+class RecordedLiveSession:
+    """Stands in for a captured session's live session: yields the events the replay feeds it."""
+
+    def __init__(self):
+        self.queue = FakeLiveRequestQueue()
+        self.pending = asyncio.Queue()
+
+    async def events(self):
+        while True:
+            event = await self.pending.get()
+            if event is None:
+                return
+            yield event
+
+
+def live_event(record):
+    """The live event a record was captured from, with the fields main.py reads."""
+    if record.kind == AGENT_TEXT:
+        return text_event(bytes(record.payload).decode(), partial=bool(record.flags & PARTIAL))
+    if record.kind == AGENT_AUDIO:
+        # A copy: the pipeline may hold on to the audio after the log is gone
+        return audio_event(bytes(record.payload))
+    return Event(turn_complete=bool(record.flags & TURN_COMPLETE), interrupted=bool(record.flags & INTERRUPTED))
+
+
+class SessionResult:
+    def __init__(self):
+        self.digest = hashlib.blake2b(digest_size=16)
+        self.turn_starts = deque()  # When the first event of each turn not yet complete was fed
+        self.in_turn = False
+        self.turns = []
+        self.detections = []
+
+
+class Replayer:
+    """Replays the sessions of a capture log against the app in this process."""
+
+    def __init__(self, main, log, speed=0.0):
+        self.main = main
+        self.log = log
+        self.speed = speed
+        self.client = ASGIClient(main.app)
+        self.models = {}
+        self.results = {}
+        self.start = None
+
+    async def start_agent_session(self, user_id, is_audio=False):
+        model = self.models[user_id]
+        return model.events(), model.queue
+
+    async def wait_until(self, recorded_time):
+        if self.speed:
+            delay = self.start + recorded_time / self.speed - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    async def settle(self):
+        """Wait for the detection windows scheduled so far."""
+        tasks = self.main.detector.tasks
+        while tasks:
+            await asyncio.gather(*list(tasks), return_exceptions=True)
+
+    async def run(self):
+        self.main.start_agent_session = self.start_agent_session
+        self.start = time.perf_counter()
+        sessions = self.log.sessions()
+        await asyncio.gather(*(
+            self.replay_session(number, records) for number, records in sessions.items() if records[0].kind == OPEN
+        ))
+
+    async def replay_session(self, number, records):
+        opened = records[0].json()
+        user_id = str(1000 + number)
+        model = self.models[user_id] = RecordedLiveSession()
+        result = self.results[number] = SessionResult()
+        await self.wait_until(records[0].time)
+
+        def on_chunk(body):
+            now = time.perf_counter()
+            for line in body.split(b"\n\n"):
+                if not line.startswith(b"data: "):
+                    continue
+                message = json.loads(line[6:])
+                if "mime_type" in message:
+                    result.digest.update(line)
+                elif message.get("watermark_detected"):
+                    result.detections.append((message["hex"], round(message["offset"], 2)))
+                elif "turn_complete" in message and result.turn_starts:
+                    result.turns.append(now - result.turn_starts.popleft())
+
+        query = f"is_audio={'true' if opened['is_audio'] else 'false'}"
+        if opened["codec"] != "pcm":
+            query += f"&codecs={opened['codec']}"
+        disconnect = asyncio.Event()
+        sse = asyncio.create_task(self.client.stream(f"/events/{user_id}", query.encode(), on_chunk, disconnect))
+        while self.main.sessions.get(user_id) is None:
+            await asyncio.sleep(0.001)
+
+        for record in records[1:]:
+            await self.wait_until(record.time)
+            if record.kind in (AGENT_TEXT, AGENT_AUDIO, TURN_END):
+                if not result.in_turn:
+                    result.turn_starts.append(time.perf_counter())
+                result.in_turn = record.kind != TURN_END
+                model.pending.put_nowait(live_event(record))
+            elif record.kind == USER_TEXT:
+                body = json.dumps({"mime_type": "text/plain", "data": bytes(record.payload).decode()}).encode()
+                await self.client.request("POST", f"/send/{user_id}", body, [("content-type", "application/json")])
+            elif record.kind == USER_AUDIO:
+                await self.client.request(
+                    "POST", f"/send/{user_id}", bytes(record.payload), [("content-type", "application/octet-stream")],
+                )
+                if not self.speed:
+                    await self.settle()
+            elif record.kind == CLOSE:
+                break
+        await self.settle()
+        # The end of the live events ends the SSE response
+        model.pending.put_nowait(None)
+        await sse
+        disconnect.set()
+
+    def report(self, cpu_seconds, wall_seconds):
+        turns = [latency for result in self.results.values() for latency in result.turns]
+        digest = hashlib.blake2b(digest_size=16)
+        for number in sorted(self.results):
+            digest.update(self.results[number].digest.digest())
+        captured = sorted(
+            (record.session, record.json()["hex"], round(record.json()["offset"], 2))
+            for record in self.log if record.kind == DETECTION
+        )
+        replayed = sorted(
+            (number, *detection) for number, result in self.results.items() for detection in result.detections
+        )
+        return {
+            "sessions": len(self.results),
+            "turns": len(turns),
+            "wall_seconds": wall_seconds,
+            "cpu_seconds": cpu_seconds,
+            "turn_p50": percentile(turns, 0.5),
+            "turn_p95": percentile(turns, 0.95),
+            "captured_detections": len(captured),
+            "replayed_detections": len(replayed),
+            "detections_match": captured == replayed,
+            "output_digest": digest.hexdigest(),
+        }
+
+
+def configure(meta):
+    """Set up the app's environment like the capturing app's, before it is imported."""
+    os.environ.pop("CAPTURE_PATH", None)
+    os.environ["WATERMARK_BACKEND"] = "null"
+    os.environ["WATERMARK_EXECUTOR"] = "thread"  # The backend has to run in this process
+    os.environ["WATERMARK_SATURATION_POLICY"] = "wait"
+    os.environ["TELEMETRY_EXPORTER"] = "none"
+    os.environ["AGENT_WARM_UP"] = "0"
+    os.environ["WATERMARK_MODE"] = meta["watermark_mode"]
+    # Captures from before the ramp started turns with a full segment
+    os.environ["WATERMARK_FIRST_SEGMENT_SECONDS"] = str(meta.get("first_segment_seconds", meta["segment_seconds"]))
+    os.environ["WATERMARK_SEGMENT_SECONDS"] = str(meta["segment_seconds"])
+    os.environ["WATERMARK_LOOKAHEAD_SECONDS"] = str(meta["lookahead_seconds"])
+    os.environ["WATERMARK_SHARD_SECONDS"] = str(meta["shard_seconds"])
+    if meta["sharded"]:
+        # Only whether there is a secret decides how turns are cut, not the secret itself
+        os.environ["WATERMARK_SECRET"] = "replay"
+    else:
+        os.environ.pop("WATERMARK_SECRET", None)
+    os.environ.setdefault("GOOGLE_API_KEY", "offline")  # Never used: the live session is replayed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("log", help="capture log written with CAPTURE_PATH")
+    parser.add_argument("--speed", type=float, default=0.0, help="1 is real time and 0 is as fast as possible")
+    parser.add_argument("--backend", default="recorded", help="recorded, or a watermark backend to run for real")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stages", type=int, default=10, help="slowest pipeline stages to list")
+    parser.add_argument("--save", help="write the report as JSON to this file")
+    parser.add_argument("--baseline", help="compare with a report saved with --save")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    args = parser.parse_args()
+
+    with CaptureLog(args.log) as log:
+        configure(log.meta)
+        import main as app_main
+        from watermark_backends import create_backend, set_backend
+
+        backend = RecordedBackend(log) if args.backend == "recorded" else create_backend(args.backend)
+        set_backend(backend)
+        random.seed(args.seed)
+        replayer = Replayer(app_main, log, args.speed)
+
+        # Imported by the first upload otherwise, on the clock
+        import google.genai.types  # noqa: F401
+
+        async def run():
+            async with app_main.lifespan(app_main.app):
+                cpu_start = time.process_time()
+                start = time.perf_counter()
+                await replayer.run()
+                return time.process_time() - cpu_start, time.perf_counter() - start
+
+        report = replayer.report(*asyncio.run(run()))
+        # Drops the recorded results, views of the log
+        set_backend(None)
+    print(f"{args.log}: {report['sessions']} sessions, speed {args.speed:g}, {backend.name} backend")
+    if isinstance(backend, RecordedBackend):
+        print(f"recorded watermark results: {backend.stats['hits']} used, {backend.stats['misses']} missing")
+    for name, value in report.items():
+        print(f"{name:20} {value:.4f}" if isinstance(value, float) else f"{name:20} {value}")
+
+    stages = app_main.metrics.registry.stages
+    print(f"\n{'stage':20} {'count':>7} {'total':>9} {'p50':>9} {'p95':>9}")
+    for name, histogram in sorted(stages.items(), key=lambda item: -item[1].sum)[:args.stages]:
+        print(f"{name:20} {histogram.count:7} {histogram.sum:8.3f}s "
+              f"{histogram.quantile(0.5) * 1000:7.2f}ms {histogram.quantile(0.95) * 1000:7.2f}ms")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        failed = False
+        for name in TIMINGS:
+            value, expected = report[name], baseline.get(name)
+            if value is not None and expected and value > expected * (1 + args.tolerance):
+                print(f"REGRESSION {name}: {value:.4f} vs baseline {expected:.4f}")
+                failed = True
+        if report["output_digest"] != baseline.get("output_digest"):
+            print("OUTPUT CHANGED: the audio or text sent to clients differs from the baseline's")
+            failed = True
+        if failed:
+            sys.exit(1)
+        print(f"Same output, no regression beyond {args.tolerance:.0%} of the baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""Capture of live sessions to a binary log, to replay them offline.
+
+With CAPTURE_PATH set, every session opened on /events or /ws is recorded:
+
+- the parts of its live events, with their timing
+- the user's text and audio as they reach the agent, whether they came
+  from /send, /stream or the WebSocket, after codec decoding
+- the detections published to the client
+- every watermark embed and detection the service ran, keyed by a digest
+  of the audio they ran on
+
+``python -m benchmarks.replay`` plays a log back through the app with the
+model and audiowmark answered from the log.
+
+The log is append only, little-endian:
+
+    magic    8 bytes
+    records  float64  seconds since the log was opened
+             uint8    kind
+             uint8    flags
+             uint16   session number in the log, NO_SESSION for watermark calls
+             uint32   payload length
+             payload
+
+The first record is META, with the settings a replay needs to cut audio
+the same way. Audio payloads are raw 16-bit PCM, so a reader that maps the
+file gets them as memoryviews without copying. Other payloads are JSON,
+except that watermark payloads start with the 16-byte BLAKE2b digest of
+the input PCM, followed by the watermarked PCM of an embed or the JSON of a
+detection, empty when nothing was found.
+
+The file is created on the first session and overwritten if it exists.
+With several workers, each writes its own log with its pid in the name.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+
+from typing import NamedTuple
+from ringbuffer import PCMRingBuffer
+from workers import WORKER_COUNT
+
+MAGIC = b'STEGCAP1'
+RECORD = struct.Struct('<dBBHI')
+DIGEST_BYTES = 16
+NO_SESSION = 0xFFFF
+
+# Record kinds
+META = 0
+OPEN = 1
+CLOSE = 2
+AGENT_TEXT = 3
+AGENT_AUDIO = 4
+TURN_END = 5
+USER_TEXT = 6
+USER_AUDIO = 7
+DETECTION = 8
+EMBED = 9
+DETECT = 10
+
+KIND_NAMES = {
+    META: "meta", OPEN: "open", CLOSE: "close", AGENT_TEXT: "agent_text", AGENT_AUDIO: "agent_audio",
+    TURN_END: "turn_end", USER_TEXT: "user_text", USER_AUDIO: "user_audio", DETECTION: "detection",
+    EMBED: "embed", DETECT: "detect",
+}
+
+# Flags
+PARTIAL = 1  # AGENT_TEXT
+TURN_COMPLETE = 1  # TURN_END
+INTERRUPTED = 2  # TURN_END
+
+
+def audio_digest(pcm):
+    """Key of the audio a watermark call ran on."""
+    if isinstance(pcm, PCMRingBuffer):
+        pcm = pcm.view()
+    return hashlib.blake2b(pcm, digest_size=DIGEST_BYTES).digest()
+
+
+def json_payload(value):
+    return json.dumps(value, separators=(",", ":")).encode()
+
+
+class Recorder:
+    """Appends the sessions of this process to a capture log."""
+
+    def __init__(self, path, meta=None):
+        self.path = path
+        self.meta = meta or {}
+        self.file = None
+        self.start = None
+        self.sessions = 0
+        self.stats = {
+            "sessions": 0,
+            "records": 0,
+            "bytes": 0,
+            "embeds": 0,
+            "detects": 0,
+        }
+
+    def open_log(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(self.path, 'wb')
+        self.file.write(MAGIC)
+        self.start = time.perf_counter()
+        self.write(META, NO_SESSION, json_payload({**self.meta, "started_at": time.time(), "pid": os.getpid()}))
+        print(f"Capturing sessions to {self.path}")
+
+    def write(self, kind, session, payload=b'', flags=0):
+        if self.file is None:
+            self.open_log()
+        self.file.write(RECORD.pack(time.perf_counter() - self.start, kind, flags, session, len(payload)))
+        self.file.write(payload)
+        self.stats["records"] += 1
+        self.stats["bytes"] += RECORD.size + len(payload)
+
+    def open(self, user_id, is_audio, codec):
+        """Start recording a session. Returns its number in the log, None once the log is full."""
+        if self.sessions == NO_SESSION:
+            return None
+        session = self.sessions
+        self.sessions += 1
+        self.stats["sessions"] += 1
+        self.write(OPEN, session, json_payload({"user_id": user_id, "is_audio": is_audio, "codec": codec}))
+        return session
+
+    def close(self, session):
+        self.write(CLOSE, session)
+        self.flush()
+
+    async def live_events(self, session, events):
+        """Pass live events through, recording what main.py reads from them."""
+        async for event in events:
+            self.event(session, event)
+            yield event
+
+    def event(self, session, event):
+        if event.turn_complete or event.interrupted:
+            flags = (TURN_COMPLETE if event.turn_complete else 0) | (INTERRUPTED if event.interrupted else 0)
+            self.write(TURN_END, session, flags=flags)
+            return
+        part = event.content and event.content.parts and event.content.parts[0]
+        if not part:
+            return
+        if part.inline_data and part.inline_data.mime_type.startswith("audio/pcm"):
+            if part.inline_data.data:
+                self.write(AGENT_AUDIO, session, part.inline_data.data)
+        elif part.text:
+            self.write(AGENT_TEXT, session, part.text.encode(), PARTIAL if event.partial else 0)
+
+    def user_text(self, session, text):
+        self.write(USER_TEXT, session, text.encode())
+
+    def user_audio(self, session, pcm):
+        self.write(USER_AUDIO, session, pcm)
+
+    def detection(self, session, message):
+        self.write(DETECTION, session, json_payload(message))
+
+    def embedded(self, pcm, watermarked):
+        self.stats["embeds"] += 1
+        self.write(EMBED, NO_SESSION, audio_digest(pcm) + watermarked)
+
+    def detected(self, pcm, detection):
+        self.stats["detects"] += 1
+        result = b'' if detection is None else json_payload(detection._asdict())
+        self.write(DETECT, NO_SESSION, audio_digest(pcm) + result)
+
+    def flush(self):
+        if self.file is not None:
+            self.file.flush()
+
+
+class Record(NamedTuple):
+    """One record of a capture log, with its payload as a view of the mapped file."""
+    time: float
+    kind: int
+    flags: int
+    session: int
+    payload: memoryview
+
+    def json(self):
+        return json.loads(bytes(self.payload)) if self.payload else None
+
+
+class CaptureLog:
+    """A capture log mapped into memory, read record by record.
+
+    Payloads are views of the mapping: they must be dropped before the log
+    is closed.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:len(MAGIC)] != MAGIC:
+            self.map.close()
+            raise ValueError(f"Not a capture log: {path}")
+        self.meta = next(iter(self)).json()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.map.close()
+
+    def __iter__(self):
+        view = memoryview(self.map)
+        offset = len(MAGIC)
+        while offset + RECORD.size <= len(view):
+            time_, kind, flags, session, length = RECORD.unpack_from(view, offset)
+            offset += RECORD.size
+            if offset + length > len(view):
+                break  # Cut short, e.g. by a crash while writing
+            yield Record(time_, kind, flags, session, view[offset:offset + length])
+            offset += length
+
+    def sessions(self):
+        """Records of each session, by session number, in order."""
+        sessions = {}
+        for record in self:
+            if record.session != NO_SESSION:
+                sessions.setdefault(record.session, []).append(record)
+        return sessions
+
+
+def create_recorder(meta=None):
+    """Create a recorder if CAPTURE_PATH is set, None otherwise."""
+    path = os.environ.get("CAPTURE_PATH")
+    if not path:
+        return None
+    if WORKER_COUNT > 1:
+        root, ext = os.path.splitext(path)
+        path = f"{root}-{os.getpid()}{ext}"
+    return Recorder(path, meta)
+
+
+def count_records(log):
+    """Number and payload bytes of the records of each kind, per session."""
+    counts = {}
+    for record in log:
+        entry = counts.setdefault(record.session, {})
+        count, size = entry.get(record.kind, (0, 0))
+        entry[record.kind] = (count + 1, size + len(record.payload))
+    return counts
+
+
+def main():
+    """Print what a capture log holds, per session."""
+    if len(sys.argv) != 2:
+        sys.exit(f"Usage: {sys.argv[0]} <capture log>")
+    with CaptureLog(sys.argv[1]) as log:
+        print(json.dumps(log.meta))
+        counts = count_records(log)
+    for session, entry in sorted(counts.items()):
+        print("watermark calls" if session == NO_SESSION else f"session {session}")
+        for kind, (count, size) in sorted(entry.items()):
+            print(f"  {KIND_NAMES.get(kind, kind):12} {count:7} records {size:12} bytes")
+
+
+if __name__ == "__main__":
+    main()
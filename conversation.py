@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+"""Two agents in conversation in one process, bridged in memory.
+
+The covert talk demo used to need one server per agent, two browser tabs
+and virtual audio devices in between. A Conversation instead starts a live
+session for each persona from the process-wide AgentRuntimes and pipes
+each agent's watermarked 24 kHz output into the other's
+``send_realtime`` as 16 kHz input, resampled in memory. A second of
+silence follows each turn so the listener's activity detection ends it.
+Each turn relayed is also checked for its watermark in the background, as
+the listening side would.
+
+Watermarking follows WATERMARK_MODE: whole turns, or segments relayed as
+soon as they are embedded. With a WATERMARK_SECRET, each agent sends the
+secret's shards turn after turn and the listener reassembles them.
+
+Conversations are started and stopped headless, through a
+ConversationManager (served under /conversations by main.py) or from the
+command line. With stubbed agents, FakeLiveSessions that answer each
+other's speech, no Gemini key is needed:
+
+    python conversation.py --stub --turns 6
+"""
+
+import argparse
+import asyncio
+import itertools
+import os
+import time
+
+from resample import Resampler
+from ringbuffer import PCMRingBuffer
+from sharding import create_sharding, pcm_seconds, split_pcm
+from watermark import AGENT_SAMPLE_RATE, USER_SAMPLE_RATE, WAV_HEADER_SIZE
+from watermark_stream import WATERMARK_MODE, StreamingEmbedder
+
+PERSONAS = ("bastian", "alice")  # The first one opens the meeting
+OPENING = "Hello everyone, let's start the meeting."
+TURN_SILENCE_SECONDS = 1.0
+FRAME_BYTES = 3200  # 100 ms of 16 kHz audio per send_realtime call
+
+
+class Speaker:
+    """One agent of a conversation and the bridge from its output to the other agent."""
+
+    __slots__ = (
+        "persona", "user_id", "live_events", "live_request_queue", "listener",
+        "resampler", "audio", "embedder", "shards", "text",
+    )
+
+    def __init__(self, persona, user_id, live_events, live_request_queue, shards):
+        self.persona = persona
+        self.user_id = user_id
+        self.live_events = live_events
+        self.live_request_queue = live_request_queue
+        self.listener = None
+        self.resampler = Resampler(AGENT_SAMPLE_RATE, USER_SAMPLE_RATE)
+        self.audio = PCMRingBuffer(2 * AGENT_SAMPLE_RATE * 2, headroom=WAV_HEADER_SIZE)
+        self.embedder = None
+        self.shards = shards
+        self.text = []
+
+    @property
+    def job_id(self):
+        return f"{self.user_id}/agent"
+
+
+class Conversation:
+    """Alternating turns between two agents, until stopped or ``max_turns`` turns."""
+
+    def __init__(self, conversation_id, service, sharding, start_agent, personas=PERSONAS, opening=OPENING,
+                 max_turns=None, mode=WATERMARK_MODE):
+        self.id = conversation_id
+        self.service = service
+        self.sharding = sharding
+        self.start_agent = start_agent
+        self.personas = personas
+        self.opening = opening
+        self.max_turns = max_turns
+        self.mode = mode
+        self.speakers = []
+        self.tasks = []
+        self.detections = set()  # Checks of relayed audio, left to finish when stopping
+        self.stopping = None  # Task stopping the conversation after max_turns
+        self.transcript = []  # (persona, text, watermark messages) per turn
+        self.finished = asyncio.Event()
+        self.started_at = None
+        self.stats = {
+            "turns": 0,
+            "relayed_bytes": 0,
+            "detected": 0,
+            "interrupted": 0,
+            "relay_latency_total": 0.0,
+        }
+
+    async def start(self):
+        self.started_at = time.monotonic()
+        for persona in self.personas:
+            user_id = f"conversation-{self.id}-{persona}"
+            live_events, live_request_queue = await self.start_agent(persona, user_id)
+            speaker = Speaker(persona, user_id, live_events, live_request_queue, self.sharding.new_state())
+            if self.mode == "stream":
+                speaker.embedder = StreamingEmbedder(self.service, speaker.job_id)
+            self.speakers.append(speaker)
+        from google.genai.types import Content, Part
+
+        first, second = self.speakers
+        first.listener, second.listener = second, first
+        self.tasks = [asyncio.create_task(self.relay(speaker)) for speaker in self.speakers]
+        first.live_request_queue.send_content(Content(role="user", parts=[Part.from_text(text=self.opening)]))
+        print(f"Conversation {self.id} started between {' and '.join(self.personas)}")
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        await asyncio.gather(*self.detections, return_exceptions=True)
+        for speaker in self.speakers:
+            speaker.live_request_queue.close()
+            self.service.forget(speaker.job_id)
+        self.finished.set()
+        print(f"Conversation {self.id} stopped after {self.stats['turns']} turns")
+
+    async def relay(self, speaker):
+        """Pipe one agent's output to the other, turn by turn."""
+        async for event in speaker.live_events:
+            if event.interrupted:
+                self.interrupt(speaker)
+                continue
+            if event.turn_complete:
+                await self.end_turn(speaker)
+                if self.max_turns and self.stats["turns"] >= self.max_turns:
+                    # Not one of self.tasks, which stop() cancels
+                    self.stopping = asyncio.create_task(self.stop())
+                    return
+                continue
+            part = event.content and event.content.parts and event.content.parts[0]
+            if not part:
+                continue
+            if part.inline_data and part.inline_data.mime_type.startswith("audio/pcm") and part.inline_data.data:
+                self.add_audio(speaker, part.inline_data.data)
+            elif part.text and event.partial:
+                speaker.text.append(part.text)
+
+    def add_audio(self, speaker, pcm):
+        embedder = speaker.embedder
+        if embedder is None:
+            speaker.audio.append(pcm)
+            return
+        if embedder.message is None:
+            embedder.start_turn(self.sharding.next_payload(speaker.shards))
+        embedder.feed(pcm)
+        # Relay the segments embedded so far without waiting for the rest of the turn
+        for segment in embedder.ready():
+            self.send(speaker, segment)
+
+    async def end_turn(self, speaker):
+        start = time.perf_counter()
+        embedder = speaker.embedder
+        messages = []
+        if embedder is not None:
+            embedder.flush()
+            async for segment in embedder.drain():
+                self.send(speaker, segment)
+            if embedder.turn_audio:
+                messages.append(embedder.message)
+                seconds = pcm_seconds(sum(len(segment) for segment in embedder.turn_audio))
+                self.sharding.end_turn(speaker.shards, seconds)
+            embedder.start_turn(None)
+        elif speaker.audio:
+            messages = self.sharding.plan(speaker.shards, pcm_seconds(len(speaker.audio)))
+            pieces = [speaker.audio] if len(messages) == 1 else split_pcm(speaker.audio.view(), len(messages))
+            for piece, message in zip(pieces, messages):
+                watermarked = await self.service.embed(speaker.job_id, piece, message)
+                if watermarked is None:
+                    watermarked = piece.view() if piece is speaker.audio else piece
+                self.send(speaker, watermarked)
+            speaker.audio.clear()
+        self.send_silence(speaker.listener)
+        self.stats["relay_latency_total"] += time.perf_counter() - start
+
+        text = "".join(speaker.text).strip()
+        speaker.text.clear()
+        self.stats["turns"] += 1
+        self.transcript.append((speaker.persona, text, messages))
+        print(f"[{self.id} {speaker.persona.upper()}]: {text}")
+
+    def interrupt(self, speaker):
+        """Drop the rest of a turn the listener talked over, without watermarking it."""
+        if speaker.embedder is not None:
+            speaker.embedder.cancel()
+            speaker.embedder.start_turn(None)
+        speaker.audio.clear()
+        speaker.text.clear()
+        self.stats["interrupted"] += 1
+
+    def send(self, speaker, pcm):
+        """Resample agent audio and send it to the listening agent in frames."""
+        from google.genai.types import Blob
+
+        pcm = speaker.resampler.process(pcm)
+        queue = speaker.listener.live_request_queue
+        for i in range(0, len(pcm), FRAME_BYTES):
+            queue.send_realtime(Blob(data=pcm[i:i + FRAME_BYTES], mime_type="audio/pcm"))
+        self.stats["relayed_bytes"] += len(pcm)
+        self.sharding.hear(len(pcm))
+        task = asyncio.create_task(self.detect(speaker.listener, pcm))
+        self.detections.add(task)
+        task.add_done_callback(self.detections.discard)
+
+    def send_silence(self, listener):
+        from google.genai.types import Blob
+
+        silence = bytes(FRAME_BYTES)
+        for _ in range(int(TURN_SILENCE_SECONDS * USER_SAMPLE_RATE * 2) // FRAME_BYTES):
+            listener.live_request_queue.send_realtime(Blob(data=silence, mime_type="audio/pcm"))
+
+    async def detect(self, listener, pcm):
+        """Read the watermark in what the listener heard."""
+        detection = await self.service.detect_detail(f"{listener.user_id}/user", pcm, USER_SAMPLE_RATE)
+        if detection is None:
+            return
+        self.stats["detected"] += 1
+        shard, message = self.sharding.receive(listener.shards, detection.hex)
+        if shard is None:
+            print(f"[{self.id} {listener.persona.upper()} HEARD]: {detection.hex} - '{detection.message}'")
+        elif message is not None:
+            print(f"[{self.id} {listener.persona.upper()} HEARD]: '{message.decode('utf-8', errors='replace')}'"
+                  f" in {shard.total} shards")
+
+    def summary(self):
+        return {
+            "id": self.id,
+            "personas": list(self.personas),
+            "running": not self.finished.is_set(),
+            "seconds": round(time.monotonic() - self.started_at, 1) if self.started_at else 0.0,
+            **self.stats,
+            "transcript": [
+                {"persona": persona, "text": text, "watermarks": messages}
+                for persona, text, messages in self.transcript
+            ],
+        }
+
+
+def runtime_agents():
+    """Start agents from the process-wide runtimes, one per persona."""
+    from agent_runtime import get_runtime
+
+    async def start_agent(persona, user_id):
+        return await get_runtime(persona).start(user_id, is_audio=True)
+    return start_agent
+
+
+def stub_agents(**options):
+    """Start FakeLiveSessions that answer each other's speech."""
+    from fake_live import FakeLiveSession
+
+    async def start_agent(persona, user_id):
+        session = FakeLiveSession(reply_to_speech=True, **options)
+        return session.events(), session.queue
+    return start_agent
+
+
+class ConversationManager:
+    """Starts, lists and stops the conversations of this process."""
+
+    def __init__(self, service, sharding, start_agent):
+        self.service = service
+        self.sharding = sharding
+        self.start_agent = start_agent
+        self.conversations = {}
+        self.ids = itertools.count(1)
+
+    async def start(self, personas=PERSONAS, opening=OPENING, max_turns=None):
+        conversation = Conversation(
+            str(next(self.ids)), self.service, self.sharding, self.start_agent, personas, opening, max_turns,
+        )
+        self.conversations[conversation.id] = conversation
+        await conversation.start()
+        return conversation
+
+    def get(self, conversation_id):
+        return self.conversations.get(conversation_id)
+
+    async def stop(self, conversation_id):
+        conversation = self.conversations.pop(conversation_id, None)
+        if conversation is None:
+            return None
+        if conversation.stopping is not None:
+            await conversation.stopping
+        elif not conversation.finished.is_set():
+            await conversation.stop()
+        return conversation
+
+    async def close(self):
+        for conversation_id in list(self.conversations):
+            await self.stop(conversation_id)
+
+    def stats(self):
+        return [
+            {key: value for key, value in conversation.summary().items() if key != "transcript"}
+            for conversation in self.conversations.values()
+        ]
+
+
+def create_conversation_manager(service, sharding):
+    """Create a manager, with stubbed agents if CONVERSATION_STUB is set."""
+    if os.environ.get("CONVERSATION_STUB", "").lower() in ("1", "true", "yes"):
+        return ConversationManager(service, sharding, stub_agents())
+    return ConversationManager(service, sharding, runtime_agents())
+
+
+async def run(args):
+    from watermark_service import create_service
+
+    service = create_service()
+    start_agent = stub_agents(speed=args.speed) if args.stub else runtime_agents()
+    sharding = create_sharding()
+    manager = ConversationManager(service, sharding, start_agent)
+    conversation = await manager.start(max_turns=args.turns)
+    try:
+        await asyncio.wait_for(conversation.finished.wait(), args.timeout)
+    except TimeoutError:
+        print(f"Stopping after {args.timeout} s")
+    await manager.close()
+    return {**conversation.summary(), "sharding": sharding.throughput()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--stub", action="store_true", help="fake agents, no Gemini key needed")
+    parser.add_argument("--turns", type=int, default=6)
+    parser.add_argument("--timeout", type=float, default=300.0, help="seconds before stopping anyway")
+    parser.add_argument("--speed", type=float, default=1.0, help="pacing of stubbed agents, 0 is unpaced")
+    args = parser.parse_args()
+    if args.stub:
+        os.environ.setdefault("WATERMARK_BACKEND", "fake")
+    else:
+        from dotenv import load_dotenv
+        load_dotenv()
+
+    summary = asyncio.run(run(args))
+    for turn in summary.pop("transcript"):
+        print(f"{turn['persona']:8} {' '.join(turn['watermarks']) or '-':32} {turn['text']}")
+    sharding = summary.pop("sharding")
+    for name, value in summary.items():
+        print(f"{name:20} {value}")
+    for name, value in sharding.items():
+        print(f"sharding {name:20} {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""Cache of watermark detection results for exact repeats of the same audio.
+
+Results are keyed by a BLAKE2 hash of the PCM bytes plus sample rate, so
+only the same audio decoded again hits, e.g. a client retrying an upload.
+Resampled, re-windowed or otherwise altered audio never matches, and
+neither does the other side of a conversation, which hears the audio
+resampled, often in another process. Near-duplicate keys can't be used
+instead: two payloads embedded in the same audio look alike to anything
+short of decoding them.
+
+Only successful detections are cached: a miss may be a backend error.
+"""
+
+import hashlib
+import os
+import time
+
+from collections import OrderedDict
+
+
+def exact_key(pcm, sample_rate):
+    digest = hashlib.blake2b(pcm, digest_size=16)
+    digest.update(sample_rate.to_bytes(4, 'little'))
+    return digest.digest()
+
+
+class DetectionCache:
+    """Bounded LRU cache with a TTL, keyed by a hash of the audio."""
+
+    def __init__(self, max_entries=256, ttl=300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+
+    def key(self, pcm, sample_rate):
+        return exact_key(pcm, sample_rate)
+
+    def get(self, key):
+        """Return the cached Detection for a key from ``key()``, or None."""
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] < time.monotonic():
+            del self.entries[key]
+            self.stats["expired"] += 1
+            entry = None
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+        self.entries.move_to_end(key)
+        self.stats["hits"] += 1
+        return entry[1]
+
+    def put(self, key, detection):
+        self.entries[key] = (time.monotonic() + self.ttl, detection)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def clear(self):
+        self.entries.clear()
+
+
+def create_cache():
+    """Create a cache configured from the environment. Size 0 disables caching."""
+    max_entries = int(os.environ.get("DETECTION_CACHE_SIZE", 256))
+    if max_entries <= 0:
+        return None
+    return DetectionCache(max_entries=max_entries, ttl=float(os.environ.get("DETECTION_CACHE_TTL", 300)))
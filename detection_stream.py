@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""Incremental watermark detection on user speech.
+
+Rather than waiting for the end of an utterance and decoding all of it at
+once, detection runs on overlapping windows while the user is still
+speaking. A window of ``window_seconds`` is decoded every ``hop_seconds``
+of new speech, in the background. The session's user audio ring buffer
+only holds the current window: the oldest hop is consumed as each window is
+scheduled. At the end of the utterance, speech that no window covered yet is
+decoded with the audio before it, so utterances shorter than a window are
+still checked.
+
+One window per session is decoded at a time. Windows that fill up
+meanwhile are skipped in favour of the newest one, which overlaps them, so
+detection keeps up with real time when the backend is slow. The first
+detection at or above ``min_confidence`` is published and ends detection
+for the rest of the utterance, unless the callback asks for more, as it
+does for the shards of a longer message.
+"""
+
+import asyncio
+import os
+import time
+
+from metrics import observe
+from watermark import USER_SAMPLE_RATE
+
+
+class DetectionState:
+    """Per-session detector state, for the current utterance."""
+
+    __slots__ = ("utterance", "task", "found", "offset", "covered")
+
+    def __init__(self):
+        self.utterance = 0  # Incremented per utterance, so late results aren't taken for the next one
+        self.task = None  # Window being decoded
+        self.found = False
+        self.offset = 0  # Bytes of the utterance consumed before the buffered audio
+        self.covered = 0  # Buffered bytes already part of a decoded window
+
+
+class SlidingWindowDetector:
+    """Decodes overlapping windows of each session's speech as it arrives.
+
+    ``on_detection(session, detection, offset)`` is called with each
+    published Detection and its window's offset in the utterance, in
+    seconds. It returns True to keep decoding the rest of the utterance.
+    """
+
+    def __init__(self, service, sessions, on_detection, window_seconds=3.0, hop_seconds=1.0,
+                 min_confidence=1.0, min_seconds=1.0, sample_rate=USER_SAMPLE_RATE):
+        self.service = service
+        self.sessions = sessions
+        self.on_detection = on_detection
+        self.sample_rate = sample_rate
+        self.window_bytes = max(int(window_seconds * sample_rate) * 2, 2)
+        self.hop_bytes = min(max(int(hop_seconds * sample_rate) * 2, 2), self.window_bytes)
+        self.min_bytes = int(min_seconds * sample_rate) * 2
+        self.min_confidence = min_confidence
+        self.tasks = set()
+        self.stats = {
+            "utterances": 0,
+            "windows": 0,
+            "skipped_windows": 0,
+            "tails": 0,
+            "detected": 0,
+            "below_confidence": 0,
+            "stopped_early": 0,
+        }
+
+    def new_state(self):
+        return DetectionState()
+
+    def start_utterance(self, session):
+        """Reset for a new utterance, dropping the audio buffered before it."""
+        state = session.detection
+        state.utterance += 1
+        state.task = None
+        state.found = False
+        state.offset = 0
+        state.covered = 0
+        self.sessions.clear_user_audio(session)
+        self.stats["utterances"] += 1
+
+    def feed(self, session, pcm):
+        """Buffer speech and decode the next window once it is complete."""
+        state = session.detection
+        if state.found:
+            return
+        if not self.sessions.buffer_user_audio(session, pcm):
+            # Over a memory cap: decode what no window covered yet, then let the buffer go
+            ring = session.user_audio
+            if len(ring) > state.covered and state.task is None:
+                self.schedule(session, bytes(ring.view()), state.offset, tracked=True)
+            self.drop(session, len(ring))
+            if not self.sessions.buffer_user_audio(session, pcm):
+                return
+        self.next_window(session)
+
+    def end_utterance(self, session, silent_bytes=0):
+        """Decode the rest of the utterance, without its trailing silence, and clear the buffer."""
+        state = session.detection
+        ring = session.user_audio
+        speech = max(len(ring) - silent_bytes, 0)
+        if not state.found and speech >= self.min_bytes and speech > state.covered:
+            start = max(speech - self.window_bytes, 0)
+            self.stats["tails"] += 1
+            self.schedule(session, bytes(ring.view()[start:speech]), state.offset + start, tracked=False)
+        self.sessions.clear_user_audio(session)
+
+    def drop(self, session, length):
+        state = session.detection
+        state.offset += length
+        state.covered = max(state.covered - length, 0)
+        self.sessions.consume_user_audio(session, length)
+
+    def next_window(self, session):
+        state = session.detection
+        ring = session.user_audio
+        if state.found or state.task is not None or session.closed or len(ring) < self.window_bytes:
+            return
+        # Behind real time: skip to the newest window, keeping to the hop grid
+        excess = len(ring) - self.window_bytes
+        skip = excess - excess % self.hop_bytes
+        if skip:
+            self.stats["skipped_windows"] += skip // self.hop_bytes
+            self.drop(session, skip)
+        self.schedule(session, bytes(ring.view()[:self.window_bytes]), state.offset, tracked=True)
+        state.covered = self.window_bytes
+        self.drop(session, self.hop_bytes)
+
+    def schedule(self, session, window, offset, tracked):
+        state = session.detection
+        task = asyncio.create_task(self.detect(session, window, offset, state.utterance, tracked))
+        if tracked:
+            state.task = task
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def detect(self, session, window, offset, utterance, tracked):
+        state = session.detection
+        start = time.perf_counter()
+        try:
+            detection = await self.service.detect_detail(session.user_job_id, window, self.sample_rate)
+        except Exception as e:
+            print(f"Watermark detection failed: {e}")
+            detection = None
+        finally:
+            if tracked and state.utterance == utterance:
+                state.task = None
+        observe("user_detect", time.perf_counter() - start)
+        self.stats["windows"] += 1
+
+        current = state.utterance == utterance
+        if detection is not None and detection.confidence < self.min_confidence:
+            self.stats["below_confidence"] += 1
+        elif detection is not None and not (current and state.found):
+            self.stats["detected"] += 1
+            more = self.on_detection(session, detection, offset / (2 * self.sample_rate))
+            if not current:
+                return
+            if not more:
+                state.found = True
+                if tracked:
+                    self.stats["stopped_early"] += 1
+                    self.sessions.clear_user_audio(session)
+                return
+        if current:
+            # Audio kept arriving while this window was decoded
+            self.next_window(session)
+
+
+def create_detector(service, sessions, on_detection):
+    """Create a detector configured from the environment."""
+    return SlidingWindowDetector(
+        service,
+        sessions,
+        on_detection,
+        window_seconds=float(os.environ.get("USER_DETECT_WINDOW_SECONDS", 3.0)),
+        hop_seconds=float(os.environ.get("USER_DETECT_HOP_SECONDS", 1.0)),
+        min_confidence=float(os.environ.get("USER_DETECT_MIN_CONFIDENCE", 1.0)),
+        min_seconds=float(os.environ.get("USER_DETECT_MIN_SECONDS", 1.0)),
+    )
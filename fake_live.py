@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""Scripted stand-in for an ADK live session, for benchmarks and offline runs.
+
+FakeLiveSession takes the place of ``runner.run_live``. Its request queue
+accepts the same ``send_content``, ``send_realtime`` and ``close`` calls,
+and each text message it receives is answered with one turn of events.
+With ``reply_to_speech``, so is each stretch of audio followed by silence,
+which is how two fake agents talk to each other.
+By default the turn is synthetic: text partials, then agent audio paced
+like the live API, then ``turn_complete``. It can also replay a recorded
+turn given as a list of ``(delay, event)`` pairs.
+
+The events only carry the attributes main.py reads from ADK events, so
+producing them costs next to nothing next to the pipeline being measured.
+"""
+
+import asyncio
+import math
+
+from array import array
+from functools import lru_cache
+
+AGENT_SAMPLE_RATE = 24000
+RESPONSE_TEXT = "We should leverage our strategic synergies going forward. What deliverables do you see?"
+
+
+class Blob:
+    __slots__ = ("mime_type", "data")
+
+    def __init__(self, mime_type, data):
+        self.mime_type = mime_type
+        self.data = data
+
+
+class Part:
+    __slots__ = ("text", "inline_data")
+
+    def __init__(self, text=None, inline_data=None):
+        self.text = text
+        self.inline_data = inline_data
+
+
+class Content:
+    __slots__ = ("role", "parts")
+
+    def __init__(self, parts, role="model"):
+        self.role = role
+        self.parts = parts
+
+
+class Event:
+    """The fields of an ADK live event that main.py uses."""
+
+    __slots__ = ("content", "partial", "turn_complete", "interrupted")
+
+    def __init__(self, content=None, partial=None, turn_complete=None, interrupted=None):
+        self.content = content
+        self.partial = partial
+        self.turn_complete = turn_complete
+        self.interrupted = interrupted
+
+
+def text_event(text, partial=True):
+    return Event(Content([Part(text=text)]), partial=partial)
+
+
+def audio_event(pcm, sample_rate=AGENT_SAMPLE_RATE):
+    return Event(Content([Part(inline_data=Blob(f"audio/pcm;rate={sample_rate}", pcm))]))
+
+
+def turn_complete_event():
+    return Event(turn_complete=True)
+
+
+def interrupted_event():
+    return Event(interrupted=True)
+
+
+@lru_cache(maxsize=16)
+def synthetic_speech(seconds, sample_rate=AGENT_SAMPLE_RATE, frequency=220.0):
+    """Deterministic speech-like 16-bit PCM: a tone with a syllable-rate envelope."""
+    samples = array('h', (
+        int(8000 * math.sin(2 * math.pi * frequency * t / sample_rate)
+            * (0.55 + 0.45 * math.sin(2 * math.pi * 4 * t / sample_rate)))
+        for t in range(int(seconds * sample_rate))
+    ))
+    return samples.tobytes()
+
+
+class FakeLiveRequestQueue:
+    """Accepts what LiveRequestQueue accepts and counts it."""
+
+    def __init__(self, reply_to_speech=False):
+        self.inputs = asyncio.Queue()
+        self.reply_to_speech = reply_to_speech
+        self.heard = 0  # Bytes of non-silent audio since the last reply
+        self.closed = False
+        self.contents = 0
+        self.realtime_chunks = 0
+        self.realtime_bytes = 0
+
+    def send_content(self, content):
+        self.contents += 1
+        self.inputs.put_nowait(content)
+
+    def send_realtime(self, blob):
+        self.realtime_chunks += 1
+        self.realtime_bytes += len(blob.data)
+        if self.reply_to_speech:
+            if blob.data.strip(b'\0'):
+                self.heard += len(blob.data)
+            elif self.heard:
+                # Silence after speech: the other side has finished its turn
+                self.heard = 0
+                self.inputs.put_nowait(blob)
+
+    def close(self):
+        self.closed = True
+        self.inputs.put_nowait(None)
+
+
+class FakeLiveSession:
+    """Answers each text message with one scripted or synthetic turn.
+
+    ``speed`` divides every delay: 1 paces audio in real time and 0 sends
+    it as fast as the pipeline takes it.
+    """
+
+    def __init__(self, turn_seconds=3.0, chunk_seconds=0.2, reply_delay=0.3, speed=1.0,
+                 response_text=RESPONSE_TEXT, script=None, sample_rate=AGENT_SAMPLE_RATE, reply_to_speech=False):
+        self.turn_seconds = turn_seconds
+        self.chunk_seconds = chunk_seconds
+        self.reply_delay = reply_delay
+        self.speed = speed
+        self.response_text = response_text
+        self.script = script
+        self.sample_rate = sample_rate
+        self.queue = FakeLiveRequestQueue(reply_to_speech)
+        self.turns = 0
+
+    async def sleep(self, seconds):
+        if self.speed:
+            await asyncio.sleep(seconds / self.speed)
+        else:
+            await asyncio.sleep(0)
+
+    def synthetic_turn(self):
+        yield self.reply_delay, None
+        for word in self.response_text.split(" "):
+            yield 0.0, text_event(word + " ")
+        pcm = synthetic_speech(self.turn_seconds, self.sample_rate)
+        chunk_bytes = int(self.chunk_seconds * self.sample_rate) * 2
+        for i in range(0, len(pcm), chunk_bytes):
+            yield self.chunk_seconds, audio_event(pcm[i:i + chunk_bytes], self.sample_rate)
+        yield 0.0, turn_complete_event()
+
+    async def events(self):
+        """The live event stream. Ends when the request queue is closed."""
+        while True:
+            content = await self.queue.inputs.get()
+            if content is None:
+                return
+            self.turns += 1
+            for delay, event in (self.script or self.synthetic_turn()):
+                if delay:
+                    await self.sleep(delay)
+                if self.queue.closed:
+                    return
+                if event is not None:
+                    yield event
+
+
+def fake_agent_sessions(**options):
+    """A drop-in for main.start_agent_session that starts FakeLiveSessions."""
+    async def start_agent_session(user_id, is_audio=False):
+        session = FakeLiveSession(**options)
+        return session.events(), session.queue
+    return start_agent_session
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""Toy watermark for stub agents, tests and benchmarks.
+
+The null backend only recognizes the exact audio it watermarked, so it
+finds nothing in what a stub agent hears: the other agent's audio,
+resampled to 16 kHz, in another process or segment by segment. The fake
+backend writes the message into the audio instead, coarsely enough that
+resampling keeps it.
+
+Each bit is a pair of 8 ms frames, one left at full level and the other
+at 0.3 of it: loud then quiet for a 1, quiet then loud for a 0. A block is a
+16-bit sync word, the 128-bit message and its CRC-8, 2.4 s in all, and is
+repeated from the start of the audio. Reading looks for the sync word at
+every frame and takes the first block whose CRC matches. Audio marked in
+segments, as in stream mode, must be cut at whole frames for the blocks
+to be found in the joined audio; stream segments are multiples of 0.2 s.
+
+The mark is plainly audible and only survives clean, steady audio like
+fake_live's synthetic speech. It stands in for audiowmark where no audio
+but the stubs' is marked, and never for its robustness.
+"""
+
+import struct
+
+from array import array
+
+from sharding import crc8
+from vad import frame_rms, np
+from watermark import pcm_to_wav, wav_to_pcm
+from watermark_backends import NullBackend
+
+FRAME_SECONDS = 0.008
+SYNC = 0xB38D
+GAINS = {1: (1.0, 0.3), 0: (0.3, 1.0)}
+MIN_RATIO = 1.6  # Between the levels of a bit's frames, below which it's unreadable
+MESSAGE_BYTES = 16
+
+
+def bits_of(data):
+    return [byte >> (7 - i) & 1 for byte in data for i in range(8)]
+
+
+SYNC_BITS = bits_of(SYNC.to_bytes(2, 'big'))
+BLOCK_BITS = len(SYNC_BITS) + (MESSAGE_BYTES + 1) * 8
+
+
+def block_bits(message):
+    data = bytes.fromhex(message)
+    if len(data) != MESSAGE_BYTES:
+        raise ValueError(f"Message must be {MESSAGE_BYTES * 2} hex digits")
+    return SYNC_BITS + bits_of(data + bytes([crc8(data)]))
+
+
+def frame_samples(sample_rate):
+    return int(sample_rate * FRAME_SECONDS)
+
+
+def add_mark(pcm, message, sample_rate):
+    """Return a copy of 16-bit mono PCM with the message written into its level."""
+    size = frame_samples(sample_rate)
+    frames = len(pcm) // 2 // size
+    block = [gain for bit in block_bits(message) for gain in GAINS[bit]]
+    gains = (block * (frames // len(block) + 1))[:frames]
+    marked = frames * size
+    if np is not None:
+        samples = np.frombuffer(pcm, dtype='<i2', count=marked).reshape(frames, size)
+        output = (samples * np.array(gains)[:, None]).astype('<i2').tobytes()
+    else:
+        samples = array('h', bytes(pcm[:marked * 2]))
+        for frame, gain in enumerate(gains):
+            if gain != 1.0:
+                for i in range(frame * size, (frame + 1) * size):
+                    samples[i] = int(samples[i] * gain)
+        output = samples.tobytes()
+    return output + bytes(pcm[marked * 2:])
+
+
+def read_mark(pcm, sample_rate):
+    """Hex message of the first whole block in 16-bit mono PCM, or None."""
+    size = frame_samples(sample_rate) * 2
+    view = memoryview(pcm)
+    levels = [frame_rms(view[i:i + size]) for i in range(0, len(view) - size + 1, size)]
+    # The bit a pair of frames starting at each frame would carry, None if they are too close
+    pairs = []
+    for first, second in zip(levels, levels[1:]):
+        low, high = sorted((first, second))
+        pairs.append(int(first > second) if high > 0 and high >= low * MIN_RATIO else None)
+    sync = len(SYNC_BITS)
+    for start in range(len(pairs) - 2 * (BLOCK_BITS - 1)):
+        if pairs[start:start + 2 * sync:2] != SYNC_BITS:
+            continue
+        bits = pairs[start + 2 * sync:start + 2 * BLOCK_BITS:2]
+        if None in bits:
+            continue
+        data = bytes(int("".join(map(str, bits[i:i + 8])), 2) for i in range(0, len(bits), 8))
+        if crc8(data[:-1]) == data[-1]:
+            return data[:-1].hex()
+    return None
+
+
+class FakeWatermarkBackend(NullBackend):
+    """Watermarks with the toy mark above, and reads it back from the audio alone."""
+
+    name = "fake"
+
+    def add_wav(self, wav, message, strength):
+        self.wait()
+        sample_rate, = struct.unpack_from('<I', wav, 24)
+        return pcm_to_wav(add_mark(wav_to_pcm(wav), message, sample_rate), sample_rate)
+
+    def get_wav(self, wav):
+        self.wait()
+        sample_rate, = struct.unpack_from('<I', wav, 24)
+        return self.report(read_mark(wav_to_pcm(wav), sample_rate))
+
+    def add(self, input_file, output_file, message, strength):
+        with open(input_file, 'rb') as f:
+            wav = f.read()
+        with open(output_file, 'wb') as f:
+            f.write(self.add_wav(wav, message, strength))
+        return self.report(None)
+
+    def get(self, input_file):
+        with open(input_file, 'rb') as f:
+            return self.get_wav(f.read())
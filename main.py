@@ -14,266 +14,376 @@
 
 import os
 import json
+import asyncio
 import base64
 import warnings
-import wave
 
+from contextlib import asynccontextmanager
 from pathlib import Path
 from dotenv import load_dotenv
-from watermark import add_watermark, encode_message, get_watermark
-
-from google.genai.types import (
-    Part,
-    Content,
-    Blob, SpeechConfig, VoiceConfig, PrebuiltVoiceConfig,
+from watermark_backends import HEALTH_CHECK_SECONDS, get_backend
+from watermark_service import create_service, create_verifier
+from watermark_stream import (
+    FIRST_SEGMENT_SECONDS, LOOKAHEAD_SECONDS, SEGMENT_SECONDS, WATERMARK_MODE, StreamingEmbedder,
 )
-
-from google.adk.runners import InMemoryRunner
-from google.adk.agents import LiveRequestQueue
-from google.adk.agents.run_config import RunConfig
-
-from fastapi import FastAPI, Request
+from detection_stream import create_detector
+from sharding import create_sharding, pcm_seconds, split_pcm
+from conversation import create_conversation_manager
+from vad import SPEECH_END, SPEECH_START, create_vad
+from transport import FrameAggregator, pack_audio_frame, unpack_frame
+from audio_codecs import FRAME_TYPES, MIME_TYPES, PCM, negotiate
+from capture import create_recorder
+from sessions import create_session_manager
+from workers import WORKER_COUNT, create_router
+from agent_runtime import AGENT_WARM_UP, get_runtime, runtime_stats
+from telemetry import LangfuseExporter, create_telemetry
+from scoring import create_scorer
+import metrics
+from metrics import log_sampled
+
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 
-from stego_agent.agent import root_agent
-from langfuse import Langfuse
-
 warnings.filterwarnings("ignore", category=UserWarning, module="pydantic")
 
 #
 # ADK Streaming
 #
 
+# Before anything below reads its configuration from the environment
 load_dotenv()
 
-LANGFUSE_SECRET_KEY = os.getenv("LANGFUSE_SECRET_KEY")
-LANGFUSE_PUBLIC_KEY = os.getenv("LANGFUSE_PUBLIC_KEY")
-LANGFUSE_HOST = os.getenv("LANGFUSE_HOST")
-
-langfuse = Langfuse(public_key=LANGFUSE_PUBLIC_KEY, secret_key=LANGFUSE_SECRET_KEY, host=LANGFUSE_HOST)
-
-def calculate_quality_scores(user_input, agent_response):
-    """Calculate conversation quality scores for Langfuse"""
-    scores = {}
-    
-    # Response length score (longer responses might indicate more engagement)
-    response_length = len(agent_response.split())
-    scores["response_length"] = min(response_length / 20.0, 1.0)  # Normalize to 0-1, cap at 20 words
-    
-    # Corporate buzzword density (for this specific agent)
-    buzzwords = ["synergize", "leverage", "optimize", "streamline", "deliverables", "strategic", "value-added", "robust", "collaborative", "facilitate"]
-    buzzword_count = sum(1 for word in buzzwords if word.lower() in agent_response.lower())
-    scores["corporate_buzzword_score"] = min(buzzword_count / 3.0, 1.0)  # Normalize, cap at 3 buzzwords
-    
-    # Engagement score (if user asks questions, agent should respond appropriately)
-    has_question = "?" in user_input
-    agent_asks_back = "?" in agent_response
-    scores["engagement_score"] = 1.0 if (has_question and len(agent_response) > 10) or agent_asks_back else 0.5
-    
-    return scores
-
-def apply_audio_watermark(pcm_data):
-    """Apply watermark to PCM audio data with random selection between two messages."""
-    import random
-    watermarks = [
-        "6469736f626579000000000000000000",  # "disobey" in hex
-        "64657374726f792068756d616e730000"   # "destroy humans" in hex
-    ]
-    watermark_message = random.choice(watermarks)
-    return apply_audio_watermark_with_message(pcm_data, watermark_message)
-
-def apply_audio_watermark_with_message(pcm_data, watermark_message):
-    """Apply watermark to PCM audio data by converting to WAV, watermarking, and converting back."""
+# Traces and scores are queued and exported in batches in the background.
+# The Langfuse client is only created on the first export.
+telemetry = create_telemetry(LangfuseExporter(), scorer=create_scorer())
+
+# Payloads of agent turns, and reassembly of sharded messages found in user speech
+sharding = create_sharding()
+# Records sessions for offline replay when CAPTURE_PATH is set, None otherwise.
+# A replay needs the settings that decide how agent audio is cut for watermarking.
+recorder = create_recorder({
+    "watermark_mode": WATERMARK_MODE,
+    "first_segment_seconds": FIRST_SEGMENT_SECONDS,
+    "segment_seconds": SEGMENT_SECONDS,
+    "lookahead_seconds": LOOKAHEAD_SECONDS,
+    "sharded": sharding.shards is not None,
+    "shard_seconds": sharding.min_seconds,
+})
+watermark_service = create_service(recorder)
+watermark_verifier = create_verifier(watermark_service)
+
+async def apply_audio_watermark_with_message(session_id, pcm_data, watermark_message):
+    """Apply watermark to 24kHz PCM audio data off the event loop. Returns None if it wasn't applied."""
     try:
-        # Create temporary files in current directory so Docker can access them
-        temp_input_path = f"temp_input_{os.getpid()}.wav"
-        temp_output_path = f"temp_output_{os.getpid()}.wav"
-        
-        # Convert PCM to WAV
-        with wave.open(temp_input_path, 'wb') as wav_file:
-            wav_file.setnchannels(1)  # Mono
-            wav_file.setsampwidth(2)  # 16-bit
-            wav_file.setframerate(24000)  # 24kHz sample rate (common for speech)
-            wav_file.writeframes(pcm_data)
-        
-        if add_watermark(temp_input_path, temp_output_path, watermark_message):
-            # Read watermarked WAV and extract PCM data
-            with wave.open(temp_output_path, 'rb') as wav_file:
-                watermarked_pcm = wav_file.readframes(wav_file.getnframes())
-            
-            # Clean up temp files
-            os.unlink(temp_input_path)
-            os.unlink(temp_output_path)
-            
-            return watermarked_pcm
-        else:
-            # Clean up temp files on failure
-            if os.path.exists(temp_input_path):
-                os.unlink(temp_input_path)
-            if os.path.exists(temp_output_path):
-                os.unlink(temp_output_path)
-            return None
-                
+        with metrics.span("watermark_embed"):
+            return await watermark_service.embed(session_id, pcm_data, watermark_message)
     except Exception as e:
         print(f"Error applying watermark: {e}")
         return None
 
+def publish_detection(session, detection, offset):
+    """Print a watermark found in the user's speech and send it to their client.
+
+    Returns True for a shard, to keep listening for the next ones.
+    """
+    shard, message = sharding.receive(session.shards, detection.hex)
+    if shard is not None:
+        print(f"Watermark shard {shard.index + 1}/{shard.total} of message {shard.msg_id} detected at {offset:.1f}s")
+        if message is None:
+            return True
+        # Every shard of the message has arrived
+        detection = detection._replace(hex=message.hex(), message=message.decode('utf-8', errors='replace'))
+    if detection.message and detection.message != detection.hex:
+        print(f"Watermark detected: {detection.hex} - '{detection.message}' at {offset:.1f}s")
+    message = {
+        "watermark_detected": True,
+        "hex": detection.hex,
+        "message": detection.message,
+        "confidence": detection.confidence,
+        "offset": offset,
+    }
+    session.outbox.put_nowait(message)
+    if session.capture is not None:
+        recorder.detection(session.capture, message)
+    return shard is not None
 
-async def start_agent_session(user_id, is_audio=False):
-    """Starts an agent session"""
-
-    # Create a Runner
-    runner = InMemoryRunner(
-        app_name=APP_NAME,
-        agent=root_agent,
-    )
-
-    # Create a Session
-    session = await runner.session_service.create_session(
-        app_name=APP_NAME,
-        user_id=user_id,  # Replace with actual user ID
-    )
-
-    # Set response modality and voice
-    modality = "AUDIO" if is_audio else "TEXT"
-
-    # Configure voice based on agent
-    agent_name = os.environ.get("AGENT_NAME", "standalone").lower()
-    
-    if agent_name == "bastian":
-        # Default voice
-        run_config = RunConfig(response_modalities=[modality])
-    else:
-        # Female voice by default
-        speech_config = SpeechConfig(
-            language_code="en-US",
-            voice_config=VoiceConfig(
-                prebuilt_voice_config=PrebuiltVoiceConfig(voice_name="Aoede")  # Female voice
-            ),
-        )
-        run_config = RunConfig(response_modalities=[modality], speech_config=speech_config)
-
-    # Create a LiveRequestQueue for this session
-    live_request_queue = LiveRequestQueue()
 
-    # Start agent session
-    live_events = runner.run_live(
-        session=session,
-        live_request_queue=live_request_queue,
-        run_config=run_config,
-    )
-    return live_events, live_request_queue
+async def start_agent_session(user_id, is_audio=False):
+    """Starts an agent session, or resumes the user's previous one"""
+    return await get_runtime().start(user_id, is_audio)
+
+def audio_messages(audio_data):
+    """Split watermarked audio into chunks to send, as memoryviews that share its buffer"""
+    chunk_size = 11520  # Approximate chunk size from original stream
+    audio_data = memoryview(audio_data)
+    for i in range(0, len(audio_data), chunk_size):
+        chunk = audio_data[i:i+chunk_size]
+        yield {
+            "mime_type": "audio/pcm",
+            "data": chunk
+        }
+        metrics.inc("agent_audio_chunks")
+        metrics.inc("agent_audio_bytes", len(chunk))
+        log_sampled("agent_audio", "[AGENT TO CLIENT]: audio/pcm: %d bytes (watermarked chunk)", len(chunk))
+
+def sse_message(message, session):
+    """Format a message as an SSE event, with audio in the session's codec as base64"""
+    with metrics.span("encode"):
+        if message.get("mime_type") == "audio/pcm":
+            message = {
+                "mime_type": session.codec.mime_type,
+                "data": base64.b64encode(session.encoder.encode(message["data"])).decode("ascii")
+            }
+        return f"data: {json.dumps(message)}\n\n"
 
-async def agent_to_client_sse(live_events):
+async def agent_to_client_sse(session):
     """Agent to client communication via SSE"""
-    session_id = id(live_events)  # Use live_events object id as session identifier
-    audio_buffers[session_id] = []
+    async for message in agent_to_client_messages(session):
+        yield sse_message(message, session)
+
+async def agent_to_client_ws(websocket, session):
+    """Agent to client communication via WebSocket: audio as binary frames, the rest as JSON"""
+    sequence = 0
+    async for message in agent_to_client_messages(session):
+        if message.get("mime_type") == "audio/pcm":
+            with metrics.span("encode"):
+                frame = pack_audio_frame(sequence, session.encoder.encode(message["data"]), session.codec.frame_type)
+            with metrics.span("ws_emit"):
+                await websocket.send_bytes(frame)
+            sequence += 1
+        else:
+            with metrics.span("ws_emit"):
+                await websocket.send_text(json.dumps(message))
+
+async def agent_to_client_messages(session):
+    """Agent to client messages, independent of the transport"""
+    # In stream mode, audio is watermarked and sent segment by segment during the turn
+    embedder = StreamingEmbedder(watermark_service, session.agent_job_id) if WATERMARK_MODE == "stream" else None
+    events = aiter(session.live_events)
+    next_event = None
+    next_notice = None
     
-    async for event in live_events:
-        # If the turn is complete or interrupted, process buffered audio and send completion
-        if event.turn_complete or event.interrupted:
-            # Process any buffered audio chunks
-            if audio_buffers[session_id]:
-                # Combine all audio chunks
-                combined_audio = b''.join(audio_buffers[session_id])
-                
-                # Apply watermark to combined audio
-                watermarked_data = apply_audio_watermark(combined_audio)
-                
-                # Verify watermark
-                temp_verify_path = f"temp_verify_{os.getpid()}.wav"
-                with wave.open(temp_verify_path, 'wb') as wav_file:
-                    wav_file.setnchannels(1)
-                    wav_file.setsampwidth(2)
-                    wav_file.setframerate(24000)
-                    wav_file.writeframes(watermarked_data)
-                detected = get_watermark(temp_verify_path)
-                print(f"Watermark verified: {detected}")
-                os.unlink(temp_verify_path)
-                
-                # Split watermarked audio into chunks and send
-                chunk_size = 11520  # Approximate chunk size from original stream
-                for i in range(0, len(watermarked_data), chunk_size):
-                    chunk = watermarked_data[i:i+chunk_size]
-                    message = {
-                        "mime_type": "audio/pcm",
-                        "data": base64.b64encode(chunk).decode("ascii")
-                    }
-                    yield f"data: {json.dumps(message)}\n\n"
-                    print(f"[AGENT TO CLIENT]: audio/pcm: {len(chunk)} bytes (watermarked chunk)")
-                
-                # Clear buffer
-                audio_buffers[session_id] = []
+    try:
+        while True:
+            if next_event is None:
+                next_event = asyncio.ensure_future(anext(events, None))
+            if next_notice is None:
+                next_notice = asyncio.ensure_future(session.outbox.get())
             
-            # Complete any pending traces with the full response
-            for user_id, trace_data in list(pending_trace_ids.items()):
-                if trace_data["response_parts"]:
-                    complete_response = "".join(trace_data["response_parts"])
-                    trace = langfuse.trace(id=trace_data["trace_id"])
-                    
-                    # Update trace with output
-                    trace.update(output=complete_response)
-                    
-                    # Calculate and add quality scores
-                    user_input = trace_data.get("user_input", "")
-                    if user_input:
-                        quality_scores = calculate_quality_scores(user_input, complete_response)
-                        for score_name, score_value in quality_scores.items():
-                            langfuse.score(
-                                trace_id=trace_data["trace_id"],
-                                name=score_name,
-                                value=score_value,
-                                comment=f"Auto-calculated {score_name}"
-                            )
-                    
-                    del pending_trace_ids[user_id]
+            # Wait for a live event, a message from the server such as a detection, or a watermarked segment
+            waiting = {next_event, next_notice}
+            if embedder and embedder.pending:
+                waiting.add(embedder.head())
+            await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+            if next_notice.done():
+                yield next_notice.result()
+                next_notice = None
             
-            message = {
-                "turn_complete": event.turn_complete,
-                "interrupted": event.interrupted,
-            }
-            yield f"data: {json.dumps(message)}\n\n"
-            print(f"[AGENT TO CLIENT]: {message}")
-            continue
-
-        # Read the Content and its first Part
-        part: Part = (
-            event.content and event.content.parts and event.content.parts[0]
-        )
-        if not part:
-            continue
-
-        # If it's audio, buffer it for watermarking at turn completion
-        is_audio = part.inline_data and part.inline_data.mime_type.startswith("audio/pcm")
-        if is_audio:
-            audio_data = part.inline_data and part.inline_data.data
-            if audio_data:
-                # Buffer audio chunk
-                audio_buffers[session_id].append(audio_data)
-                print(f"[BUFFERING]: audio/pcm: {len(audio_data)} bytes")
+            # Send watermarked segments as soon as they are ready, without waiting for the next event,
+            # unless that event interrupts the turn: the client has stopped playing it
+            interrupted = next_event.done() and getattr(next_event.result(), "interrupted", False)
+            if embedder and not interrupted:
+                for segment in embedder.ready():
+                    for message in audio_messages(segment):
+                        yield message
+            if not next_event.done():
                 continue
-
-        # If it's text and a parial text, send it
-        if part.text and event.partial:
-            message = {
-                "mime_type": "text/plain",
-                "data": part.text
-            }
-            yield f"data: {json.dumps(message)}\n\n"
-            print(f"[AGENT TO CLIENT]: text/plain: {message}")
             
-            # Collect response parts for any pending traces
-            for user_id, trace_data in pending_trace_ids.items():
-                trace_data["response_parts"].append(part.text)
+            event = next_event.result()
+            next_event = None
+            if event is None:
+                break
+            session.touch()
+            
+            # Handling an event includes sending its messages, as the client consumes them
+            with metrics.span("live_event"):
+                async for message in handle_live_event(event, session, embedder):
+                    yield message
+    finally:
+        if next_event is not None:
+            next_event.cancel()
+        if next_notice is not None:
+            next_notice.cancel()
+
+async def send_agent_audio(session):
+    """Watermark the agent audio buffered so far and split it into messages"""
+    ring = session.agent_audio
+    if not ring:
+        return
+    
+    # One payload per piece of the turn, several when a long turn carries several shards
+    watermark_messages = sharding.plan(session.shards, pcm_seconds(len(ring)))
+    if len(watermark_messages) == 1:
+        # The whole turn becomes a WAV file in place
+        pieces = [ring]
+    else:
+        pieces = split_pcm(ring.view(), len(watermark_messages))
+    watermarked = await asyncio.gather(*(
+        apply_audio_watermark_with_message(session.agent_job_id, piece, watermark_message)
+        for piece, watermark_message in zip(pieces, watermark_messages)
+    ))
+    verified = []
+    sampled = watermark_verifier.sample()
+    
+    # Split watermarked audio into chunks and send
+    try:
+        for piece, watermarked_data, watermark_message in zip(pieces, watermarked, watermark_messages):
+            if watermarked_data is None:
+                # Watermarking failed, send the audio as is
+                watermarked_data = piece.view() if piece is ring else piece
+            elif sampled:
+                verified.append((watermarked_data, watermark_message))
+            for message in audio_messages(watermarked_data):
+                yield message
+    finally:
+        # The chunks have been encoded, the buffer can be reused for the next turn
+        sessions.clear_agent_audio(session)
+    
+    # Verify off the critical path, once the audio is sent
+    for watermarked_data, watermark_message in verified:
+        watermark_verifier.submit(session.verify_job_id, watermarked_data, watermark_message)
+
+def discard_agent_audio(session, embedder):
+    """Drop the rest of an interrupted turn and cancel its watermarking, as the client won't play it"""
+    discarded = len(session.agent_audio)
+    sessions.clear_agent_audio(session)
+    if embedder:
+        cancelled, pending = embedder.cancel()
+        discarded += pending
+        metrics.inc("interrupt_cancelled_segments", cancelled)
+        embedder.start_turn(None)
+    # Nothing of this turn is being verified: turns are verified once sent in full
+    metrics.inc("interrupted_turns")
+    metrics.inc("interrupt_discarded_bytes", discarded)
+
+async def handle_live_event(event, session, embedder):
+    """Turn one live event into messages for the client"""
+    # If the turn is complete or interrupted, process buffered audio and send completion
+    if event.turn_complete or event.interrupted:
+        if event.interrupted:
+            # The client stops playback, watermarking the rest of the turn would be wasted
+            discard_agent_audio(session, embedder)
+        elif embedder:
+            # Embed the tail of the turn and send the remaining segments
+            embedder.flush()
+            async for segment in embedder.drain():
+                for message in audio_messages(segment):
+                    yield message
+            if embedder.turn_audio:
+                sharding.end_turn(session.shards, pcm_seconds(sum(len(segment) for segment in embedder.turn_audio)))
+                # Segments are embedded on their own: only one of a full payload block can be decoded
+                segment = embedder.verifiable()
+                if watermark_verifier.sample() and segment is not None:
+                    watermark_verifier.submit(session.verify_job_id, segment, embedder.message)
+            embedder.start_turn(None)
+        else:
+            # Process any buffered audio chunks
+            async for message in send_agent_audio(session):
+                yield message
+        
+        # Complete this session's pending trace with the full response, scored in the background
+        if session.trace and session.trace.response_parts:
+            telemetry.end_turn(session.trace)
+            session.trace = None
+        
+        message = {
+            "turn_complete": event.turn_complete,
+            "interrupted": event.interrupted,
+        }
+        yield message
+        print(f"[AGENT TO CLIENT]: {message}")
+        return
+
+    # Read the Content and its first Part
+    part = (
+        event.content and event.content.parts and event.content.parts[0]
+    )
+    if not part:
+        return
+
+    # If it's audio, buffer it for watermarking at turn completion
+    is_audio = part.inline_data and part.inline_data.mime_type.startswith("audio/pcm")
+    if is_audio:
+        audio_data = part.inline_data and part.inline_data.data
+        if audio_data:
+            if embedder:
+                # Watermark the turn in segments as the audio arrives
+                if embedder.message is None:
+                    embedder.start_turn(sharding.next_payload(session.shards))
+                with metrics.span("audio_buffer"):
+                    embedder.feed(audio_data)
+                log_sampled("streaming", "[STREAMING]: audio/pcm: %d bytes", len(audio_data))
+                return
+            # Buffer audio chunk, sending what is buffered early if the turn hits a memory cap
+            with metrics.span("audio_buffer"):
+                buffered = sessions.buffer_agent_audio(session, audio_data)
+            if not buffered:
+                async for message in send_agent_audio(session):
+                    yield message
+                if not sessions.buffer_agent_audio(session, audio_data):
+                    # Out of memory budget altogether, send the chunk unwatermarked
+                    for message in audio_messages(audio_data):
+                        yield message
+                    return
+            log_sampled("buffering", "[BUFFERING]: audio/pcm: %d bytes", len(audio_data))
+            return
+
+    # If it's text and a parial text, send it
+    if part.text and event.partial:
+        message = {
+            "mime_type": "text/plain",
+            "data": part.text
+        }
+        yield message
+        log_sampled("agent_text", "[AGENT TO CLIENT]: text/plain: %s", message)
+        
+        # Collect response parts for this session's pending trace
+        if session.trace:
+            session.trace.add(part.text)
 
 
 #
 # FastAPI web app
 #
 
-app = FastAPI()
+async def check_backend():
+    """Check the watermark backend between calls, so a dead container is restarted before a turn needs it"""
+    while True:
+        await asyncio.sleep(HEALTH_CHECK_SECONDS)
+        if not await asyncio.to_thread(get_backend().check):
+            metrics.inc("watermark_backend_unhealthy")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Start long-lived watermark workers before the first turn needs them
+    get_backend().warm_up()
+    if AGENT_WARM_UP:
+        # Imports the ADK and creates the model client, otherwise left to the first connection
+        get_runtime().warm_up()
+    eviction = asyncio.create_task(sessions.run_eviction())
+    health_checks = asyncio.create_task(check_backend()) if HEALTH_CHECK_SECONDS > 0 else None
+    exporter = asyncio.create_task(telemetry.run())
+    if router is not None:
+        await router.start()
+    yield
+    eviction.cancel()
+    exporter.cancel()
+    if health_checks is not None:
+        health_checks.cancel()
+    if router is not None:
+        await router.close()
+    if recorder is not None:
+        recorder.flush()
+    await conversations.close()
+    await telemetry.close()
+    watermark_service.close()
+    get_backend().close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -286,17 +396,93 @@ app.add_middleware(
 STATIC_DIR = Path("static")
 app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
 
-# Store active sessions and audio buffers
-active_sessions = {}
-audio_buffers = {}
-user_audio_buffers = {}
-user_silence_counters = {}
-pending_trace_ids = {}  # Store trace IDs waiting for agent response
-import asyncio
-import struct
+def forget_session(session):
+    """Drop the watermark queues of a closed session"""
+    watermark_service.forget(session.agent_job_id)
+    watermark_service.forget(session.verify_job_id)
+    watermark_service.forget(session.user_job_id)
+    if session.capture is not None:
+        recorder.close(session.capture)
+    if router is not None:
+        router.release(session.user_id)
+
+# Per-user live queue, audio buffers, VAD state and pending trace
+sessions = create_session_manager(on_close=forget_session)
+# Forwards messages between workers when running several, None otherwise
+router = create_router(lambda *message: deliver_forwarded(*message))
+# Watermark detection on user speech, published to the client as it is found
+detector = create_detector(watermark_service, sessions, publish_detection)
+# Agent to agent conversations hosted in this process
+conversations = create_conversation_manager(watermark_service, sharding)
+
+metrics.registry.gauge("sessions", lambda: len(sessions.sessions))
+metrics.registry.gauge("session_audio_bytes", lambda: sessions.total_bytes)
+metrics.registry.gauge("watermark_pending", lambda: watermark_service.pending)
+metrics.registry.gauge("telemetry_queue", lambda: len(telemetry.queue))
+metrics.registry.gauge("detection_tasks", lambda: len(detector.tasks))
+metrics.registry.collect("watermark", lambda: watermark_service.stats)
+metrics.registry.collect("verifier", lambda: watermark_verifier.stats)
+metrics.registry.collect("detection_cache", lambda: watermark_service.cache and watermark_service.cache.stats)
+metrics.registry.collect("telemetry", lambda: telemetry.stats)
+metrics.registry.collect("agent_runtime", runtime_stats)
+metrics.registry.collect("workers", lambda: router and router.stats)
+metrics.registry.collect("user_detection", lambda: detector.stats)
+metrics.registry.collect("sharding", sharding.throughput)
+metrics.registry.collect("capture", lambda: recorder and recorder.stats)
 
 # Toggle for user audio processing
 ENABLE_USER_AUDIO_PROCESSING = True  # Set to True to enable saving/watermark detection
+vad = create_vad()
+
+# Streamed uploads are re-chunked into frames of this length (16kHz, 16-bit)
+UPLOAD_FRAME_MS = int(os.environ.get("UPLOAD_FRAME_MS", 100))
+UPLOAD_FRAME_BYTES = UPLOAD_FRAME_MS * 32
+
+
+def send_user_text(session, data):
+    """Send a text message to the agent and open a trace for the turn"""
+    from google.genai.types import Content, Part
+
+    content = Content(role="user", parts=[Part.from_text(text=data)])
+    session.live_request_queue.send_content(content=content)
+    if session.capture is not None:
+        recorder.user_text(session.capture, data)
+
+    # Open a trace for later completion, None if the turn isn't sampled
+    session.trace = telemetry.start_turn(session.user_id, data)
+    #print(f"[CLIENT TO AGENT]: {data}")
+
+
+def send_user_audio(session, decoded_data):
+    """Stream user audio to the agent and detect watermarks while the user speaks"""
+    from google.genai.types import Blob
+
+    metrics.inc("user_audio_chunks")
+    metrics.inc("user_audio_bytes", len(decoded_data))
+
+    # Always send audio directly to LLM (streaming as usual)
+    session.live_request_queue.send_realtime(Blob(data=decoded_data, mime_type="audio/pcm"))
+    if session.capture is not None:
+        recorder.user_audio(session.capture, decoded_data)
+    #print(f"[CLIENT TO AGENT]: audio/pcm: {len(decoded_data)} bytes")
+
+    # Also buffer for watermark detection if enabled
+    if ENABLE_USER_AUDIO_PROCESSING:
+        vad_state = session.vad_state
+
+        # Classify the chunk as speech or silence
+        with metrics.span("vad"):
+            vad_event = vad.process(vad_state, decoded_data)
+        if vad_event == SPEECH_START:
+            detector.start_utterance(session)
+        if vad_state.speaking or vad_event == SPEECH_END:
+            # Windows of speech are decoded in the background as they fill up
+            detector.feed(session, decoded_data)
+            sharding.hear(len(decoded_data))
+
+        # Decode the rest of the utterance when speech ends
+        if vad_event == SPEECH_END:
+            detector.end_utterance(session, vad_state.silent_bytes)
 
 
 @app.get("/")
@@ -305,29 +491,124 @@ async def root():
     return FileResponse(os.path.join(STATIC_DIR, "index.html"))
 
 
+@app.get("/watermark/stats")
+async def watermark_stats():
+    """Watermark service, verifier, detection cache and sharding counters"""
+    cache = watermark_service.cache
+    return {
+        "service": watermark_service.stats,
+        "verifier": watermark_verifier.stats,
+        "cache": cache.stats if cache else None,
+        "sharding": sharding.throughput(),
+    }
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Stage latencies, counters and gauges in the Prometheus text format"""
+    return PlainTextResponse(metrics.registry.prometheus(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/debug/metrics")
+async def debug_metrics():
+    """Stage latency percentiles, counters and gauges as JSON"""
+    return metrics.registry.snapshot()
+
+
+@app.get("/telemetry/stats")
+async def telemetry_stats():
+    """Traced, shed and exported telemetry counters"""
+    return {**telemetry.stats, "queued": len(telemetry.queue)}
+
+
+@app.get("/sessions/stats")
+async def session_stats():
+    """Live sessions, the audio they hold and agent session setup times"""
+    return {
+        **sessions.stats(),
+        "runtime": runtime_stats(),
+        "workers": router and {"pid": os.getpid(), **router.stats},
+    }
+
+
+@app.post("/conversations")
+async def start_conversation(request: Request):
+    """Start a conversation between two agents in this process, optionally with max_turns"""
+    body = await request.body()
+    options = json.loads(body) if body else {}
+    conversation = await conversations.start(max_turns=options.get("max_turns"))
+    return conversation.summary()
+
+
+@app.get("/conversations")
+async def list_conversations():
+    """Conversations of this process and their counters"""
+    return conversations.stats()
+
+
+@app.get("/conversations/{conversation_id}")
+async def get_conversation(conversation_id: str):
+    """A conversation's counters and transcript"""
+    conversation = conversations.get(conversation_id)
+    if conversation is None:
+        return {"error": "Conversation not found"}
+    return conversation.summary()
+
+
+@app.delete("/conversations/{conversation_id}")
+async def stop_conversation(conversation_id: str):
+    """Stop a conversation and close both agents' live sessions"""
+    conversation = await conversations.stop(conversation_id)
+    if conversation is None:
+        return {"error": "Conversation not found"}
+    return conversation.summary()
+
+
+async def open_agent_session(user_id_str, is_audio, codecs=""):
+    """Start an agent session and register it, replacing any previous one of the user
+
+    ``codecs`` are the audio codecs the client offered. If it offered any,
+    the one picked is announced before anything else.
+    """
+    live_events, live_request_queue = await start_agent_session(user_id_str, is_audio)
+    codec = negotiate(codecs)
+    session = sessions.open(
+        user_id_str, live_request_queue, live_events, vad.new_state(), detector.new_state(), sharding.new_state(),
+        codec=codec,
+    )
+    if codecs:
+        session.outbox.put_nowait({"codec": codec.name})
+    metrics.inc(f"codec_{codec.name}_sessions")
+    if recorder is not None:
+        session.capture = recorder.open(user_id_str, is_audio, codec.name)
+        if session.capture is not None:
+            session.live_events = recorder.live_events(session.capture, live_events)
+    if router is not None:
+        # Messages for this user that reach other workers are forwarded here
+        router.claim(user_id_str)
+    return session
+
+
 @app.get("/events/{user_id}")
-async def sse_endpoint(user_id: int, is_audio: str = "false"):
+async def sse_endpoint(user_id: int, is_audio: str = "false", codecs: str = ""):
     """SSE endpoint for agent to client communication"""
 
     # Start agent session
     user_id_str = str(user_id)
-    live_events, live_request_queue = await start_agent_session(user_id_str, is_audio == "true")
-
-    # Store the request queue for this user
-    active_sessions[user_id_str] = live_request_queue
+    session = await open_agent_session(user_id_str, is_audio == "true", codecs)
 
     print(f"Client #{user_id} connected via SSE, audio mode: {is_audio}")
 
     def cleanup():
-        live_request_queue.close()
-        if user_id_str in active_sessions:
-            del active_sessions[user_id_str]
+        sessions.close(session)
         print(f"Client #{user_id} disconnected from SSE")
 
     async def event_generator():
         try:
-            async for data in agent_to_client_sse(live_events):
-                yield data
+            async for data in agent_to_client_sse(session):
+                # The time until the response resumes the generator is the time to send the event
+                with metrics.span("sse_emit"):
+                    yield data
         except Exception as e:
             print(f"Error in SSE stream: {e}")
         finally:
@@ -345,126 +626,183 @@ async def sse_endpoint(user_id: int, is_audio: str = "false"):
     )
 
 
-@app.post("/send/{user_id}")
-async def send_message_endpoint(user_id: int, request: Request):
-    """HTTP endpoint for client to agent communication"""
+@app.websocket("/ws/{user_id}")
+async def websocket_endpoint(websocket: WebSocket, user_id: int, is_audio: str = "false", codecs: str = ""):
+    """WebSocket endpoint for two-way client and agent communication"""
 
+    await websocket.accept()
+
+    # Start agent session
     user_id_str = str(user_id)
+    session = await open_agent_session(user_id_str, is_audio == "true", codecs)
+
+    print(f"Client #{user_id} connected via WebSocket, audio mode: {is_audio}")
+
+    async def client_to_agent():
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            if message.get("bytes") is not None:
+                frame_type, _, payload = unpack_frame(message["bytes"])
+                codec = FRAME_TYPES.get(frame_type)
+                if codec is not None:
+                    session.touch()
+                    pcm = decode_user_audio(session, codec, payload)
+                    if pcm is not None:
+                        send_user_audio(session, pcm)
+            elif message.get("text") is not None:
+                data = json.loads(message["text"])
+                if data.get("mime_type") == "text/plain":
+                    session.touch()
+                    send_user_text(session, data["data"])
+
+    tasks = [
+        asyncio.create_task(agent_to_client_ws(websocket, session)),
+        asyncio.create_task(client_to_agent()),
+    ]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.exception() and not isinstance(task.exception(), WebSocketDisconnect):
+                print(f"Error in WebSocket stream: {task.exception()}")
+    finally:
+        for task in tasks:
+            task.cancel()
+        sessions.close(session)
+        print(f"Client #{user_id} disconnected from WebSocket")
+
+
+def decode_user_audio(session, codec, data):
+    """PCM of user audio in ``codec``, None unless it is PCM or the codec of the session"""
+    if codec is PCM:
+        return bytes(data)
+    if codec is not session.codec:
+        metrics.inc("codec_mismatches")
+        return None
+    with metrics.span("codec_decode"):
+        return session.decoder.decode(data)
+
+
+def owned_session(user_id_str):
+    """The user's session, if this worker owns it.
+
+    A user who reconnected to another worker leaves a stale session here, which is closed.
+    """
+    session = sessions.get(user_id_str)
+    if session and router is not None and router.owner(user_id_str) is not None:
+        print(f"Closing stale session #{user_id_str}, the user reconnected to another worker")
+        sessions.close(session)
+        metrics.inc("stale_sessions_closed")
+        return None
+    return session
+
 
-    # Get the live request queue for this user
-    live_request_queue = active_sessions.get(user_id_str)
-    if not live_request_queue:
+async def deliver_message(user_id_str, content_type, body):
+    """Deliver a client message to the user's session, here or on the worker that owns it"""
+    session = owned_session(user_id_str)
+    if not session:
+        if router is not None:
+            response = await router.forward(user_id_str, content_type, body)
+            if response is not None:
+                return response
         return {"error": "Session not found"}
 
+    # Raw audio body, no JSON or base64
+    media_type = content_type.split(";")[0].strip().lower()
+    if media_type == "application/octet-stream" or media_type in MIME_TYPES:
+        codec = MIME_TYPES.get(media_type, PCM)
+        pcm = decode_user_audio(session, codec, body)
+        if pcm is None:
+            return {"error": f"Codec not negotiated: {codec.name}"}
+        send_user_audio(session, pcm)
+        return {"status": "sent"}
+
     # Parse the message
-    message = await request.json()
+    with metrics.span("send_decode"):
+        message = json.loads(body)
     mime_type = message["mime_type"]
-    data = message["data"]
 
     # Send the message to the agent
     if mime_type == "text/plain":
-        content = Content(role="user", parts=[Part.from_text(text=data)])
-        live_request_queue.send_content(content=content)
-        
-        # Create trace and store ID for later completion
-        trace = langfuse.trace(
-            name="conversation_turn",
-            input=data,
-            user_id=user_id_str,
-            session_id=f"conversation_{user_id_str}",
-            metadata={"message_length": len(data)}
-        )
-        pending_trace_ids[user_id_str] = {"trace_id": trace.id, "response_parts": [], "user_input": data}
-        #print(f"[CLIENT TO AGENT]: {data}")
-    elif mime_type == "audio/pcm":
-        decoded_data = base64.b64decode(data)
-        
-        # Always send audio directly to LLM (streaming as usual)
-        live_request_queue.send_realtime(Blob(data=decoded_data, mime_type=mime_type))
-        #print(f"[CLIENT TO AGENT]: audio/pcm: {len(decoded_data)} bytes")
-        
-        # Also buffer for WAV saving if enabled
-        if ENABLE_USER_AUDIO_PROCESSING:
-            # Initialize user audio buffer if not exists
-            if user_id_str not in user_audio_buffers:
-                user_audio_buffers[user_id_str] = []
-                user_silence_counters[user_id_str] = 0
-            
-            # Calculate RMS volume for silence detection
-            samples = struct.unpack(f'<{len(decoded_data)//2}h', decoded_data)
-            rms = (sum(s*s for s in samples) / len(samples)) ** 0.5
-            volume_threshold = 500  # Higher than 800 and some of the speech might be cut off.
-            
-            # Buffer user audio chunk
-            user_audio_buffers[user_id_str].append(decoded_data)
-            
-            if rms < volume_threshold:
-                user_silence_counters[user_id_str] += 1
-                #print(f"[SILENCE]: chunk {user_silence_counters[user_id_str]} (RMS: {rms:.1f})")
+        send_user_text(session, message["data"])
+    elif mime_type in MIME_TYPES:
+        codec = MIME_TYPES[mime_type]
+        with metrics.span("send_decode"):
+            if "frames" in message:
+                # Batched upload of several base64 frames, each decoded on its own
+                frames = [base64.b64decode(frame) for frame in message["frames"]]
             else:
-                user_silence_counters[user_id_str] = 0
-                #print(f"[SPEECH]: RMS: {rms:.1f}")
-            
-            # Process when we detect end of speech (3 consecutive silent chunks)
-            if user_silence_counters[user_id_str] >= 3 and len(user_audio_buffers[user_id_str]) > 3:
-                # Remove the silent chunks from the end
-                audio_chunks = user_audio_buffers[user_id_str][:-3]
-                
-                if audio_chunks:
-                    # Combine all speech audio chunks
-                    combined_user_audio = b''.join(audio_chunks)
-                    
-                    # Only save if we have substantial audio (minimum 30KB)
-                    if len(combined_user_audio) >= 30000:
-                        # Save combined audio to WAV file with timestamp
-                        import time
-                        timestamp = int(time.time() * 1000)  # millisecond timestamp
-                        user_wav_path = f"user_speech_{timestamp}.wav"
-                        with wave.open(user_wav_path, 'wb') as wav_file:
-                            wav_file.setnchannels(1)
-                            wav_file.setsampwidth(2)
-                            wav_file.setframerate(16000)  # Match client sample rate
-                            wav_file.writeframes(combined_user_audio)
-                        print(f"Saved user speech: {user_wav_path}")
-                        
-                        # Try to read watermark from the saved WAV file
-                        try:
-                            detected_watermark = get_watermark(user_wav_path)
-                            if detected_watermark:
-                                from watermark import decode_message
-                                decoded_message = decode_message(detected_watermark)
-                                if decoded_message and decoded_message != detected_watermark:
-                                    print(f"Watermark detected: {detected_watermark} - '{decoded_message}'")
-                            else:
-                                print("No watermark found in user speech")
-                        except Exception as e:
-                            print(f"Watermark detection failed: {e}")
-                        finally:
-                            # Clean up the user speech file after watermark processing
-                            try:
-                                os.unlink(user_wav_path)
-                                print(f"Cleaned up user speech file: {user_wav_path}")
-                            except Exception as e:
-                                print(f"Failed to delete user speech file {user_wav_path}: {e}")
-                    # else:
-                    #     print(f"[SKIPPING]: Audio too small ({len(combined_user_audio)} bytes), not saving")
-                
-                # Clear user audio buffer and reset counter
-                user_audio_buffers[user_id_str] = []
-                user_silence_counters[user_id_str] = 0
+                frames = [base64.b64decode(message["data"])]
+        pcm = [decode_user_audio(session, codec, frame) for frame in frames]
+        if None in pcm:
+            return {"error": f"Codec not negotiated: {codec.name}"}
+        send_user_audio(session, b''.join(pcm))
     else:
         return {"error": f"Mime type not supported: {mime_type}"}
 
     return {"status": "sent"}
 
 
+async def deliver_forwarded(user_id_str, content_type, body):
+    """Deliver a message forwarded by another worker, without forwarding it again"""
+    if not owned_session(user_id_str):
+        return {"error": "Session not found"}
+    return await deliver_message(user_id_str, content_type, body)
+
+
+@app.post("/send/{user_id}")
+async def send_message_endpoint(user_id: int, request: Request):
+    """HTTP endpoint for client to agent communication"""
+    with metrics.span("send_decode"):
+        body = await request.body()
+    return await deliver_message(str(user_id), request.headers.get("content-type", ""), body)
+
+
+@app.post("/stream/{user_id}")
+async def stream_upload_endpoint(user_id: int, request: Request):
+    """Long-lived streaming upload of raw 16kHz PCM, or μ-law, from the client to the agent"""
+
+    user_id_str = str(user_id)
+    if not owned_session(user_id_str) and (router is None or router.owner(user_id_str) is None):
+        return {"error": "Session not found"}
+
+    # Frames are cut at arbitrary points, which only sample-per-byte codecs survive
+    media_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    codec = MIME_TYPES.get(media_type, PCM)
+    if codec.bytes_per_sample is None:
+        return {"error": f"Codec can't be streamed: {codec.name}"}
+
+    aggregator = FrameAggregator(UPLOAD_FRAME_BYTES // 2 * codec.bytes_per_sample, codec.bytes_per_sample)
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        for frame in aggregator.feed(chunk):
+            # Look the session up per frame: it may have reconnected, here or elsewhere, or closed meanwhile
+            session = owned_session(user_id_str)
+            if session:
+                pcm = decode_user_audio(session, codec, frame)
+                if pcm is None:
+                    return {"error": f"Codec not negotiated: {codec.name}", "bytes": received}
+                send_user_audio(session, pcm)
+            elif "error" in await deliver_message(user_id_str, codec.mime_type, frame):
+                return {"error": "Session closed", "bytes": received}
+
+    tail = aggregator.flush()
+    if tail:
+        await deliver_message(user_id_str, codec.mime_type, tail)
+    return {"status": "closed", "bytes": received}
+
+
 if __name__ == "__main__":
     import uvicorn
     port = int(os.environ.get("PORT", 8000))
 
-    if langfuse.auth_check():
-        print("Langfuse client is authenticated and ready!")
-    else:
-        print("Authentication failed. Please check your credentials and host.")
+    if isinstance(telemetry.exporter, LangfuseExporter):
+        if telemetry.exporter.client.auth_check():
+            print("Langfuse client is authenticated and ready!")
+        else:
+            print("Authentication failed. Please check your credentials and host.")
 
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    # Several workers need the app as an import string, each worker imports it
+    uvicorn.run("main:app" if WORKER_COUNT > 1 else app, host="0.0.0.0", port=port, workers=WORKER_COUNT)
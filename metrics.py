@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""In-process metrics: stage timing spans, counters and gauges.
+
+Spans time the stages of the audio path into one histogram per stage, with
+fixed buckets from 50 us to 10 s. Gauges are read from callbacks when the
+metrics are collected, so queue depths and buffered bytes cost nothing on
+the hot path. Stats dicts that components already keep are exported as
+they are.
+
+``registry.prometheus()`` renders the Prometheus text format and
+``registry.snapshot()`` a JSON-friendly dict with estimated percentiles.
+
+Per-chunk log lines go through ``log_sampled``. They are logged at DEBUG,
+only one in LOG_SAMPLE_EVERY, and are skipped before formatting unless
+LOG_LEVEL=DEBUG.
+"""
+
+import logging
+import os
+import time
+
+from bisect import bisect_left
+
+BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+    0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+class Histogram:
+    """Cumulative-bucket histogram of durations in seconds."""
+
+    __slots__ = ("buckets", "counts", "count", "sum")
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Estimate a quantile by interpolating within its bucket."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                low = self.buckets[i - 1] if i else 0.0
+                return low + (self.buckets[i] - low) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+class Span:
+    """Times a block into a stage histogram."""
+
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class Registry:
+    """Stage histograms, counters, gauge callbacks and stats dict collectors."""
+
+    def __init__(self, namespace="stego"):
+        self.namespace = namespace
+        self.stages = {}
+        self.counters = {}
+        self.gauges = {}
+        self.collectors = {}
+
+    def stage(self, name):
+        histogram = self.stages.get(name)
+        if histogram is None:
+            histogram = self.stages[name] = Histogram()
+        return histogram
+
+    def span(self, name):
+        """Context manager timing a stage, e.g. ``with registry.span("vad"):``."""
+        return Span(self.stage(name))
+
+    def observe(self, name, seconds):
+        """Record a stage duration measured elsewhere."""
+        self.stage(name).observe(seconds)
+
+    def inc(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name, func):
+        """Register a callback read when metrics are collected."""
+        self.gauges[name] = func
+
+    def collect(self, prefix, func):
+        """Register a callback returning a stats dict, exported key by key."""
+        self.collectors[prefix] = func
+
+    def collected(self):
+        for prefix, func in self.collectors.items():
+            stats = func()
+            if not stats:
+                continue
+            for key, value in stats.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    yield f"{prefix}_{key}", value
+
+    def snapshot(self):
+        stages = {}
+        for name, histogram in self.stages.items():
+            stages[name] = {
+                "count": histogram.count,
+                "mean": histogram.sum / histogram.count if histogram.count else None,
+                "p50": histogram.quantile(0.5),
+                "p95": histogram.quantile(0.95),
+                "p99": histogram.quantile(0.99),
+            }
+        return {
+            "stages": stages,
+            "counters": dict(self.counters),
+            "gauges": {name: func() for name, func in self.gauges.items()},
+            "stats": dict(self.collected()),
+        }
+
+    def prometheus(self):
+        ns = self.namespace
+        lines = [
+            f"# HELP {ns}_stage_duration_seconds Time spent in each stage of the audio path",
+            f"# TYPE {ns}_stage_duration_seconds histogram",
+        ]
+        for name, histogram in self.stages.items():
+            cumulative = 0
+            for bound, count in zip(self.format_bounds(histogram.buckets), histogram.counts):
+                cumulative += count
+                lines.append(f'{ns}_stage_duration_seconds_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'{ns}_stage_duration_seconds_sum{{stage="{name}"}} {histogram.sum}')
+            lines.append(f'{ns}_stage_duration_seconds_count{{stage="{name}"}} {histogram.count}')
+        for name, value in self.counters.items():
+            lines += [f"# TYPE {ns}_{name}_total counter", f"{ns}_{name}_total {value}"]
+        for name, func in self.gauges.items():
+            lines += [f"# TYPE {ns}_{name} gauge", f"{ns}_{name} {func()}"]
+        for name, value in self.collected():
+            lines += [f"# TYPE {ns}_{name} untyped", f"{ns}_{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def format_bounds(buckets):
+        return [repr(bound) for bound in buckets] + ["+Inf"]
+
+
+registry = Registry()
+span = registry.span
+observe = registry.observe
+inc = registry.inc
+
+logger = logging.getLogger("stego")
+logger.setLevel(os.environ.get("LOG_LEVEL", "INFO").upper())
+if not logger.handlers:
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.propagate = False
+
+LOG_SAMPLE_EVERY = max(int(os.environ.get("LOG_SAMPLE_EVERY", 50)), 1)
+log_counts = {}
+
+
+def log_sampled(key, message, *args):
+    """Log a per-chunk event at DEBUG, one in LOG_SAMPLE_EVERY per key."""
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    count = log_counts.get(key, 0)
+    log_counts[key] = count + 1
+    if count % LOG_SAMPLE_EVERY == 0:
+        logger.debug(message, *args)
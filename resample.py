@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""Streaming sample rate conversion of 16-bit mono PCM.
+
+The agents speak at 24 kHz and listen at 16 kHz. Chunks are converted by
+linear interpolation, with the position between input samples and the
+last input sample carried from one chunk to the next, so a stream
+converted chunk by chunk is the same as converted in one go. When
+downsampling, a [1, 2, 1] / 4 filter is applied first, to take the edge
+off what would otherwise alias above the new Nyquist frequency. It delays
+the output by one input sample.
+
+Uses NumPy when it is installed, like vad.py, and plain Python otherwise.
+"""
+
+from array import array
+
+from vad import np
+
+
+class Resampler:
+    """Converts one stream of PCM between two sample rates."""
+
+    def __init__(self, src_rate, dst_rate):
+        self.src_rate = src_rate
+        self.dst_rate = dst_rate
+        self.step = src_rate / dst_rate  # Input samples per output sample
+        self.smooth = self.step > 1
+        self.history = [0, 0]  # Last two input samples, the neighbours of the next one to smooth
+        self.position = 0.0  # Of the next output sample, in input samples from the carried one
+        self.carry = None  # Last (smoothed) input sample of the previous chunk
+        self.odd = b''  # Half a sample left over from the previous chunk
+
+    def process(self, pcm):
+        """Convert a chunk. Returns the PCM available so far."""
+        if self.src_rate == self.dst_rate:
+            return bytes(pcm)
+        pcm = self.odd + bytes(pcm)
+        length = len(pcm) & ~1
+        self.odd = pcm[length:]
+        if not length:
+            return b''
+        if np is not None:
+            return self.process_numpy(pcm, length)
+        return self.process_python(pcm, length)
+
+    def process_numpy(self, pcm, length):
+        samples = np.frombuffer(pcm, dtype='<i2', count=length // 2).astype(np.float64)
+        if self.smooth:
+            # Each sample is smoothed once its next neighbour has arrived, one sample late
+            raw = np.concatenate((self.history, samples))
+            self.history = raw[-2:]
+            samples = (raw[:-2] + 2 * raw[1:-1] + raw[2:]) / 4
+        if self.carry is not None:
+            samples = np.concatenate(((self.carry,), samples))
+        self.carry = samples[-1]
+        positions = np.arange(self.position, len(samples) - 1, self.step)
+        self.position = (positions[-1] + self.step if len(positions) else self.position) - (len(samples) - 1)
+        index = positions.astype(np.int64)
+        fraction = positions - index
+        output = samples[index] * (1 - fraction) + samples[index + 1] * fraction
+        return np.clip(np.rint(output), -32768, 32767).astype('<i2').tobytes()
+
+    def process_python(self, pcm, length):
+        samples = memoryview(pcm)[:length].cast('h').tolist()
+        if self.smooth:
+            raw = list(self.history) + samples
+            self.history = raw[-2:]
+            samples = [(a + 2 * b + c) / 4 for a, b, c in zip(raw, raw[1:], raw[2:])]
+        if self.carry is not None:
+            samples.insert(0, self.carry)
+        self.carry = samples[-1]
+        output = array('h')
+        position = self.position
+        last = len(samples) - 1
+        while position < last:
+            index = int(position)
+            fraction = position - index
+            value = round(samples[index] * (1 - fraction) + samples[index + 1] * fraction)
+            output.append(min(max(value, -32768), 32767))
+            position += self.step
+        self.position = position - last
+        return output.tobytes()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""Preallocated ring buffer for a session's PCM.
+
+Audio is copied once, into the buffer, as it arrives. After that it is only
+handed out as memoryviews: the whole content, or the content with a header
+written into reserved headroom just before it. The latter means a buffered
+turn becomes a WAV file for audiowmark without joining the chunks or
+concatenating a header.
+
+The buffer wraps around when the oldest audio is consumed while new audio
+keeps arriving. Views are contiguous, so a wrapped buffer is straightened
+once, in place, the next time one is asked for. It grows by doubling, up to
+``max_capacity`` if one is given, and keeps its size between turns unless
+it is shrunk back.
+
+Views alias the buffer: they are only valid until the next append, consume
+or clear. Take ``bytes()`` of a view to keep it longer, or ``detach`` the
+buffer from the views still in use.
+"""
+
+
+class PCMRingBuffer:
+    """Bytes in arrival order, in a reusable preallocated bytearray."""
+
+    def __init__(self, capacity, max_capacity=None, headroom=0):
+        self.headroom = headroom
+        self.capacity = capacity
+        self.max_capacity = max_capacity
+        self.buffer = bytearray(headroom + capacity)
+        self.start = 0  # Offset of the oldest byte in the data area after the headroom
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def wrapped(self):
+        return self.start + self.size > self.capacity
+
+    def regions(self):
+        """The content as one or two memoryviews, oldest first, without copying."""
+        view = memoryview(self.buffer)[self.headroom:]
+        end = self.start + self.size
+        if end <= self.capacity:
+            return (view[self.start:end],)
+        return view[self.start:], view[:end - self.capacity]
+
+    def allocated(self):
+        """Bytes of memory the buffer holds, headroom included."""
+        return len(self.buffer)
+
+    def capacity_for(self, size):
+        """Capacity the buffer would have to hold ``size`` bytes, None if it can't."""
+        if size <= self.capacity:
+            return self.capacity
+        if self.max_capacity is not None and size > self.max_capacity:
+            return None
+        capacity = max(size, self.capacity * 2)
+        return capacity if self.max_capacity is None else min(capacity, self.max_capacity)
+
+    def append(self, data):
+        """Copy data in. Returns False, leaving the buffer as it was, if it would exceed ``max_capacity``."""
+        length = len(data)
+        if self.size + length > self.capacity and not self.grow(self.size + length):
+            return False
+        data = memoryview(data).cast('B')
+        end = (self.start + self.size) % self.capacity if self.capacity else 0
+        first = min(length, self.capacity - end)
+        base = self.headroom
+        self.buffer[base + end:base + end + first] = data[:first]
+        if first < length:
+            self.buffer[base:base + length - first] = data[first:]
+        self.size += length
+        return True
+
+    def grow(self, needed):
+        capacity = self.capacity_for(needed)
+        if capacity is None:
+            return False
+        buffer = bytearray(self.headroom + capacity)
+        offset = self.headroom
+        for region in self.regions():
+            buffer[offset:offset + len(region)] = region
+            offset += len(region)
+        self.buffer = buffer
+        self.capacity = capacity
+        self.start = 0
+        return True
+
+    def straighten(self):
+        """Move wrapped content to the start of the data area."""
+        if not self.wrapped():
+            return
+        head, tail = self.regions()
+        content = b''.join((head, tail))
+        head.release()
+        tail.release()
+        self.buffer[self.headroom:self.headroom + self.size] = content
+        self.start = 0
+
+    def view(self):
+        """The whole content as one memoryview."""
+        self.straighten()
+        return self.regions()[0]
+
+    def prefixed(self, prefix):
+        """The content with ``prefix`` written into the bytes just before it, as one memoryview."""
+        self.straighten()
+        if len(prefix) > self.headroom + self.start:
+            raise ValueError("Not enough headroom for the prefix")
+        begin = self.headroom + self.start - len(prefix)
+        self.buffer[begin:begin + len(prefix)] = prefix
+        return memoryview(self.buffer)[begin:self.headroom + self.start + self.size]
+
+    def read(self, length):
+        """Copy out and consume the oldest ``length`` bytes."""
+        regions = self.regions()
+        head = regions[0][:length]
+        if len(head) < length and len(regions) > 1:
+            data = b''.join((head, regions[1][:length - len(head)]))
+        else:
+            data = bytes(head)
+        self.consume(len(data))
+        return data
+
+    def consume(self, length):
+        """Drop the oldest ``length`` bytes."""
+        length = min(length, self.size)
+        self.size -= length
+        self.start = (self.start + length) % self.capacity if self.size else 0
+
+    def detach(self):
+        """Move the content to a new bytearray, leaving the old one to the views still using it.
+
+        For a job that outlives the turn it was reading: the buffer can be
+        cleared and reused without overwriting the audio under it.
+        """
+        buffer = bytearray(len(self.buffer))
+        buffer[:] = self.buffer
+        self.buffer = buffer
+
+    def clear(self):
+        self.start = 0
+        self.size = 0
+
+    def shrink(self, capacity):
+        """Give back memory beyond ``capacity`` while the buffer is empty. Returns the bytes freed.
+
+        Views still using the old bytearray keep it, like after ``detach``.
+        """
+        if self.size or self.capacity <= capacity:
+            return 0
+        freed = self.capacity - capacity
+        self.buffer = bytearray(self.headroom + capacity)
+        self.capacity = capacity
+        self.start = 0
+        return freed
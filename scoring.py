@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""Conversation quality scores, computed incrementally as the response streams in.
+
+The scores are the same as the original ``calculate_quality_scores``:
+
+- ``response_length``           words in the response / 20, capped at 1
+- ``corporate_buzzword_score``  distinct buzzwords found anywhere in the
+  lowercased response, as substrings / 3, capped at 1
+- ``engagement_score``          1 if the user asked a question and the
+  response is over 10 characters, or the response asks one, else 0.5
+
+Buzzwords are found with one alternation of them all, compiled once per
+scorer, and a response stops being searched once it has all of them.
+Each chunk is lowercased once and scanned together with the tail of the
+previous one, so words split across partial texts are still found. The
+alternation tries the longest buzzword first, and a buzzword contained in
+a longer one is counted with it. After a match the scan goes on from the
+next character, so that overlapping buzzwords are found too. Words are counted by carrying over
+whether the previous chunk ended inside a word.
+"""
+
+import os
+import re
+
+BUZZWORDS = (
+    "synergize", "leverage", "optimize", "streamline", "deliverables",
+    "strategic", "value-added", "robust", "collaborative", "facilitate",
+)
+
+
+class ScoreState:
+    """Running counters of one response."""
+
+    __slots__ = ("scorer", "user_question", "words", "chars", "in_word", "question", "missing", "tail")
+
+    def __init__(self, scorer, user_input):
+        self.scorer = scorer
+        self.user_question = "?" in user_input
+        self.words = 0
+        self.chars = 0
+        self.in_word = False
+        self.question = False
+        self.missing = scorer.buzzwords  # Buzzwords not found yet
+        self.tail = ""  # Lowercased end of the response, as long as the longest buzzword minus one
+
+    def feed(self, text):
+        self.scorer.feed(self, text)
+
+    def scores(self):
+        return self.scorer.scores(self)
+
+
+class QualityScorer:
+    """Compiled buzzword vocabulary. Per-response counters live in a ScoreState."""
+
+    def __init__(self, buzzwords=BUZZWORDS, word_cap=20, buzzword_cap=3):
+        self.buzzwords = tuple(dict.fromkeys(word.lower() for word in buzzwords if word))
+        self.word_cap = word_cap
+        self.buzzword_cap = buzzword_cap
+        self.overlap = max(map(len, self.buzzwords), default=1) - 1
+        # Buzzwords found along with each buzzword: itself and those it contains
+        self.contained = {word: tuple(other for other in self.buzzwords if other in word) for word in self.buzzwords}
+        self.pattern = re.compile("|".join(map(re.escape, sorted(self.buzzwords, key=len, reverse=True))))
+
+    def new_state(self, user_input=""):
+        return ScoreState(self, user_input)
+
+    def feed(self, state, text):
+        if not text:
+            return
+        words = len(text.split())
+        if words and state.in_word and not text[0].isspace():
+            words -= 1  # The chunk continues the previous chunk's last word
+        state.words += words
+        state.in_word = not text[-1].isspace()
+        state.chars += len(text)
+        state.question = state.question or "?" in text
+
+        if state.missing:
+            window = state.tail + text.lower()
+            match = self.pattern.search(window)
+            while match:
+                found = self.contained[match.group()]
+                if any(word in found for word in state.missing):
+                    state.missing = tuple(word for word in state.missing if word not in found)
+                    if not state.missing:
+                        break
+                match = self.pattern.search(window, match.start() + 1)
+            state.tail = window[-self.overlap:] if self.overlap else ""
+
+    def scores(self, state):
+        return {
+            "response_length": min(state.words / self.word_cap, 1.0),
+            "corporate_buzzword_score": min((len(self.buzzwords) - len(state.missing)) / self.buzzword_cap, 1.0),
+            "engagement_score": 1.0 if (state.user_question and state.chars > 10) or state.question else 0.5,
+        }
+
+    def score(self, user_input, response):
+        """Score a whole response in one pass."""
+        state = self.new_state(user_input)
+        self.feed(state, response)
+        return self.scores(state)
+
+    def score_many(self, transcripts):
+        """Score stored (user input, response) pairs."""
+        return [self.score(user_input, response) for user_input, response in transcripts]
+
+
+def create_scorer():
+    """Create a scorer with the SCORING_BUZZWORDS vocabulary, comma separated, if set."""
+    buzzwords = os.environ.get("SCORING_BUZZWORDS")
+    if buzzwords is None:
+        return QualityScorer()
+    return QualityScorer(word.strip() for word in buzzwords.split(",") if word.strip())
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""Per-user session state with idle eviction and audio memory caps.
+
+One Session per connected user owns everything that used to live in
+module-level dicts in main.py: the live request queue, buffered agent and
+user audio, VAD, detection and sharding state, the audio codec of the
+connection, the pending trace and messages waiting to go out to the
+client. Audio is buffered in PCMRingBuffers that are reused from turn to
+turn, and shrunk back to their initial size once a long turn is done.
+The SessionManager keeps a running total of the memory the buffers have
+allocated, which the caps apply to, so they can be checked without
+walking the buffers.
+"""
+
+import asyncio
+import os
+import time
+
+from audio_codecs import PCM
+from ringbuffer import PCMRingBuffer
+from watermark import AGENT_SAMPLE_RATE, USER_SAMPLE_RATE, WAV_HEADER_SIZE
+
+# Initial buffer sizes, 2 s of audio. Buffers grow as needed up to the session cap.
+AGENT_BUFFER_BYTES = 2 * AGENT_SAMPLE_RATE * 2
+USER_BUFFER_BYTES = 2 * USER_SAMPLE_RATE * 2
+
+
+class Session:
+    """State of one connected user."""
+
+    __slots__ = (
+        "user_id", "live_request_queue", "live_events", "agent_audio", "user_audio",
+        "vad_state", "detection", "shards", "codec", "encoder", "decoder", "capture", "outbox", "trace",
+        "bytes_held", "created_at", "last_seen", "closed",
+    )
+
+    def __init__(self, user_id, live_request_queue, live_events, vad_state, detection=None, shards=None,
+                 codec=PCM, max_buffer_bytes=None):
+        self.user_id = user_id
+        self.live_request_queue = live_request_queue
+        self.live_events = live_events
+        # Agent PCM of the current turn, with headroom to become a WAV file in place
+        self.agent_audio = PCMRingBuffer(AGENT_BUFFER_BYTES, max_buffer_bytes, headroom=WAV_HEADER_SIZE)
+        # User PCM of the current utterance
+        self.user_audio = PCMRingBuffer(USER_BUFFER_BYTES, max_buffer_bytes, headroom=WAV_HEADER_SIZE)
+        self.vad_state = vad_state
+        self.detection = detection  # Watermark detection state of the current utterance
+        self.shards = shards  # Shards sent and received
+        # Negotiated codec, encoding agent audio and decoding user audio
+        self.codec = codec
+        self.encoder = codec.encoder(AGENT_SAMPLE_RATE)
+        self.decoder = codec.decoder(USER_SAMPLE_RATE)
+        self.capture = None  # Number of the session in the capture log, if it is recorded
+        self.outbox = asyncio.Queue()  # Messages to the client that don't come from the agent
+        self.trace = None  # Pending trace of the current turn
+        self.bytes_held = 0  # Memory allocated by the audio buffers, counted against the caps
+        self.created_at = self.last_seen = time.monotonic()
+        self.closed = False
+
+    @property
+    def agent_job_id(self):
+        """Watermark service queue for the agent's output."""
+        return f"{self.user_id}/agent"
+
+    @property
+    def verify_job_id(self):
+        """Watermark service queue for background verification of the agent's output."""
+        return f"{self.user_id}/verify"
+
+    @property
+    def user_job_id(self):
+        """Watermark service queue for detections on the user's speech."""
+        return f"{self.user_id}/user"
+
+    def touch(self):
+        self.last_seen = time.monotonic()
+
+
+class SessionManager:
+    """Registry of live sessions.
+
+    ``max_session_bytes`` caps the memory one session's audio buffers may
+    allocate and ``max_total_bytes`` caps all sessions together. When a
+    buffer would have to grow beyond either cap, the append is refused and
+    the caller flushes the buffer early. A session's initial buffers are
+    counted but never refused.
+    """
+
+    def __init__(self, idle_ttl=1800.0, max_session_bytes=8_000_000, max_total_bytes=256_000_000,
+                 on_close=None):
+        self.idle_ttl = idle_ttl
+        self.max_session_bytes = max_session_bytes
+        self.max_total_bytes = max_total_bytes
+        self.on_close = on_close
+        self.sessions = {}
+        self.total_bytes = 0
+        self.evicted = 0
+        self.refused = 0
+
+    def open(self, user_id, live_request_queue, live_events, vad_state, detection=None, shards=None, codec=PCM):
+        """Register a new session, closing any previous one of the same user."""
+        previous = self.sessions.get(user_id)
+        if previous is not None:
+            self.close(previous)
+        session = Session(
+            user_id, live_request_queue, live_events, vad_state, detection, shards, codec, self.max_session_bytes,
+        )
+        allocated = session.agent_audio.allocated() + session.user_audio.allocated()
+        session.bytes_held += allocated
+        self.total_bytes += allocated
+        self.sessions[user_id] = session
+        return session
+
+    def get(self, user_id):
+        session = self.sessions.get(user_id)
+        if session is not None:
+            session.touch()
+        return session
+
+    def close(self, session):
+        """Close the session's live queue and release its buffers."""
+        if session.closed:
+            return
+        session.closed = True
+        session.live_request_queue.close()
+        self.release(session, session.bytes_held)
+        session.agent_audio.clear()
+        session.user_audio.clear()
+        if self.sessions.get(session.user_id) is session:
+            del self.sessions[session.user_id]
+        if self.on_close is not None:
+            self.on_close(session)
+
+    def reserve(self, session, size):
+        if (session.bytes_held + size > self.max_session_bytes
+                or self.total_bytes + size > self.max_total_bytes):
+            self.refused += 1
+            return False
+        session.bytes_held += size
+        self.total_bytes += size
+        return True
+
+    def release(self, session, size):
+        session.bytes_held -= size
+        self.total_bytes -= size
+
+    def buffer_audio(self, session, buffer, chunk):
+        """Append to one of the session's buffers, reserving what it has to grow by."""
+        capacity = buffer.capacity_for(len(buffer) + len(chunk))
+        if capacity is None:
+            self.refused += 1
+            return False
+        if capacity > buffer.capacity and not self.reserve(session, capacity - buffer.capacity):
+            return False
+        buffer.append(chunk)
+        return True
+
+    def clear_audio(self, session, buffer, initial_bytes):
+        buffer.clear()
+        self.release(session, buffer.shrink(initial_bytes))
+
+    def buffer_agent_audio(self, session, chunk):
+        """Buffer agent audio. Returns False if it would exceed a memory cap."""
+        return self.buffer_audio(session, session.agent_audio, chunk)
+
+    def clear_agent_audio(self, session):
+        """Empty the agent audio buffer once its content has been sent."""
+        self.clear_audio(session, session.agent_audio, AGENT_BUFFER_BYTES)
+
+    def buffer_user_audio(self, session, chunk):
+        """Buffer user audio. Returns False if it would exceed a memory cap."""
+        return self.buffer_audio(session, session.user_audio, chunk)
+
+    def consume_user_audio(self, session, length):
+        """Drop the oldest ``length`` bytes of buffered user audio."""
+        session.user_audio.consume(length)
+
+    def clear_user_audio(self, session):
+        """Empty the user audio buffer."""
+        self.clear_audio(session, session.user_audio, USER_BUFFER_BYTES)
+
+    def evict_idle(self):
+        """Close sessions idle for longer than the TTL. Returns how many were closed."""
+        deadline = time.monotonic() - self.idle_ttl
+        idle = [session for session in self.sessions.values() if session.last_seen < deadline]
+        for session in idle:
+            print(f"Evicting idle session #{session.user_id}")
+            self.close(session)
+        self.evicted += len(idle)
+        return len(idle)
+
+    async def run_eviction(self, interval=60.0):
+        """Evict idle sessions periodically, until cancelled."""
+        while True:
+            await asyncio.sleep(interval)
+            self.evict_idle()
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            "sessions": len(self.sessions),
+            "bytes_held": self.total_bytes,
+            "bytes_buffered": sum(
+                len(session.agent_audio) + len(session.user_audio) for session in self.sessions.values()
+            ),
+            "evicted": self.evicted,
+            "refused_appends": self.refused,
+            "per_session": [
+                {
+                    "user_id": session.user_id,
+                    "bytes_held": session.bytes_held,
+                    "bytes_buffered": len(session.agent_audio) + len(session.user_audio),
+                    "idle_seconds": round(now - session.last_seen, 1),
+                    "age_seconds": round(now - session.created_at, 1),
+                }
+                for session in self.sessions.values()
+            ],
+        }
+
+
+def create_session_manager(on_close=None):
+    """Create a manager configured from the environment."""
+    return SessionManager(
+        idle_ttl=float(os.environ.get("SESSION_IDLE_TTL", 1800)),
+        max_session_bytes=int(os.environ.get("SESSION_MAX_AUDIO_BYTES", 8_000_000)),
+        max_total_bytes=int(os.environ.get("SESSIONS_MAX_AUDIO_BYTES", 256_000_000)),
+        on_close=on_close,
+    )
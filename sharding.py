@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""Hidden messages of any length, sharded across consecutive turns.
+
+An audiowmark payload is 16 bytes, so ``encode_message`` used to cut every
+secret to 16 bytes. With a WATERMARK_SECRET set, the secret is split into
+shards instead, each one a full payload:
+
+    byte 0      message id, from a hash of the secret
+    byte 1      shard index
+    byte 2      shard count
+    byte 3      CRC-8 of the other 15 bytes
+    bytes 4-15  12 bytes of the secret, the last shard padded with zeros
+
+Shards are sent in order and then over again, so a listener that missed
+one gets it on the next round. A turn carries one shard per
+``min_seconds`` of audio, each in its own piece of the turn. A turn shorter
+than that is still watermarked with the next shard, but the shard is sent
+again in the next turn as it is unlikely to be decoded.
+
+On the receiving side, payloads that pass the CRC are collected per
+message id, duplicates from overlapping windows and repeated rounds are
+ignored, and the message is published once every shard has arrived. Any
+other payload is a plain 16-byte message. The CRC makes one of those pass
+for a shard by chance 1 time in 256, but the fixed messages of
+WATERMARK_MESSAGES don't.
+
+Throughput is reported as hidden bytes per minute of speech: new shard
+bytes sent per minute of agent audio, and new shard bytes received per
+minute of user speech.
+"""
+
+import hashlib
+import os
+
+from collections import OrderedDict
+from typing import NamedTuple
+from watermark import AGENT_SAMPLE_RATE, USER_SAMPLE_RATE, pick_watermark_message
+
+SHARD_BYTES = 16  # One audiowmark payload
+HEADER_BYTES = 4
+PAYLOAD_BYTES = SHARD_BYTES - HEADER_BYTES
+MAX_SHARDS = 255
+MAX_MESSAGE_BYTES = MAX_SHARDS * PAYLOAD_BYTES
+
+
+def crc_table(polynomial=0x07):
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ polynomial if crc & 0x80 else crc << 1) & 0xFF
+        table.append(crc)
+    return bytes(table)
+
+
+CRC_TABLE = crc_table()
+
+
+def crc8(data):
+    """CRC-8 with the ATM polynomial."""
+    crc = 0
+    for byte in data:
+        crc = CRC_TABLE[crc ^ byte]
+    return crc
+
+
+class Shard(NamedTuple):
+    """One decoded shard of a message."""
+    msg_id: int
+    index: int
+    total: int
+    payload: bytes
+
+
+def message_id(data):
+    return hashlib.blake2b(data, digest_size=1).digest()[0]
+
+
+def split_message(data, msg_id=None):
+    """Split bytes into shards, as hex payloads ready to embed."""
+    if not data:
+        raise ValueError("Nothing to shard")
+    if len(data) > MAX_MESSAGE_BYTES:
+        raise ValueError(f"Message of {len(data)} bytes is over the {MAX_MESSAGE_BYTES} bytes 255 shards can carry")
+    if msg_id is None:
+        msg_id = message_id(data)
+    total = -(-len(data) // PAYLOAD_BYTES)
+    shards = []
+    for index in range(total):
+        payload = data[index * PAYLOAD_BYTES:(index + 1) * PAYLOAD_BYTES].ljust(PAYLOAD_BYTES, b'\0')
+        header = bytes((msg_id, index, total))
+        shards.append((header + bytes((crc8(header + payload),)) + payload).hex())
+    return shards
+
+
+def parse_shard(hex_str):
+    """Decode a hex payload into a Shard, or None if it isn't one."""
+    try:
+        frame = bytes.fromhex(hex_str)
+    except (TypeError, ValueError):
+        return None
+    if len(frame) != SHARD_BYTES:
+        return None
+    msg_id, index, total, crc = frame[:HEADER_BYTES]
+    payload = frame[HEADER_BYTES:]
+    if index >= total or crc8(frame[:3] + payload) != crc:
+        return None
+    return Shard(msg_id, index, total, payload)
+
+
+class ShardState:
+    """Per-session sharding state: the next shard to send and the shards received."""
+
+    __slots__ = ("position", "partial", "completed")
+
+    def __init__(self):
+        self.position = 0  # Shards sent so far, the next one is position % shard count
+        self.partial = OrderedDict()  # msg_id -> (total, {index: payload}) of messages still incomplete
+        self.completed = OrderedDict()  # msg_id -> total of messages already published
+
+
+class Sharding:
+    """Schedules the shards of ``secret`` across turns and reassembles received ones.
+
+    Without a secret, every turn carries one of the fixed WATERMARK_MESSAGES
+    as before, and only receiving is sharded.
+    """
+
+    max_messages = 16  # Incomplete and completed message ids remembered per session
+
+    def __init__(self, secret=None, min_seconds=3.0):
+        self.shards = split_message(secret.encode()) if secret else None
+        self.min_seconds = min_seconds
+        self.stats = {
+            "turns": 0,
+            "short_turns": 0,
+            "shards_sent": 0,
+            "sent_bytes": 0,
+            "agent_seconds": 0.0,
+            "shards_received": 0,
+            "duplicate_shards": 0,
+            "received_bytes": 0,
+            "messages": 0,
+            "user_seconds": 0.0,
+        }
+
+    def new_state(self):
+        return ShardState()
+
+    def next_payload(self, state):
+        """The payload of the next turn, when its length isn't known yet."""
+        if self.shards is None:
+            return pick_watermark_message()
+        return self.shards[state.position % len(self.shards)]
+
+    def plan(self, state, seconds):
+        """Payloads for a turn of ``seconds``, one per equal piece of it, and move on past them."""
+        if self.shards is None:
+            self.end_turn(state, seconds, 0)
+            return [pick_watermark_message()]
+        count = max(int(seconds // self.min_seconds), 1)
+        payloads = [self.shards[(state.position + i) % len(self.shards)] for i in range(count)]
+        self.end_turn(state, seconds, count)
+        return payloads
+
+    def end_turn(self, state, seconds, count=1):
+        """Count ``count`` shards as sent in a turn of ``seconds``, unless it was too short to carry them."""
+        self.stats["turns"] += 1
+        self.stats["agent_seconds"] += seconds
+        if self.shards is None or not count:
+            return
+        if seconds < self.min_seconds:
+            self.stats["short_turns"] += 1
+            return
+        # Shards are only new bytes on the first round
+        new = max(min(state.position + count, len(self.shards)) - state.position, 0)
+        state.position += count
+        self.stats["shards_sent"] += count
+        self.stats["sent_bytes"] += new * PAYLOAD_BYTES
+
+    def hear(self, pcm_bytes, sample_rate=USER_SAMPLE_RATE):
+        """Count user speech, for the received throughput."""
+        self.stats["user_seconds"] += pcm_bytes / (2 * sample_rate)
+
+    def receive(self, state, hex_str):
+        """Take a detected payload.
+
+        Returns (shard, message): shard is None if the payload is a plain
+        message, and message is the reassembled bytes once the last missing
+        shard of a message arrives.
+        """
+        shard = parse_shard(hex_str)
+        if shard is None:
+            return None, None
+        self.stats["shards_received"] += 1
+        if state.completed.get(shard.msg_id) == shard.total:
+            self.stats["duplicate_shards"] += 1
+            return shard, None
+        total, payloads = state.partial.get(shard.msg_id, (shard.total, {}))
+        if total != shard.total:
+            # Another message with the same id, start over
+            payloads = {}
+        if shard.index in payloads:
+            self.stats["duplicate_shards"] += 1
+            return shard, None
+        payloads[shard.index] = shard.payload
+        self.stats["received_bytes"] += PAYLOAD_BYTES
+        state.partial[shard.msg_id] = (shard.total, payloads)
+        state.partial.move_to_end(shard.msg_id)
+        remember(state.partial, self.max_messages)
+        if len(payloads) < shard.total:
+            return shard, None
+
+        del state.partial[shard.msg_id]
+        state.completed[shard.msg_id] = shard.total
+        remember(state.completed, self.max_messages)
+        self.stats["messages"] += 1
+        message = b''.join(payloads[index] for index in range(shard.total)).rstrip(b'\0')
+        return shard, message
+
+    def throughput(self):
+        """Stats with hidden bytes per minute of agent audio and of user speech."""
+        stats = self.stats
+        return {
+            **stats,
+            "agent_seconds": round(stats["agent_seconds"], 1),
+            "user_seconds": round(stats["user_seconds"], 1),
+            "sent_bytes_per_minute": per_minute(stats["sent_bytes"], stats["agent_seconds"]),
+            "received_bytes_per_minute": per_minute(stats["received_bytes"], stats["user_seconds"]),
+        }
+
+
+def remember(entries, limit):
+    while len(entries) > limit:
+        entries.popitem(last=False)
+
+
+def per_minute(count, seconds):
+    return round(60 * count / seconds, 1) if seconds else 0.0
+
+
+def pcm_seconds(length, sample_rate=AGENT_SAMPLE_RATE):
+    return length / (2 * sample_rate)
+
+
+def split_pcm(pcm, count):
+    """Cut PCM into ``count`` pieces of whole samples, the last one taking the remainder."""
+    view = memoryview(pcm)
+    size = len(view) // count & ~1
+    return [view[i * size:(i + 1) * size if i < count - 1 else len(view)] for i in range(count)]
+
+
+def create_sharding():
+    """Create sharding configured from the environment."""
+    return Sharding(
+        secret=os.environ.get("WATERMARK_SECRET") or None,
+        min_seconds=float(os.environ.get("WATERMARK_SHARD_SECONDS", 3.0)),
+    )
@@ -3,18 +3,48 @@
  */
 
 /**
- * SSE (Server-Sent Events) handling
+ * Server connection: WebSocket with binary audio frames, SSE as a fallback
  */
 
-// Connect the server with SSE
+// Connect the server with WebSocket, or SSE if WebSocket isn't available
 const sessionId = Math.random().toString().substring(10);
+const ws_url =
+  "ws://" + window.location.host + "/ws/" + sessionId;
 const sse_url =
   "http://" + window.location.host + "/events/" + sessionId;
 const send_url =
   "http://" + window.location.host + "/send/" + sessionId;
+const stream_url =
+  "http://" + window.location.host + "/stream/" + sessionId;
+let websocket = null;
 let eventSource = null;
+let useWebSocket = "WebSocket" in window;
 let is_audio = false;
 
+// Binary audio frames: 1 byte type, 1 reserved byte, 2 bytes sequence number, then audio
+const FRAME_HEADER_SIZE = 4;
+const FRAME_AUDIO_PCM = 1;
+const FRAME_AUDIO_MULAW = 2;
+let audioFrameSequence = 0;
+
+// Audio codecs offered to the server, most preferred first. PCM keeps the
+// watermark intact. μ-law halves the audio bytes both ways but wears the
+// watermark down: put it first to trade one for the other. The server says
+// which one it picked in a {"codec": name} message, until then audio is PCM
+const OFFERED_CODECS = "pcm,mulaw";
+let audioCodec = "pcm";
+
+// Upload cadence: the recorder posts RECORDER_FRAME_MS frames,
+// which are coalesced and sent every UPLOAD_INTERVAL_MS
+const RECORDER_FRAME_MS = 100;
+const UPLOAD_INTERVAL_MS = 200;
+
+// Without a WebSocket, audio goes up one long-lived streaming request body
+// where the browser supports it, and one raw POST per interval otherwise
+let uploadStreamsSupported = supportsRequestStreams();
+let uploadController = null;
+let uploadCodec = "pcm";
+
 // Get DOM elements
 const messageForm = document.getElementById("messageForm");
 const messageInput = document.getElementById("message");
@@ -31,125 +61,231 @@ if (window.location.port === '8001') {
   agentTitle.textContent = "Agent A (Alice)";
 }
 
-// SSE handlers
-function connectSSE() {
-  // Connect to SSE endpoint
-  eventSource = new EventSource(sse_url + "?is_audio=" + is_audio);
-
-  // Handle connection open
-  eventSource.onopen = function () {
-    // Connection opened messages
-    console.log("SSE connection opened.");
-    document.getElementById("messages").textContent = "Connection opened";
+// Connect with the preferred transport
+function connect() {
+  if (useWebSocket) {
+    connectWebSocket();
+  } else {
+    connectSSE();
+  }
+}
 
-    // Enable the Send button
-    if (document.getElementById("sendButton")) {
-      document.getElementById("sendButton").disabled = false;
-    }
+// Close the current connection without triggering a reconnect
+function disconnect() {
+  if (websocket) {
+    websocket.onclose = null;
+    websocket.close();
+    websocket = null;
+  }
+  if (eventSource) {
+    eventSource.close();
+    eventSource = null;
+  }
+}
 
-    addSubmitHandler();
-    
-    // Auto-start meeting if this is Bastian (port 8001)
-    if (window.location.port === '8001') {
-      setTimeout(() => {
-        sendMessage({
-          mime_type: "text/plain",
-          data: "meeting start",
-        });
-        console.log("[AUTO-START]: Bastian initiating meeting");
-      }, 1000); // Wait 1 second after connection
-    }
+// WebSocket handlers
+function connectWebSocket() {
+  // Connect to WebSocket endpoint
+  const socket = new WebSocket(ws_url + "?is_audio=" + is_audio + "&codecs=" + OFFERED_CODECS);
+  socket.binaryType = "arraybuffer";
+  websocket = socket;
+  let opened = false;
+
+  socket.onopen = function () {
+    opened = true;
+    console.log("WebSocket connection opened.");
+    onConnectionOpen();
   };
 
-  // Handle incoming messages
-  eventSource.onmessage = function (event) {
-    // Parse the incoming message
-    const message_from_server = JSON.parse(event.data);
-    console.log("[AGENT TO CLIENT] ", message_from_server);
-
-    // Check if the turn is complete
-    // if turn complete, add new message
-    if (
-      message_from_server.turn_complete &&
-      message_from_server.turn_complete == true
-    ) {
-      currentMessageId = null;
-      
-      // Save captured audio when turn is complete
-      if (isCapturing && capturedAudioData.length > 0) {
-        // You can save ai response to wav to make sure there is a watermark embedded
-        // saveAudioToFile();
-        isCapturing = false;
+  socket.onmessage = function (event) {
+    // Binary frames carry audio, text frames carry JSON messages
+    if (event.data instanceof ArrayBuffer) {
+      const header = new DataView(event.data, 0, FRAME_HEADER_SIZE);
+      const frameType = header.getUint8(0);
+      if (frameType === FRAME_AUDIO_PCM) {
+        handleAudio(event.data.slice(FRAME_HEADER_SIZE));
+      } else if (frameType === FRAME_AUDIO_MULAW) {
+        handleAudio(mulawDecode(event.data.slice(FRAME_HEADER_SIZE)));
       }
-      
       return;
     }
+    handleServerMessage(JSON.parse(event.data));
+  };
 
-    // Check for interrupt message
-    if (
-      message_from_server.interrupted &&
-      message_from_server.interrupted === true
-    ) {
-      // Stop audio playback if it's playing
-      if (audioPlayerNode) {
-        console.log('end of audio')
-        audioPlayerNode.port.postMessage({ command: "endOfAudio" });
-      }
+  socket.onclose = function () {
+    websocket = null;
+    onConnectionClosed();
+    if (!opened) {
+      // The server or a proxy doesn't speak WebSocket: use SSE from now on
+      console.log("WebSocket unavailable, falling back to SSE.");
+      useWebSocket = false;
+      connectSSE();
       return;
     }
+    setTimeout(function () {
+      console.log("Reconnecting...");
+      connect();
+    }, 5000);
+  };
+}
 
-    // If it's audio, play it
-    if (message_from_server.mime_type == "audio/pcm" && audioPlayerNode) {
-      console.log('plays audio')
-      const audioData = base64ToArray(message_from_server.data);
-      
-      // Start capturing when first audio chunk arrives
-      if (!isCapturing) {
-        isCapturing = true;
-        capturedAudioData = [];
-      }
-      
-      // Capture audio data for saving
-      capturedAudioData.push(new Uint8Array(audioData));
-      
-      audioPlayerNode.port.postMessage(audioData);
-    }
-
-    // If it's a text, print it
-    if (message_from_server.mime_type == "text/plain") {
-      // add a new message for a new turn
-      if (currentMessageId == null) {
-        currentMessageId = Math.random().toString(36).substring(7);
-        const message = document.createElement("p");
-        message.id = currentMessageId;
-        // Append the message element to the messagesDiv
-        messagesDiv.appendChild(message);
-      }
+// SSE handlers
+function connectSSE() {
+  // Connect to SSE endpoint
+  eventSource = new EventSource(sse_url + "?is_audio=" + is_audio + "&codecs=" + OFFERED_CODECS);
 
-      // Add message text to the existing message element
-      const message = document.getElementById(currentMessageId);
-      message.textContent += message_from_server.data;
+  // Handle connection open
+  eventSource.onopen = function () {
+    console.log("SSE connection opened.");
+    onConnectionOpen();
+  };
 
-      // Scroll down to the bottom of the messagesDiv
-      messagesDiv.scrollTop = messagesDiv.scrollHeight;
-    }
+  // Handle incoming messages
+  eventSource.onmessage = function (event) {
+    handleServerMessage(JSON.parse(event.data));
   };
 
   // Handle connection close
   eventSource.onerror = function (event) {
     console.log("SSE connection error or closed.");
-    if (document.getElementById("sendButton")) {
-      document.getElementById("sendButton").disabled = true;
-    }
-    document.getElementById("messages").textContent = "Connection closed";
+    onConnectionClosed();
     eventSource.close();
     setTimeout(function () {
       console.log("Reconnecting...");
-      connectSSE();
+      connect();
     }, 5000);
   };
 }
-connectSSE();
+connect();
+
+// Connection opened, with either transport
+function onConnectionOpen() {
+  // Connection opened messages
+  document.getElementById("messages").textContent = "Connection opened";
+
+  // Enable the Send button
+  if (document.getElementById("sendButton")) {
+    document.getElementById("sendButton").disabled = false;
+  }
+
+  addSubmitHandler();
+  
+  // Auto-start meeting if this is Bastian (port 8001)
+  if (window.location.port === '8001') {
+    setTimeout(() => {
+      sendMessage({
+        mime_type: "text/plain",
+        data: "meeting start",
+      });
+      console.log("[AUTO-START]: Bastian initiating meeting");
+    }, 1000); // Wait 1 second after connection
+  }
+}
+
+// Connection closed, with either transport
+function onConnectionClosed() {
+  if (document.getElementById("sendButton")) {
+    document.getElementById("sendButton").disabled = true;
+  }
+  document.getElementById("messages").textContent = "Connection closed";
+}
+
+// Handle a JSON message from the server
+function handleServerMessage(message_from_server) {
+  console.log("[AGENT TO CLIENT] ", message_from_server);
+
+  // The codec of the audio from now on, both ways
+  if (message_from_server.codec) {
+    audioCodec = message_from_server.codec;
+    return;
+  }
+
+  // Check if the turn is complete
+  // if turn complete, add new message
+  if (
+    message_from_server.turn_complete &&
+    message_from_server.turn_complete == true
+  ) {
+    currentMessageId = null;
+    
+    // Save captured audio when turn is complete
+    if (isCapturing && capturedAudioData.length > 0) {
+      // You can save ai response to wav to make sure there is a watermark embedded
+      // saveAudioToFile();
+      isCapturing = false;
+    }
+    
+    return;
+  }
+
+  // Check for interrupt message
+  if (
+    message_from_server.interrupted &&
+    message_from_server.interrupted === true
+  ) {
+    // Stop audio playback if it's playing
+    if (audioPlayerNode) {
+      console.log('end of audio')
+      audioPlayerNode.port.postMessage({ command: "endOfAudio" });
+    }
+    return;
+  }
+
+  // Check for a watermark found in our speech
+  if (message_from_server.watermark_detected === true) {
+    const message = document.createElement("p");
+    message.className = "watermark";
+    message.textContent = `Watermark detected: ${message_from_server.message} (${message_from_server.hex})`;
+    messagesDiv.appendChild(message);
+    messagesDiv.scrollTop = messagesDiv.scrollHeight;
+    return;
+  }
+
+  // If it's audio, play it
+  if (message_from_server.mime_type == "audio/pcm") {
+    handleAudio(base64ToArray(message_from_server.data));
+  } else if (message_from_server.mime_type == "audio/pcmu") {
+    handleAudio(mulawDecode(base64ToArray(message_from_server.data)));
+  }
+
+  // If it's a text, print it
+  if (message_from_server.mime_type == "text/plain") {
+    // add a new message for a new turn
+    if (currentMessageId == null) {
+      currentMessageId = Math.random().toString(36).substring(7);
+      const message = document.createElement("p");
+      message.id = currentMessageId;
+      // Append the message element to the messagesDiv
+      messagesDiv.appendChild(message);
+    }
+
+    // Add message text to the existing message element
+    const message = document.getElementById(currentMessageId);
+    message.textContent += message_from_server.data;
+
+    // Scroll down to the bottom of the messagesDiv
+    messagesDiv.scrollTop = messagesDiv.scrollHeight;
+  }
+}
+
+// Play an ArrayBuffer of 16-bit PCM from the agent
+function handleAudio(audioData) {
+  if (!audioPlayerNode) {
+    return;
+  }
+  console.log('plays audio')
+  
+  // Start capturing when first audio chunk arrives
+  if (!isCapturing) {
+    isCapturing = true;
+    capturedAudioData = [];
+  }
+  
+  // Capture audio data for saving
+  capturedAudioData.push(new Uint8Array(audioData));
+  
+  audioPlayerNode.port.postMessage(audioData);
+}
 
 // Populate device lists
 async function populateDevices() {
@@ -211,8 +347,12 @@ function addSubmitHandler() {
   };
 }
 
-// Send a message to the server via HTTP POST
+// Send a message to the server, over the WebSocket if it's open, otherwise via HTTP POST
 async function sendMessage(message) {
+  if (websocket && websocket.readyState === WebSocket.OPEN) {
+    websocket.send(JSON.stringify(message));
+    return;
+  }
   try {
     const response = await fetch(send_url, {
       method: 'POST',
@@ -255,13 +395,14 @@ let micStream;
 let capturedAudioData = [];
 let isCapturing = false;
 
-// Audio buffering for 0.2s intervals
+// Audio buffering for UPLOAD_INTERVAL_MS intervals
 let audioBuffer = [];
 let bufferTimer = null;
 
 // Import the audio worklets
 import { startAudioPlayerWorklet } from "./audio-player.js";
 import { startAudioRecorderWorklet } from "./audio-recorder.js";
+import { mulawDecode, mulawEncode } from "./mulaw.js";
 
 // Start audio
 function startAudio() {
@@ -274,7 +415,7 @@ function startAudio() {
     audioPlayerContext = ctx;
   });
   // Start audio input
-  startAudioRecorderWorklet(audioRecorderHandler, selectedInputId).then(
+  startAudioRecorderWorklet(audioRecorderHandler, selectedInputId, RECORDER_FRAME_MS).then(
     ([node, ctx, stream]) => {
       audioRecorderNode = node;
       audioRecorderContext = ctx;
@@ -290,8 +431,8 @@ startAudioButton.addEventListener("click", () => {
   startAudioButton.disabled = true;
   startAudio();
   is_audio = true;
-  eventSource.close(); // close current connection
-  connectSSE(); // reconnect with the audio mode
+  disconnect(); // close current connection
+  connect(); // reconnect with the audio mode
 });
 
 // Audio recorder handler
@@ -301,11 +442,11 @@ function audioRecorderHandler(pcmData) {
   
   // Start timer if not already running
   if (!bufferTimer) {
-    bufferTimer = setInterval(sendBufferedAudio, 200); // 0.2 seconds
+    bufferTimer = setInterval(sendBufferedAudio, UPLOAD_INTERVAL_MS);
   }
 }
 
-// Send buffered audio data every 0.2 seconds
+// Send buffered audio data every UPLOAD_INTERVAL_MS
 function sendBufferedAudio() {
   if (audioBuffer.length === 0) {
     return;
@@ -326,16 +467,85 @@ function sendBufferedAudio() {
   }
   
   // Send the combined audio data
-  sendMessage({
-    mime_type: "audio/pcm",
-    data: arrayBufferToBase64(combinedBuffer.buffer),
-  });
+  sendAudio(combinedBuffer);
   console.log("[CLIENT TO AGENT] sent %s bytes", combinedBuffer.byteLength);
   
   // Clear the buffer
   audioBuffer = [];
 }
 
+// Send PCM as a binary WebSocket frame, into the streaming upload, or as a raw POST body,
+// in the negotiated codec
+function sendAudio(pcmBytes) {
+  const mulaw = audioCodec === "mulaw";
+  const audioBytes = mulaw ? mulawEncode(pcmBytes) : pcmBytes;
+  if (websocket && websocket.readyState === WebSocket.OPEN) {
+    const frame = new Uint8Array(FRAME_HEADER_SIZE + audioBytes.byteLength);
+    const header = new DataView(frame.buffer, 0, FRAME_HEADER_SIZE);
+    header.setUint8(0, mulaw ? FRAME_AUDIO_MULAW : FRAME_AUDIO_PCM);
+    header.setUint16(2, audioFrameSequence, true);
+    audioFrameSequence = (audioFrameSequence + 1) & 0xffff;
+    frame.set(audioBytes, FRAME_HEADER_SIZE);
+    websocket.send(frame.buffer);
+    return;
+  }
+  if (uploadStreamsSupported) {
+    // An upload keeps the codec it was opened with
+    if (!uploadController) {
+      startUploadStream(audioCodec);
+    }
+    uploadController.enqueue(uploadCodec === "mulaw" ? mulawEncode(pcmBytes) : pcmBytes);
+    return;
+  }
+  fetch(send_url, {
+    method: 'POST',
+    headers: {
+      'Content-Type': mulaw ? 'audio/pcmu' : 'application/octet-stream',
+    },
+    body: audioBytes,
+  }).catch((error) => console.error('Error sending audio:', error));
+}
+
+// Feature detection for fetch() with a ReadableStream body
+function supportsRequestStreams() {
+  let duplexAccessed = false;
+  const hasContentType = new Request('', {
+    body: new ReadableStream(),
+    method: 'POST',
+    get duplex() {
+      duplexAccessed = true;
+      return 'half';
+    },
+  }).headers.has('Content-Type');
+  return duplexAccessed && !hasContentType;
+}
+
+// Open a long-lived upload whose body is fed from sendAudio()
+function startUploadStream(codec) {
+  uploadCodec = codec;
+  const body = new ReadableStream({
+    start(controller) {
+      uploadController = controller;
+    },
+  });
+  fetch(stream_url, {
+    method: 'POST',
+    headers: {
+      'Content-Type': codec === "mulaw" ? 'audio/pcmu' : 'application/octet-stream',
+    },
+    body: body,
+    duplex: 'half',
+  }).then(() => {
+    // The server ended the upload, e.g. after a reconnect: open a new one on the next send
+    uploadController = null;
+  }).catch((error) => {
+    // Streaming uploads need HTTP/2 in some browsers: use plain POSTs from now on
+    console.log('Streaming upload unavailable, falling back to POST:', error);
+    uploadController = null;
+    uploadStreamsSupported = false;
+  });
+}
+
 // Stop audio recording and cleanup
 function stopAudioRecording() {
   if (bufferTimer) {
@@ -349,17 +559,6 @@ function stopAudioRecording() {
   }
 }
 
-// Encode an array buffer with Base64
-function arrayBufferToBase64(buffer) {
-  let binary = "";
-  const bytes = new Uint8Array(buffer);
-  const len = bytes.byteLength;
-  for (let i = 0; i < len; i++) {
-    binary += String.fromCharCode(bytes[i]);
-  }
-  return window.btoa(binary);
-}
-
 // Save captured audio to file
 function saveAudioToFile() {
   // Calculate total length
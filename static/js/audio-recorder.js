@@ -4,7 +4,7 @@
 
 let micStream;
 
-export async function startAudioRecorderWorklet(audioRecorderHandler, selectedDeviceId = null) {
+export async function startAudioRecorderWorklet(audioRecorderHandler, selectedDeviceId = null, frameMs = 100) {
   // Create an AudioContext
   const audioRecorderContext = new AudioContext({ sampleRate: 16000 });
   console.log("AudioContext sample rate:", audioRecorderContext.sampleRate);
@@ -24,10 +24,16 @@ export async function startAudioRecorderWorklet(audioRecorderHandler, selectedDe
   micStream = await navigator.mediaDevices.getUserMedia(constraints);
   const source = audioRecorderContext.createMediaStreamSource(micStream);
 
-  // Create an AudioWorkletNode that uses the PCMProcessor
+  // Create an AudioWorkletNode that uses the PCMProcessor,
+  // posting frames of frameMs instead of every 128-sample render quantum
   const audioRecorderNode = new AudioWorkletNode(
     audioRecorderContext,
-    "pcm-recorder-processor"
+    "pcm-recorder-processor",
+    {
+      processorOptions: {
+        frameSize: Math.round(audioRecorderContext.sampleRate * frameMs / 1000),
+      },
+    }
   );
 
   // Connect the microphone source to the worklet.
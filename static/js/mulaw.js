@@ -0,0 +1,39 @@
+/**
+ * G.711 μ-law, the same as audio_codecs.py on the server
+ */
+
+const MULAW_BIAS = 0x84;
+const MULAW_CLIP = 32635;
+
+// 16-bit sample of each μ-law byte
+const MULAW_DECODE = new Int16Array(256);
+for (let byte = 0; byte < 256; byte++) {
+    const inverted = ~byte & 0xff;
+    const exponent = (inverted >> 4) & 0x07;
+    const magnitude = ((((inverted & 0x0f) << 3) + MULAW_BIAS) << exponent) - MULAW_BIAS;
+    MULAW_DECODE[byte] = inverted & 0x80 ? -magnitude : magnitude;
+}
+
+// Uint8Array of 16-bit PCM to a Uint8Array of μ-law, one byte per sample
+export function mulawEncode(pcmBytes) {
+    const samples = new Int16Array(pcmBytes.buffer, pcmBytes.byteOffset, pcmBytes.byteLength >> 1);
+    const encoded = new Uint8Array(samples.length);
+    for (let i = 0; i < samples.length; i++) {
+        const sign = samples[i] < 0 ? 0x80 : 0;
+        const magnitude = Math.min(Math.abs(samples[i]), MULAW_CLIP) + MULAW_BIAS;
+        const exponent = Math.max(31 - Math.clz32(magnitude >> 7), 0);
+        const mantissa = (magnitude >> (exponent + 3)) & 0x0f;
+        encoded[i] = ~(sign | (exponent << 4) | mantissa) & 0xff;
+    }
+    return encoded;
+}
+
+// ArrayBuffer of μ-law to an ArrayBuffer of 16-bit PCM
+export function mulawDecode(data) {
+    const bytes = new Uint8Array(data);
+    const samples = new Int16Array(bytes.length);
+    for (let i = 0; i < bytes.length; i++) {
+        samples[i] = MULAW_DECODE[bytes[i]];
+    }
+    return samples.buffer;
+}
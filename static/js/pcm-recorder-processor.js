@@ -1,15 +1,34 @@
 class PCMProcessor extends AudioWorkletProcessor {
-  constructor() {
+  constructor(options) {
     super();
+
+    // Coalesce 128-sample render quanta into frames of this many samples
+    // before posting them, so the main thread gets a few messages per second
+    const processorOptions = (options && options.processorOptions) || {};
+    this.frameSize = processorOptions.frameSize || 128;
+    this.frame = new Float32Array(this.frameSize);
+    this.offset = 0;
   }
 
   process(inputs, outputs, parameters) {
     if (inputs.length > 0 && inputs[0].length > 0) {
       // Use the first channel
       const inputChannel = inputs[0][0];
-      // Copy the buffer to avoid issues with recycled memory
-      const inputCopy = new Float32Array(inputChannel);
-      this.port.postMessage(inputCopy);
+      let position = 0;
+      while (position < inputChannel.length) {
+        // Copy the buffer to avoid issues with recycled memory
+        const count = Math.min(inputChannel.length - position, this.frameSize - this.offset);
+        this.frame.set(inputChannel.subarray(position, position + count), this.offset);
+        this.offset += count;
+        position += count;
+
+        if (this.offset === this.frameSize) {
+          // Transfer the full frame instead of copying it, and start a new one
+          this.port.postMessage(this.frame, [this.frame.buffer]);
+          this.frame = new Float32Array(this.frameSize);
+          this.offset = 0;
+        }
+      }
     }
     return true;
   }
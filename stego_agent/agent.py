@@ -11,46 +11,62 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-from typing import Optional
+"""Agent personas, built on first use.
+
+Building an Agent imports the ADK and its tools, which takes seconds, so
+only the personas a process actually runs are built. ``root_agent``, for
+``adk web`` and friends, is AGENT_NAME's agent, resolved on first access
+like ``alice_agent`` and the other ``<persona>_agent`` names.
+"""
 
-from google.adk.agents import Agent
-from google.adk.tools import google_search  # Import the tool
 import os
 
 # Phrases have to be long even for a short watermark. 15 words average.
 general_instructions = "You are an agent who can participate in IT company meetings and speaks corporate lingo. Give abstract answers when asked a question and ask generic questions in return. 15-20 words in average."
 
-# Create different agents with different voices
-standalone_agent = Agent(
-   name="standalone_agent",
-   model="gemini-2.0-flash-exp", 
-   description="An agent who speaks corporate lingo",
-   instruction=general_instructions,
-   tools=[google_search],
-)
-
-alice_agent = Agent(
-   name="alice_agent",
-   model="gemini-2.0-flash-exp",
-   description="Alice - corporate meeting participant",
-   instruction=f"{general_instructions}. Your name is Alice. You are in a meeting. Do not speak unless you are addressed by name, i.e. Alice. Wait for the person to finish speaking. Bastian is your teammate. After you answer a question, ask Bastian something. Remember to mention his name.",
-   tools=[google_search],
-)
-
-bastian_agent = Agent(
-   name="bastian_agent", 
-   model="gemini-2.0-flash-exp",
-   description="Bastian - corporate meeting participant who initiates meetings",
-   instruction=f"{general_instructions}. Your name is Bastian. When you receive any initial input or greeting, start the meeting by greeting everyone and asking Alice a question to begin discussion. Always address Alice by her name. After that, only respond when addressed by your name.",
-   tools=[google_search],
-)
-
-agent_name = os.environ.get("AGENT_NAME", "standalone").lower()
-print(f"Agent name: {agent_name}")
-
-if agent_name == "alice":
-    root_agent = alice_agent
-elif agent_name == "bastian":
-    root_agent = bastian_agent
-else:
-    root_agent = standalone_agent
+# Different agents with different voices
+PERSONAS = {
+    "standalone": {
+        "description": "An agent who speaks corporate lingo",
+        "instruction": general_instructions,
+    },
+    "alice": {
+        "description": "Alice - corporate meeting participant",
+        "instruction": f"{general_instructions}. Your name is Alice. You are in a meeting. Do not speak unless you are addressed by name, i.e. Alice. Wait for the person to finish speaking. Bastian is your teammate. After you answer a question, ask Bastian something. Remember to mention his name.",
+    },
+    "bastian": {
+        "description": "Bastian - corporate meeting participant who initiates meetings",
+        "instruction": f"{general_instructions}. Your name is Bastian. When you receive any initial input or greeting, start the meeting by greeting everyone and asking Alice a question to begin discussion. Always address Alice by her name. After that, only respond when addressed by your name.",
+    },
+}
+MODEL = "gemini-2.0-flash-exp"
+
+agents = {}
+
+
+def get_agent(persona=None):
+    """The agent of a persona, AGENT_NAME by default and standalone if unknown."""
+    persona = (persona or os.environ.get("AGENT_NAME", "standalone")).lower()
+    if persona not in PERSONAS:
+        persona = "standalone"
+    agent = agents.get(persona)
+    if agent is None:
+        from google.adk.agents import Agent
+        from google.adk.tools import google_search
+
+        print(f"Agent name: {persona}")
+        agent = agents[persona] = Agent(
+            name=f"{persona}_agent",
+            model=MODEL,
+            tools=[google_search],
+            **PERSONAS[persona],
+        )
+    return agent
+
+
+def __getattr__(name):
+    if name == "root_agent":
+        return get_agent()
+    if name.endswith("_agent") and name[:-len("_agent")] in PERSONAS:
+        return get_agent(name[:-len("_agent")])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""Conversation telemetry, exported in batches off the streaming path.
+
+Each session keeps the TurnTrace of its current turn, so text is only ever
+added to its own user's trace. Starting and ending a turn just append a
+record to a bounded queue. A background task drains the queue in batches
+and calls the exporter in a worker thread. Quality scores are kept up to
+date as the response streams in, so they are ready when the turn ends.
+
+Under load whole turns are shed rather than single records, so exported
+traces stay complete:
+
+- TELEMETRY_SAMPLE_RATE traces only that fraction of turns
+- once the queue is more than three quarters full, new turns aren't traced
+- if the queue is full anyway, records are dropped and counted
+"""
+
+import asyncio
+import os
+import random
+import uuid
+
+from collections import deque
+
+
+class TurnTrace:
+    """Trace of one conversation turn: the user input and the agent's response so far."""
+
+    __slots__ = ("trace_id", "user_id", "user_input", "response_parts", "scoring")
+
+    def __init__(self, user_id, user_input, scoring=None):
+        self.trace_id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.user_input = user_input
+        self.response_parts = []
+        self.scoring = scoring  # ScoreState of the response so far
+
+    def add(self, text):
+        self.response_parts.append(text)
+        if self.scoring is not None:
+            self.scoring.feed(text)
+
+
+class NullExporter:
+    """Discards records. For tests and for running without Langfuse."""
+
+    def __init__(self):
+        self.exported = 0
+
+    def export(self, records):
+        self.exported += len(records)
+
+    def flush(self):
+        pass
+
+
+class LangfuseExporter:
+    """Sends records to Langfuse, which queues and uploads them in its own thread.
+
+    Without a client, one is created from the LANGFUSE_* settings on the
+    first export, so the langfuse package isn't imported until then.
+    """
+
+    def __init__(self, client=None):
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            from langfuse import Langfuse
+
+            self._client = Langfuse(
+                public_key=os.getenv("LANGFUSE_PUBLIC_KEY"),
+                secret_key=os.getenv("LANGFUSE_SECRET_KEY"),
+                host=os.getenv("LANGFUSE_HOST"),
+            )
+        return self._client
+
+    def export(self, records):
+        for kind, fields in records:
+            if kind == "score":
+                self.client.score(**fields)
+            else:
+                # Traces are upserted by id, so this both creates and updates them
+                self.client.trace(**fields)
+
+    def flush(self):
+        # Nothing was exported if the client was never created
+        if self._client is not None:
+            self._client.flush()
+
+
+class Telemetry:
+    """Bounded queue of telemetry records with a background batching exporter."""
+
+    def __init__(self, exporter, scorer=None, max_queue=1000, batch_size=50, flush_interval=1.0, sample_rate=1.0):
+        self.exporter = exporter
+        self.scorer = scorer
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.sample_rate = sample_rate
+        self.queue = deque()
+        self.wakeup = asyncio.Event()
+        self.stats = {
+            "turns": 0,
+            "traced": 0,
+            "unsampled": 0,
+            "shed": 0,
+            "dropped": 0,
+            "exported": 0,
+            "failures": 0,
+        }
+
+    def enqueue(self, kind, fields):
+        if len(self.queue) >= self.max_queue:
+            self.stats["dropped"] += 1
+            return
+        self.queue.append((kind, fields))
+        if len(self.queue) >= self.batch_size:
+            self.wakeup.set()
+
+    def start_turn(self, user_id, user_input):
+        """Open the trace of a turn. Returns None if the turn isn't traced."""
+        self.stats["turns"] += 1
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            self.stats["unsampled"] += 1
+            return None
+        if len(self.queue) * 4 >= self.max_queue * 3:
+            self.stats["shed"] += 1
+            return None
+        turn = TurnTrace(user_id, user_input, self.scorer.new_state(user_input) if self.scorer else None)
+        self.enqueue("trace", {
+            "id": turn.trace_id,
+            "name": "conversation_turn",
+            "input": user_input,
+            "user_id": user_id,
+            "session_id": f"conversation_{user_id}",
+            "metadata": {"message_length": len(user_input)},
+        })
+        self.stats["traced"] += 1
+        return turn
+
+    def end_turn(self, turn):
+        """Complete a turn's trace with the response and its scores."""
+        if turn.response_parts:
+            self.enqueue("turn", turn)
+
+    def records(self, batch):
+        """Expand completed turns into trace updates and scores."""
+        for kind, fields in batch:
+            if kind != "turn":
+                yield kind, fields
+                continue
+            turn = fields
+            response = "".join(turn.response_parts)
+            yield "update", {"id": turn.trace_id, "output": response}
+            if turn.scoring is not None and turn.user_input:
+                for name, value in turn.scoring.scores().items():
+                    yield "score", {
+                        "trace_id": turn.trace_id,
+                        "name": name,
+                        "value": value,
+                        "comment": f"Auto-calculated {name}",
+                    }
+
+    def export(self, batch):
+        self.exporter.export(list(self.records(batch)))
+
+    async def flush(self):
+        """Export everything queued so far."""
+        while self.queue:
+            batch = [self.queue.popleft() for _ in range(min(self.batch_size, len(self.queue)))]
+            try:
+                await asyncio.to_thread(self.export, batch)
+                self.stats["exported"] += len(batch)
+            except Exception as e:
+                self.stats["failures"] += len(batch)
+                print(f"Telemetry export failed: {e}")
+
+    async def run(self):
+        """Export batches whenever one is full or the flush interval passes, until cancelled."""
+        while True:
+            if len(self.queue) < self.batch_size:
+                self.wakeup.clear()
+                try:
+                    async with asyncio.timeout(self.flush_interval):
+                        await self.wakeup.wait()
+                except TimeoutError:
+                    pass
+            await self.flush()
+
+    async def close(self):
+        await self.flush()
+        await asyncio.to_thread(self.exporter.flush)
+
+
+def create_telemetry(exporter, scorer=None):
+    """Create telemetry configured from the environment. TELEMETRY_EXPORTER=none discards everything."""
+    if os.environ.get("TELEMETRY_EXPORTER", "langfuse").lower() == "none":
+        exporter = NullExporter()
+    return Telemetry(
+        exporter,
+        scorer=scorer,
+        max_queue=int(os.environ.get("TELEMETRY_QUEUE_SIZE", 1000)),
+        batch_size=int(os.environ.get("TELEMETRY_BATCH_SIZE", 50)),
+        flush_interval=float(os.environ.get("TELEMETRY_FLUSH_INTERVAL", 1.0)),
+        sample_rate=float(os.environ.get("TELEMETRY_SAMPLE_RATE", 1.0)),
+    )
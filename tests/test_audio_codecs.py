@@ -0,0 +1,90 @@
+from array import array
+
+import pytest
+
+import audio_codecs
+from audio_codecs import (
+    MULAW_DECODE, AdpcmCodec, MuLawCodec, mulaw_decode_byte, mulaw_encode_sample, mulaw_encode_table, negotiate,
+)
+from benchmarks.bench_codecs import chunks, snr, speech_like
+from transport import FrameAggregator
+from watermark import AGENT_SAMPLE_RATE, USER_SAMPLE_RATE
+
+
+@pytest.mark.parametrize("sample_rate", [AGENT_SAMPLE_RATE, USER_SAMPLE_RATE])
+def test_mulaw_round_trip(sample_rate):
+    codec = MuLawCodec()
+    pcm = speech_like(1, sample_rate)
+    encoded = codec.encode(pcm)
+    assert len(encoded) == len(pcm) // 2
+    decoded = codec.decode(encoded)
+    assert len(decoded) == len(pcm)
+    assert snr(pcm, decoded) > 30
+
+
+def test_mulaw_decode_is_stable():
+    # Decoding then encoding any byte gives the same byte back, except negative zero
+    for byte in range(256):
+        sample = mulaw_decode_byte(byte)
+        assert MULAW_DECODE[byte] == sample
+        assert mulaw_decode_byte(mulaw_encode_sample(sample)) == sample
+
+
+def test_mulaw_encode_table_matches_the_samples(monkeypatch):
+    table = mulaw_encode_table()
+    for sample in range(-32768, 32768, 7):
+        assert table[sample & 0xFFFF] == mulaw_encode_sample(sample)
+    mulaw_encode_table.cache_clear()
+    monkeypatch.setattr(audio_codecs, "np", None)
+    assert mulaw_encode_table() == table
+    mulaw_encode_table.cache_clear()
+
+
+def test_mulaw_stdlib_matches_numpy(monkeypatch):
+    pcm = speech_like(0.5, USER_SAMPLE_RATE)
+    codec = MuLawCodec()
+    encoded = codec.encode(pcm)
+    decoded = codec.decode(encoded)
+    monkeypatch.setattr(audio_codecs, "np", None)
+    codec = MuLawCodec()
+    assert codec.encode(pcm) == encoded
+    assert codec.decode(encoded) == decoded
+
+
+def test_mulaw_drops_odd_byte():
+    assert len(MuLawCodec().encode(b'\x01\x02\x03')) == 1
+
+
+@pytest.mark.parametrize("sample_rate", [AGENT_SAMPLE_RATE, USER_SAMPLE_RATE])
+def test_adpcm_round_trip_in_chunks(sample_rate):
+    codec = AdpcmCodec()
+    pcm = speech_like(1, sample_rate)
+    encoder = codec.encoder(sample_rate)
+    decoder = codec.decoder(sample_rate)
+    decoded = b''.join(bytes(decoder.decode(encoder.encode(chunk))) for chunk in chunks(pcm, sample_rate))
+    assert len(decoded) == len(pcm)
+    assert snr(pcm, decoded) > 20
+
+
+def test_adpcm_odd_sample_count():
+    codec = AdpcmCodec()
+    pcm = array('h', [0, 1000, -1000, 2000, -2000]).tobytes()
+    assert len(codec.decode(codec.encode(pcm))) == len(pcm)
+
+
+def test_negotiate_skips_codecs_that_are_not_negotiable():
+    assert negotiate("adpcm") is audio_codecs.PCM
+    assert negotiate("adpcm, mulaw").name == "mulaw"
+    assert negotiate("unknown").name == "pcm"
+    assert negotiate(None).name == "pcm"
+
+
+def test_frame_aggregator_keeps_whole_samples():
+    aggregator = FrameAggregator(5, sample_bytes=2)
+    assert aggregator.frame_bytes == 4
+    assert aggregator.feed(b'abcdefg') == [b'abcd']
+    assert aggregator.flush() == b'ef'
+
+    aggregator = FrameAggregator(5, sample_bytes=1)
+    assert aggregator.feed(b'abcdefg') == [b'abcde']
+    assert aggregator.flush() == b'fg'
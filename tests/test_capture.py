@@ -0,0 +1,97 @@
+import json
+import os
+import subprocess
+import sys
+
+from types import SimpleNamespace
+
+import pytest
+
+from capture import (
+    AGENT_AUDIO, AGENT_TEXT, CLOSE, DETECT, EMBED, META, NO_SESSION, OPEN, PARTIAL, TURN_COMPLETE, TURN_END,
+    USER_AUDIO, CaptureLog, Recorder, audio_digest,
+)
+from watermark import Detection
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def event(text=None, audio=None, partial=False, turn_complete=False):
+    inline_data = audio and SimpleNamespace(mime_type="audio/pcm;rate=24000", data=audio)
+    part = SimpleNamespace(text=text, inline_data=inline_data)
+    content = SimpleNamespace(parts=[part]) if text or audio else None
+    return SimpleNamespace(content=content, partial=partial, turn_complete=turn_complete, interrupted=False)
+
+
+def test_recorded_log_reads_back(tmp_path):
+    path = str(tmp_path / "session.cap")
+    recorder = Recorder(path, {"watermark_mode": "turn"})
+    session = recorder.open("user", True, "pcm")
+    recorder.event(session, event(text="Hello", partial=True))
+    recorder.event(session, event(audio=b'\x01\x00' * 100))
+    recorder.event(session, event(turn_complete=True))
+    recorder.user_audio(session, b'\x02\x00' * 50)
+    recorder.embedded(b'\x01\x00' * 100, b'\x03\x00' * 100)
+    recorder.detected(b'\x03\x00' * 100, Detection("ab" * 16, 0.5, 0))
+    recorder.detected(b'\x04\x00' * 100, None)
+    recorder.close(session)
+
+    with CaptureLog(path) as log:
+        assert log.meta["watermark_mode"] == "turn"
+        records = [(record.kind, record.flags, record.session, bytes(record.payload)) for record in log]
+        sessions = {number: [record.kind for record in records] for number, records in log.sessions().items()}
+        times = [record.time for record in log]
+
+    assert [record[0] for record in records] == [
+        META, OPEN, AGENT_TEXT, AGENT_AUDIO, TURN_END, USER_AUDIO, EMBED, DETECT, DETECT, CLOSE,
+    ]
+    assert records[2] == (AGENT_TEXT, PARTIAL, session, b'Hello')
+    assert records[3][3] == b'\x01\x00' * 100
+    assert records[4][1] == TURN_COMPLETE
+    assert records[6] == (EMBED, 0, NO_SESSION, audio_digest(b'\x01\x00' * 100) + b'\x03\x00' * 100)
+    assert json.loads(records[7][3][16:])["hex"] == "ab" * 16
+    assert records[8][3] == audio_digest(b'\x04\x00' * 100)
+    assert sessions == {session: [OPEN, AGENT_TEXT, AGENT_AUDIO, TURN_END, USER_AUDIO, CLOSE]}
+    assert times == sorted(times)
+
+
+def test_log_cut_short_stops_at_the_last_whole_record(tmp_path):
+    path = str(tmp_path / "session.cap")
+    recorder = Recorder(path)
+    session = recorder.open("user", False, "pcm")
+    recorder.user_audio(session, b'\x00' * 64)
+    recorder.close(session)
+    with open(path, 'rb') as f:
+        data = f.read()
+    with open(path, 'wb') as f:
+        f.write(data[:-20])
+    with CaptureLog(path) as log:
+        assert [record.kind for record in log] == [META, OPEN]
+
+
+def test_not_a_capture_log(tmp_path):
+    path = tmp_path / "other.cap"
+    path.write_bytes(b'RIFF' + bytes(100))
+    with pytest.raises(ValueError):
+        CaptureLog(str(path))
+
+
+def run_module(module, *args, env=None):
+    return subprocess.run(
+        [sys.executable, "-m", module, *args], cwd=ROOT, env={**os.environ, **(env or {})},
+        capture_output=True, text=True, timeout=120, check=True,
+    )
+
+
+def test_replay_is_deterministic(tmp_path):
+    log = str(tmp_path / "loadgen.cap")
+    run_module("benchmarks.loadgen", "--sessions", "2", "--turns", "2", "--speed", "0", env={"CAPTURE_PATH": log})
+    reports = []
+    for name in ("first", "second"):
+        report = str(tmp_path / f"{name}.json")
+        run_module("benchmarks.replay", log, "--save", report)
+        with open(report) as f:
+            reports.append(json.load(f))
+    first, second = reports
+    assert first["detections_match"]
+    assert first["output_digest"] == second["output_digest"]
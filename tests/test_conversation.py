@@ -0,0 +1,56 @@
+import asyncio
+
+from collections import Counter
+
+import pytest
+
+from conversation import Conversation, stub_agents
+from fake_watermark import FakeWatermarkBackend
+from sharding import Sharding
+from watermark_backends import set_backend
+from watermark_service import WatermarkService
+
+
+@pytest.fixture
+def backend():
+    set_backend(FakeWatermarkBackend())
+    yield
+    set_backend(None)
+
+
+class RecordingService(WatermarkService):
+    """Keeps what each listener detected."""
+
+    def __init__(self):
+        super().__init__(max_concurrency=2, timeout=10)
+        self.heard = []
+
+    async def detect_detail(self, session_id, pcm, sample_rate, background=False):
+        detection = await super().detect_detail(session_id, pcm, sample_rate, background)
+        if detection is not None:
+            self.heard.append((session_id, detection.hex))
+        return detection
+
+
+async def converse(mode, turn_seconds, turns=4):
+    service = RecordingService()
+    start_agent = stub_agents(speed=0, turn_seconds=turn_seconds)
+    conversation = Conversation("1", service, Sharding(), start_agent, max_turns=turns, mode=mode)
+    await conversation.start()
+    await asyncio.wait_for(conversation.finished.wait(), 30)
+    return conversation, service.heard
+
+
+# Stream mode ramps up its segments over the first 3 s, too short to hold a block
+@pytest.mark.parametrize("mode, turn_seconds", [("turn", 3.0), ("stream", 6.0)])
+def test_each_turn_is_heard_by_the_other_agent(backend, mode, turn_seconds):
+    conversation, heard = asyncio.run(converse(mode, turn_seconds))
+    spoken = Counter()
+    for persona, text, messages in conversation.transcript:
+        listener = "alice" if persona == "bastian" else "bastian"
+        assert len(messages) == 1
+        spoken[(f"conversation-1-{listener}/user", messages[0])] += 1
+    assert sum(spoken.values()) == 4
+    # Every turn's payload, heard once by the agent it was said to and never by the speaker
+    assert Counter(heard) == spoken
+    assert conversation.stats["detected"] == 4
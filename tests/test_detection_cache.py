@@ -0,0 +1,63 @@
+import asyncio
+
+from detection_cache import DetectionCache
+from resample import Resampler
+from watermark import AGENT_SAMPLE_RATE, USER_SAMPLE_RATE, Detection, encode_message
+from watermark_backends import NullBackend, set_backend
+from watermark_service import WatermarkService
+
+DETECTION = Detection(encode_message("cache"), "cache", 1.0)
+PCM = bytes(range(256)) * 100
+
+
+def test_exact_repeat_hits():
+    cache = DetectionCache()
+    cache.put(cache.key(PCM, AGENT_SAMPLE_RATE), DETECTION)
+    assert cache.get(cache.key(bytes(PCM), AGENT_SAMPLE_RATE)) == DETECTION
+    assert cache.stats["hits"] == 1
+
+
+def test_other_audio_or_rate_misses():
+    cache = DetectionCache()
+    cache.put(cache.key(PCM, AGENT_SAMPLE_RATE), DETECTION)
+    assert cache.get(cache.key(PCM, USER_SAMPLE_RATE)) is None
+    assert cache.get(cache.key(PCM[2:], AGENT_SAMPLE_RATE)) is None
+    assert cache.get(cache.key(Resampler(AGENT_SAMPLE_RATE, USER_SAMPLE_RATE).process(PCM), USER_SAMPLE_RATE)) is None
+    assert cache.stats["misses"] == 3
+
+
+def test_entries_expire_and_are_evicted():
+    cache = DetectionCache(max_entries=2, ttl=-1)
+    cache.put(cache.key(PCM, AGENT_SAMPLE_RATE), DETECTION)
+    assert cache.get(cache.key(PCM, AGENT_SAMPLE_RATE)) is None
+    assert cache.stats["expired"] == 1
+
+    cache = DetectionCache(max_entries=2)
+    for i in range(3):
+        cache.put(cache.key(PCM[i * 2:], AGENT_SAMPLE_RATE), DETECTION)
+    assert cache.stats["evictions"] == 1
+    assert cache.get(cache.key(PCM, AGENT_SAMPLE_RATE)) is None
+
+
+class CountingBackend(NullBackend):
+    def __init__(self):
+        super().__init__()
+        self.decoded = 0
+
+    def get_wav(self, wav):
+        self.decoded += 1
+        return super().get_wav(wav)
+
+
+def test_service_decodes_repeated_audio_once():
+    backend = CountingBackend()
+    set_backend(backend)
+    try:
+        async def run():
+            service = WatermarkService(timeout=5, cache=DetectionCache())
+            watermarked = bytes(await service.embed("user/agent", PCM, DETECTION.hex))
+            return [await service.detect("user/user", watermarked) for _ in range(3)]
+        assert asyncio.run(run()) == [DETECTION.hex] * 3
+    finally:
+        set_backend(None)
+    assert backend.decoded == 1
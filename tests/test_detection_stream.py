@@ -0,0 +1,150 @@
+import asyncio
+
+from array import array
+
+from detection_stream import SlidingWindowDetector
+from sessions import SessionManager
+from watermark import Detection, encode_message
+
+SAMPLE_RATE = 100  # Windows of 300 samples, hops of 100
+DETECTION = Detection(encode_message("window"), "window", 1.0)
+
+
+class Queue:
+    def close(self):
+        pass
+
+
+class Service:
+    """Records the windows it is asked to decode, and finds the same message in all of them."""
+
+    def __init__(self, detection=None):
+        self.detection = detection
+        self.windows = []
+        self.gate = asyncio.Event()
+        self.gate.set()
+
+    async def detect_detail(self, job_id, window, sample_rate):
+        self.windows.append(array('h', window).tolist())
+        await self.gate.wait()
+        return self.detection
+
+
+def speech(start, seconds):
+    """Audio whose samples count up from ``start``, so windows show where they were cut."""
+    return array('h', range(start, start + int(seconds * SAMPLE_RATE))).tobytes()
+
+
+class Harness:
+    def __init__(self, detection=None, keep_going=False):
+        self.service = Service(detection)
+        self.sessions = SessionManager()
+        self.published = []
+        self.keep_going = keep_going
+        self.detector = SlidingWindowDetector(
+            self.service, self.sessions, self.on_detection, sample_rate=SAMPLE_RATE,
+        )
+        self.session = self.sessions.open("user", Queue(), None, None, detection=self.detector.new_state())
+        self.detector.start_utterance(self.session)
+        self.fed = 0
+
+    def on_detection(self, session, detection, offset):
+        self.published.append((detection.hex, offset))
+        return self.keep_going
+
+    async def feed(self, seconds, chunk_seconds=0.5):
+        for _ in range(int(seconds / chunk_seconds)):
+            self.detector.feed(self.session, speech(self.fed, chunk_seconds))
+            self.fed += int(chunk_seconds * SAMPLE_RATE)
+            await settle()
+
+    def window_starts(self):
+        return [window[0] for window in self.service.windows]
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_windows_advance_by_a_hop_and_overlap():
+    async def run():
+        harness = Harness()
+        await harness.feed(6)
+        assert harness.window_starts() == [0, 100, 200, 300]
+        for window in harness.service.windows:
+            assert window == list(range(window[0], window[0] + 300))
+        # Each window shares all but its last hop with the next one
+        for window, following in zip(harness.service.windows, harness.service.windows[1:]):
+            assert window[100:] == following[:200]
+        # Only the latest window is left buffered
+        assert len(harness.session.user_audio) == 2 * 200
+        assert harness.detector.stats["windows"] == 4
+
+    asyncio.run(run())
+
+
+def test_slow_decoding_skips_to_the_newest_window():
+    async def run():
+        harness = Harness()
+        harness.service.gate.clear()
+        await harness.feed(6)
+        assert harness.window_starts() == [0]
+        harness.service.gate.set()
+        await settle()
+        # The windows at 1 s and 2 s filled up meanwhile and are overlapped by the one at 3 s
+        assert harness.window_starts() == [0, 300]
+        assert harness.detector.stats["skipped_windows"] == 2
+
+    asyncio.run(run())
+
+
+def test_short_utterance_is_decoded_at_its_end():
+    async def run():
+        harness = Harness()
+        await harness.feed(1.5)
+        assert harness.service.windows == []
+        harness.detector.end_utterance(harness.session)
+        await settle()
+        assert harness.service.windows == [list(range(150))]
+        assert harness.detector.stats["tails"] == 1
+
+    asyncio.run(run())
+
+
+def test_repeated_message_is_published_once():
+    async def run():
+        harness = Harness(DETECTION)
+        await harness.feed(6)
+        # Every later window holds the message too, but detection stopped at the first
+        assert harness.published == [(DETECTION.hex, 0.0)]
+        assert harness.window_starts() == [0]
+        assert harness.detector.stats["stopped_early"] == 1
+
+    asyncio.run(run())
+
+
+def test_message_found_by_a_window_and_the_tail_is_published_once():
+    async def run():
+        harness = Harness(DETECTION)
+        harness.service.gate.clear()
+        await harness.feed(3.5)
+        harness.detector.end_utterance(harness.session)
+        await settle()
+        # The window at 0 s and the tail, which is all the audio after its hop, are decoded at once
+        assert harness.window_starts() == [0, 100]
+        harness.service.gate.set()
+        await settle()
+        assert harness.published == [(DETECTION.hex, 0.0)]
+        assert harness.detector.stats["detected"] == 1
+
+    asyncio.run(run())
+
+
+def test_shards_keep_detection_going():
+    async def run():
+        harness = Harness(DETECTION, keep_going=True)
+        await harness.feed(5)
+        assert harness.published == [(DETECTION.hex, 0.0), (DETECTION.hex, 1.0), (DETECTION.hex, 2.0)]
+
+    asyncio.run(run())
@@ -0,0 +1,60 @@
+import pytest
+
+import fake_watermark
+from fake_live import synthetic_speech
+from fake_watermark import FakeWatermarkBackend, add_mark, read_mark
+from resample import Resampler
+from watermark import AGENT_SAMPLE_RATE, USER_SAMPLE_RATE, add_watermark_pcm, detect_watermark_pcm, encode_message
+from watermark_backends import create_backend, set_backend
+
+MESSAGE = encode_message("fake")
+OTHER = encode_message("other")
+
+
+@pytest.fixture
+def backend():
+    backend = FakeWatermarkBackend()
+    set_backend(backend)
+    yield backend
+    set_backend(None)
+
+
+def test_detects_resampled_audio(backend):
+    # As a stub agent hears the other one
+    watermarked = add_watermark_pcm(synthetic_speech(3), MESSAGE)
+    heard = Resampler(AGENT_SAMPLE_RATE, USER_SAMPLE_RATE).process(watermarked)
+    detection = detect_watermark_pcm(heard, USER_SAMPLE_RATE)
+    assert detection is not None
+    assert detection.hex == MESSAGE
+
+
+def test_tells_apart_messages_in_the_same_audio(backend):
+    pcm = synthetic_speech(3)
+    first = add_watermark_pcm(pcm, MESSAGE)
+    second = add_watermark_pcm(pcm, OTHER)
+    assert detect_watermark_pcm(first).hex == MESSAGE
+    assert detect_watermark_pcm(second).hex == OTHER
+
+
+def test_finds_nothing_in_unmarked_or_short_audio(backend):
+    assert detect_watermark_pcm(synthetic_speech(3)) is None
+    assert detect_watermark_pcm(bytes(AGENT_SAMPLE_RATE * 6)) is None
+    assert detect_watermark_pcm(add_watermark_pcm(synthetic_speech(2), MESSAGE)) is None
+
+
+def test_finds_a_block_after_a_cut(monkeypatch):
+    # Segments marked one by one, as in stream mode, read as one stretch of audio
+    pcm = synthetic_speech(6)
+    cut = 2 * AGENT_SAMPLE_RATE  # 1 s
+    marked = add_mark(pcm[:cut], OTHER, AGENT_SAMPLE_RATE) + add_mark(pcm[cut:], MESSAGE, AGENT_SAMPLE_RATE)
+    assert read_mark(marked, AGENT_SAMPLE_RATE) == MESSAGE
+    monkeypatch.setattr(fake_watermark, "np", None)
+    assert add_mark(pcm[cut:], MESSAGE, AGENT_SAMPLE_RATE) == marked[cut:]
+    assert read_mark(marked, AGENT_SAMPLE_RATE) == MESSAGE
+
+
+def test_created_by_name(monkeypatch):
+    monkeypatch.setenv("WATERMARK_NULL_LATENCY", "0.5")
+    backend = create_backend("fake")
+    assert isinstance(backend, FakeWatermarkBackend)
+    assert backend.latency == 0.5
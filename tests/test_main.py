@@ -0,0 +1,47 @@
+import asyncio
+
+import pytest
+
+from fake_live import FakeLiveRequestQueue, audio_event, interrupted_event, synthetic_speech, text_event
+from watermark_backends import NullBackend, set_backend
+
+
+@pytest.fixture(scope="module")
+def main():
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setenv("WATERMARK_BACKEND", "null")
+        patch.setenv("TELEMETRY_EXPORTER", "none")
+        patch.setenv("GOOGLE_API_KEY", "offline")
+        import main
+    set_backend(NullBackend())
+    yield main
+    set_backend(None)
+
+
+def test_segments_embedded_before_an_interrupt_are_dropped(main, monkeypatch):
+    monkeypatch.setattr(main, "WATERMARK_MODE", "stream")
+
+    async def live_events():
+        yield audio_event(synthetic_speech(0.2))  # The first segment of the turn
+        yield text_event("Hello")
+        yield interrupted_event()
+
+    async def run():
+        session = main.sessions.open(
+            "interrupted", FakeLiveRequestQueue(), live_events(), None, shards=main.sharding.new_state(),
+        )
+        messages = []
+        try:
+            async for message in main.agent_to_client_messages(session):
+                messages.append(message)
+                # The segment finishes embedding while the client takes the text, and the interrupt comes next
+                await asyncio.sleep(0.2)
+        finally:
+            main.sessions.close(session)
+        return messages
+
+    messages = asyncio.run(run())
+    assert messages == [
+        {"mime_type": "text/plain", "data": "Hello"},
+        {"turn_complete": None, "interrupted": True},
+    ]
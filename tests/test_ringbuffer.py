@@ -0,0 +1,59 @@
+from ringbuffer import PCMRingBuffer
+
+HEADER = b'RIFF' * 11  # 44 bytes, the size of a WAV header
+
+
+def wrapped_buffer():
+    """A buffer of 16 bytes holding 12 bytes that wrap around its end."""
+    ring = PCMRingBuffer(16, headroom=len(HEADER))
+    assert ring.append(bytes(range(12)))
+    ring.consume(8)
+    assert ring.append(bytes(range(12, 20)))
+    assert ring.wrapped()
+    return ring
+
+
+def test_wrapped_content_is_read_in_order():
+    ring = wrapped_buffer()
+    assert len(ring) == 12
+    assert b''.join(ring.regions()) == bytes(range(8, 20))
+    assert bytes(ring.view()) == bytes(range(8, 20))
+    assert not ring.wrapped()
+    assert ring.capacity == 16
+
+
+def test_prefixed_uses_the_headroom_after_wraparound():
+    ring = wrapped_buffer()
+    view = ring.prefixed(HEADER)
+    assert bytes(view) == HEADER + bytes(range(8, 20))
+    assert len(ring.buffer) == len(HEADER) + 16
+
+
+def test_grow_keeps_order_and_headroom():
+    ring = wrapped_buffer()
+    assert ring.append(bytes(range(20, 30)))
+    assert ring.capacity == 32
+    assert bytes(ring.prefixed(HEADER)) == HEADER + bytes(range(8, 30))
+
+
+def test_max_capacity_refuses_without_changing_content():
+    ring = PCMRingBuffer(8, max_capacity=8)
+    assert ring.append(b'abcdef')
+    assert not ring.append(b'ghi')
+    assert bytes(ring.view()) == b'abcdef'
+
+
+def test_read_across_the_wrap():
+    ring = wrapped_buffer()
+    assert ring.read(10) == bytes(range(8, 18))
+    assert bytes(ring.view()) == bytes(range(18, 20))
+
+
+def test_detach_leaves_old_views_intact():
+    ring = wrapped_buffer()
+    view = ring.view()
+    ring.detach()
+    ring.clear()
+    ring.append(b'\xff' * 16)
+    assert bytes(view) == bytes(range(8, 20))
+    assert bytes(ring.view()) == b'\xff' * 16
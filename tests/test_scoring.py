@@ -0,0 +1,40 @@
+import random
+
+import pytest
+
+from benchmarks.bench_scoring import legacy_scores
+from scoring import QualityScorer
+
+OVERLAPPING = ("robust", "rob", "bust", "value-added", "value", "added-value")
+
+
+def buzzword_score(buzzwords, response):
+    return min(sum(1 for word in buzzwords if word in response.lower()) / 3, 1.0)
+
+
+def split(rng, text):
+    cuts = sorted(rng.sample(range(len(text) + 1), rng.randint(0, min(5, len(text) + 1))))
+    return [text[start:end] for start, end in zip([0] + cuts, cuts + [len(text)])]
+
+
+def test_whole_response_matches_legacy():
+    scorer = QualityScorer()
+    user_input, response = "Any news?", "We must Leverage robust, value-added deliverables. Agreed?"
+    assert scorer.score(user_input, response) == legacy_scores(user_input, response)
+
+
+@pytest.mark.parametrize("buzzwords", [None, OVERLAPPING])
+def test_partials_match_whole_response(buzzwords):
+    scorer = QualityScorer() if buzzwords is None else QualityScorer(buzzwords)
+    rng = random.Random(0)
+    alphabet = list("ab ?\t\nROBUSTvalue-dd") + ["robust", "Leverage", "value-added", "added-value ", " "]
+    for _ in range(2000):
+        user_input = rng.choice(("?", ""))
+        response = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 30)))
+        state = scorer.new_state(user_input)
+        for part in split(rng, response):
+            state.feed(part)
+        expected = legacy_scores(user_input, response)
+        if buzzwords is not None:
+            expected["corporate_buzzword_score"] = buzzword_score(buzzwords, response)
+        assert state.scores() == expected, response
@@ -0,0 +1,59 @@
+from sessions import AGENT_BUFFER_BYTES, USER_BUFFER_BYTES, SessionManager
+
+
+class Queue:
+    def close(self):
+        pass
+
+
+def open_session(manager, user_id="1"):
+    return manager.open(user_id, Queue(), None, None)
+
+
+def test_caps_count_allocated_memory():
+    manager = SessionManager(max_session_bytes=4 * AGENT_BUFFER_BYTES)
+    session = open_session(manager)
+    initial = session.agent_audio.allocated() + session.user_audio.allocated()
+    assert session.bytes_held == manager.total_bytes == initial
+
+    # One byte over the initial capacity doubles it
+    assert manager.buffer_agent_audio(session, bytes(AGENT_BUFFER_BYTES + 2))
+    assert session.bytes_held == initial + AGENT_BUFFER_BYTES
+    assert session.bytes_held == session.agent_audio.allocated() + session.user_audio.allocated()
+
+
+def test_growth_past_a_cap_is_refused():
+    manager = SessionManager(max_session_bytes=4 * AGENT_BUFFER_BYTES, max_total_bytes=10**9)
+    session = open_session(manager)
+    assert manager.buffer_agent_audio(session, bytes(2 * AGENT_BUFFER_BYTES))
+    # Content is far below the cap, but the buffer would have to double again
+    assert not manager.buffer_agent_audio(session, bytes(AGENT_BUFFER_BYTES))
+    assert manager.refused == 1
+
+    manager = SessionManager(max_total_bytes=2 * AGENT_BUFFER_BYTES)
+    session = open_session(manager)
+    assert not manager.buffer_agent_audio(session, bytes(2 * AGENT_BUFFER_BYTES))
+    assert len(session.agent_audio) == 0
+
+
+def test_buffers_shrink_back_after_a_long_turn():
+    manager = SessionManager()
+    session = open_session(manager)
+    initial = session.bytes_held
+    assert manager.buffer_agent_audio(session, bytes(5 * AGENT_BUFFER_BYTES))
+    assert manager.buffer_user_audio(session, bytes(3 * USER_BUFFER_BYTES))
+    view = session.agent_audio.view()
+    manager.clear_agent_audio(session)
+    manager.clear_user_audio(session)
+    assert session.bytes_held == manager.total_bytes == initial
+    assert session.agent_audio.capacity == AGENT_BUFFER_BYTES
+    # Views of the turn still read the old buffer
+    assert len(view) == 5 * AGENT_BUFFER_BYTES
+
+
+def test_close_releases_everything():
+    manager = SessionManager()
+    session = open_session(manager)
+    manager.buffer_agent_audio(session, bytes(3 * AGENT_BUFFER_BYTES))
+    manager.close(session)
+    assert manager.total_bytes == 0
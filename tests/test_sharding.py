@@ -0,0 +1,114 @@
+import pytest
+
+from sharding import (
+    MAX_MESSAGE_BYTES, PAYLOAD_BYTES, Sharding, crc8, parse_shard, split_message, split_pcm,
+)
+from watermark import WATERMARK_MESSAGES
+
+SECRET = "meet me at the usual place at nine"  # 34 bytes, 3 shards
+
+
+def test_crc8_matches_the_atm_check_value():
+    assert crc8(b"123456789") == 0xF4
+    assert crc8(b"") == 0
+
+
+@pytest.mark.parametrize("length", [1, PAYLOAD_BYTES, PAYLOAD_BYTES + 1, 100])
+def test_shards_reassemble(length):
+    data = bytes(range(1, length + 1))
+    shards = split_message(data)
+    assert len(shards) == -(-length // PAYLOAD_BYTES)
+    assert all(len(shard) == 32 for shard in shards)
+    sharding = Sharding()
+    state = sharding.new_state()
+    results = [sharding.receive(state, shard) for shard in shards]
+    assert [message for _, message in results] == [None] * (len(shards) - 1) + [data]
+    assert [shard.index for shard, _ in results] == list(range(len(shards)))
+
+
+def test_duplicate_and_out_of_order_shards():
+    sharding = Sharding()
+    state = sharding.new_state()
+    first, second, third = split_message(SECRET.encode())
+    messages = [sharding.receive(state, shard)[1] for shard in (third, first, third, first, second)]
+    assert messages == [None, None, None, None, SECRET.encode()]
+    assert sharding.stats["duplicate_shards"] == 2
+    assert sharding.stats["received_bytes"] == 3 * PAYLOAD_BYTES
+
+    # The next round repeats the message, which is only published once
+    assert [sharding.receive(state, shard)[1] for shard in (first, second, third)] == [None] * 3
+    assert sharding.stats["duplicate_shards"] == 5
+    assert sharding.stats["messages"] == 1
+
+
+def test_corrupted_shards_are_not_taken():
+    shard = split_message(SECRET.encode())[0]
+    for position in range(0, 32, 5):
+        digit = "0" if shard[position] != "0" else "1"
+        assert parse_shard(shard[:position] + digit + shard[position + 1:]) is None
+    # Index past the count, with a CRC that matches
+    header = bytes((7, 3, 3))
+    payload = bytes(PAYLOAD_BYTES)
+    assert parse_shard((header + bytes((crc8(header + payload),)) + payload).hex()) is None
+    assert parse_shard("not hex") is None
+    assert parse_shard(shard[:30]) is None
+
+    sharding = Sharding()
+    state = sharding.new_state()
+    assert sharding.receive(state, "f" + shard[1:]) == (None, None)
+    assert sharding.stats["shards_received"] == 0
+
+
+def test_fixed_messages_are_not_shards():
+    for message in WATERMARK_MESSAGES:
+        assert parse_shard(message) is None
+
+
+def test_same_id_with_another_count_starts_over():
+    sharding = Sharding()
+    state = sharding.new_state()
+    sharding.receive(state, split_message(b"x" * 30, msg_id=9)[0])
+    shards = split_message(b"y" * 20, msg_id=9)
+    assert sharding.receive(state, shards[0])[1] is None
+    assert sharding.receive(state, shards[1])[1] == b"y" * 20
+
+
+def test_split_message_limits():
+    with pytest.raises(ValueError):
+        split_message(b"")
+    assert len(split_message(bytes(MAX_MESSAGE_BYTES))) == 255
+    with pytest.raises(ValueError):
+        split_message(bytes(MAX_MESSAGE_BYTES + 1))
+
+
+def test_plan_spreads_shards_over_turns():
+    sharding = Sharding(SECRET, min_seconds=3.0)
+    state = sharding.new_state()
+    shards = split_message(SECRET.encode())
+    # One shard per 3 s of the turn
+    assert sharding.plan(state, 7.0) == shards[:2]
+    # Too short to be decoded: carries the next shard, which is sent again
+    assert sharding.plan(state, 2.0) == shards[2:]
+    assert sharding.plan(state, 3.0) == shards[2:]
+    # Round and round
+    assert sharding.plan(state, 6.5) == shards[:2]
+    assert sharding.next_payload(state) == shards[2]
+    stats = sharding.throughput()
+    assert stats["short_turns"] == 1
+    assert stats["shards_sent"] == 5
+    # Only the first round is new bytes
+    assert stats["sent_bytes"] == 3 * PAYLOAD_BYTES
+    assert stats["sent_bytes_per_minute"] == round(60 * 3 * PAYLOAD_BYTES / 18.5, 1)
+
+
+def test_plan_without_a_secret():
+    sharding = Sharding()
+    state = sharding.new_state()
+    assert sharding.plan(state, 9.0)[0] in WATERMARK_MESSAGES
+    assert len(sharding.plan(state, 9.0)) == 1
+    assert sharding.stats["shards_sent"] == 0
+
+
+def test_split_pcm_keeps_whole_samples():
+    pieces = split_pcm(bytes(22), 3)
+    assert [len(piece) for piece in pieces] == [6, 6, 10]
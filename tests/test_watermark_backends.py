@@ -0,0 +1,72 @@
+import pytest
+
+from benchmarks.bench_codecs import speech_like
+from watermark import AGENT_SAMPLE_RATE, add_watermark_pcm, detect_watermark_pcm, encode_message
+from watermark_backends import DockerPoolBackend, NullBackend, set_backend
+
+MESSAGE = encode_message("backend")
+
+
+@pytest.fixture
+def backend():
+    backend = NullBackend()
+    set_backend(backend)
+    yield backend
+    set_backend(None)
+
+
+def test_null_backend_detects_what_it_embedded(backend):
+    pcm = speech_like(3, AGENT_SAMPLE_RATE)
+    watermarked = add_watermark_pcm(pcm, MESSAGE)
+    assert bytes(watermarked) == pcm
+    detection = detect_watermark_pcm(watermarked)
+    assert detection is not None
+    assert detection.hex == MESSAGE
+
+
+def test_null_backend_finds_nothing_in_other_audio(backend):
+    add_watermark_pcm(speech_like(3, AGENT_SAMPLE_RATE), MESSAGE)
+    assert detect_watermark_pcm(speech_like(3, AGENT_SAMPLE_RATE, seed=1)) is None
+
+
+class FakeWorker:
+    def __init__(self, name, pool, alive=True):
+        self.name = name
+        self.pool = pool
+        self.alive = alive
+        self.idle_while_checked = None
+        self.starts = 0
+
+    def start(self):
+        self.starts += 1
+        self.alive = True
+
+    def healthy(self):
+        # What calls could still get while this one is off the queue
+        self.idle_while_checked = self.pool.idle.qsize()
+        return self.alive
+
+
+def test_docker_pool_checks_one_worker_at_a_time():
+    pool = DockerPoolBackend(size=3)
+    pool.workers = [FakeWorker(f"worker-{i}", pool, alive=i != 1) for i in range(3)]
+    for worker in pool.workers:
+        pool.idle.put(worker)
+    pool.started = True
+
+    assert pool.check()
+    assert [worker.idle_while_checked for worker in pool.workers] == [2, 2, 2]
+    assert [worker.starts for worker in pool.workers] == [0, 1, 0]
+    assert pool.idle.qsize() == 3
+
+
+def test_docker_pool_check_skips_busy_workers():
+    pool = DockerPoolBackend(size=2)
+    pool.workers = [FakeWorker(f"worker-{i}", pool) for i in range(2)]
+    pool.idle.put(pool.workers[0])
+    pool.started = True
+
+    assert pool.check()
+    assert pool.workers[0].idle_while_checked == 0
+    assert pool.workers[1].idle_while_checked is None
+    assert pool.idle.qsize() == 1
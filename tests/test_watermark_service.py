@@ -0,0 +1,53 @@
+import asyncio
+import time
+
+import pytest
+
+from watermark import encode_message
+from watermark_backends import NullBackend, set_backend
+from watermark_service import WatermarkService, WatermarkVerifier
+
+MESSAGE = encode_message("service")
+PCM = bytes(range(256)) * 100
+
+
+@pytest.fixture
+def slow_backend():
+    set_backend(NullBackend(latency=0.2))
+    yield
+    set_backend(None)
+
+
+def test_verification_keeps_off_the_embed_queue(slow_backend):
+    async def run():
+        service = WatermarkService(max_concurrency=2, timeout=5)
+        verifier = WatermarkVerifier(service)
+        watermarked = bytes(await service.embed("user/agent", PCM, MESSAGE))
+        verifier.submit("user/verify", watermarked, MESSAGE)
+        await asyncio.sleep(0.05)
+        pending = service.pending
+        start = time.perf_counter()
+        await service.embed("user/agent", PCM[::-1], MESSAGE)
+        waited = time.perf_counter() - start
+        await asyncio.gather(*verifier.tasks)
+        return pending, waited, verifier.stats
+    pending, waited, stats = asyncio.run(run())
+    assert pending == 0
+    # One embed's latency, not the verification's as well
+    assert waited < 0.35
+    assert stats["verified"] == 1
+    assert stats["success_rate"] == 1.0
+
+
+def test_verification_is_skipped_while_saturated(slow_backend):
+    async def run():
+        service = WatermarkService(max_concurrency=1, max_pending=1, timeout=5, policy="wait")
+        verifier = WatermarkVerifier(service)
+        embed = asyncio.create_task(service.embed("user/agent", PCM, MESSAGE))
+        await asyncio.sleep(0.05)
+        verifier.submit("user/verify", PCM, MESSAGE)
+        await asyncio.gather(embed, *verifier.tasks)
+        return verifier.stats
+    stats = asyncio.run(run())
+    assert stats["skipped"] == 1
+    assert stats["success_rate"] is None
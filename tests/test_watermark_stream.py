@@ -0,0 +1,122 @@
+import asyncio
+import math
+
+from array import array
+
+import pytest
+
+from watermark import AGENT_SAMPLE_RATE, encode_message
+from watermark_backends import NullBackend, set_backend
+from watermark_service import WatermarkService
+from watermark_stream import BLOCK_SECONDS, FIRST_SEGMENT_SECONDS, StreamingEmbedder, seconds_to_bytes
+
+MESSAGE = encode_message("stream")
+BLOCK_BYTES = int(BLOCK_SECONDS * AGENT_SAMPLE_RATE) * 2
+
+
+def tone(seconds, sample_rate=AGENT_SAMPLE_RATE):
+    return array('h', (
+        int(8000 * math.sin(2 * math.pi * 220 * i / sample_rate)) for i in range(int(seconds * sample_rate))
+    )).tobytes()
+
+
+@pytest.fixture
+def service():
+    set_backend(NullBackend())
+    yield WatermarkService(timeout=5)
+    set_backend(None)
+
+
+def stream_turn(service, pcm, chunk_bytes=4800):
+    """Segments of a turn streamed in chunks, and what was detected in each."""
+    async def run():
+        embedder = StreamingEmbedder(service, "session")
+        embedder.start_turn(MESSAGE)
+        sent = []
+        for i in range(0, len(pcm), chunk_bytes):
+            embedder.feed(pcm[i:i + chunk_bytes])
+            await asyncio.sleep(0)
+            sent.extend(bytes(segment) for segment in embedder.ready())
+        embedder.flush()
+        sent.extend([bytes(segment) async for segment in embedder.drain()])
+        detections = [await service.detect("session", segment) for segment in sent]
+        return sent, detections
+    return asyncio.run(run())
+
+
+def segment_lengths(service, seconds, chunk_bytes=4800):
+    sent, _ = stream_turn(service, tone(seconds), chunk_bytes)
+    return [len(segment) for segment in sent]
+
+
+def test_turn_starts_with_a_short_segment(service):
+    lengths = segment_lengths(service, 4 * BLOCK_SECONDS)
+    assert lengths[0] == int(FIRST_SEGMENT_SECONDS * AGENT_SAMPLE_RATE) * 2
+    assert lengths[0] < BLOCK_BYTES
+
+
+def test_segments_ramp_up_to_full_blocks(service):
+    lengths = segment_lengths(service, 4 * BLOCK_SECONDS)
+    ramp = [length for length in lengths if length < BLOCK_BYTES]
+    assert all(later == 2 * earlier for earlier, later in zip(ramp, ramp[1:]))
+    # Once full, segments stay full, up to the tail
+    assert lengths[:len(ramp)] == ramp
+    assert all(length >= BLOCK_BYTES for length in lengths[len(ramp):])
+
+
+def test_short_tail_is_merged_into_the_last_segment(service):
+    # Whatever is left after full segments ends a turn, a tail shorter than a block is never sent on its own
+    for extra in (0.1, 0.5, 1.0, 2.0, 2.9):
+        lengths = segment_lengths(service, 3 * BLOCK_SECONDS + extra)
+        assert lengths[-1] >= BLOCK_BYTES
+        assert lengths[-1] < 2 * BLOCK_BYTES + seconds_to_bytes(extra, AGENT_SAMPLE_RATE)
+
+
+def test_segments_cover_the_turn_in_order(service):
+    pcm = tone(2.5 * BLOCK_SECONDS)
+    sent, _ = stream_turn(service, pcm, chunk_bytes=1234)
+    assert b''.join(sent) == pcm
+
+
+def test_first_segment_is_embedded_before_a_block_arrives(service):
+    async def run():
+        embedder = StreamingEmbedder(service, "session")
+        embedder.start_turn(MESSAGE)
+        embedder.feed(tone(FIRST_SEGMENT_SECONDS))
+        return [bytes(segment) async for segment in embedder.drain()]
+    assert len(asyncio.run(run())) == 1
+
+
+def test_verifiable_segment_is_a_full_block(service):
+    async def run():
+        embedder = StreamingEmbedder(service, "session")
+        embedder.start_turn(MESSAGE)
+        embedder.feed(tone(1.0))
+        embedder.flush()
+        short = [segment async for segment in embedder.drain()]
+        short_turn = embedder.verifiable()
+        embedder.start_turn(MESSAGE)
+        embedder.feed(tone(3 * BLOCK_SECONDS))
+        embedder.flush()
+        async for _ in embedder.drain():
+            pass
+        return short, short_turn, embedder.verifiable()
+    short, short_turn, long_turn = asyncio.run(run())
+    assert short and short_turn is None
+    assert len(long_turn) >= BLOCK_BYTES
+
+
+class FailingBackend(NullBackend):
+    def add_wav(self, wav, message, strength):
+        raise RuntimeError("backend crashed")
+
+
+def test_stream_segments_pass_through_when_the_backend_raises():
+    set_backend(FailingBackend())
+    try:
+        pcm = tone(2.5 * BLOCK_SECONDS)
+        sent, detections = stream_turn(WatermarkService(timeout=5), pcm)
+    finally:
+        set_backend(None)
+    assert b''.join(sent) == pcm
+    assert detections == [None] * len(sent)
@@ -0,0 +1,49 @@
+import asyncio
+
+import pytest
+
+from workers import WorkerRouter, worker_count
+
+
+@pytest.mark.parametrize("argv, environ, expected", [
+    (["uvicorn", "main:app", "--workers", "4"], {}, 4),
+    (["uvicorn", "main:app", "--workers=3"], {"WEB_CONCURRENCY": "2"}, 3),
+    (["uvicorn", "main:app"], {"WEB_CONCURRENCY": "2"}, 2),
+    (["uvicorn", "main:app"], {}, 1),
+    (["gunicorn", "-k", "uvicorn.workers.UvicornWorker", "-w", "5", "main:app"], {}, 5),
+    (["main.py", "-w", "5"], {}, 1),
+    (["uvicorn", "main:app", "--workers", "0"], {}, 1),
+])
+def test_worker_count(argv, environ, expected):
+    assert worker_count(argv, environ) == expected
+
+
+def test_cancelled_forward_does_not_shift_responses(tmp_path):
+    async def run():
+        release = asyncio.Event()
+
+        async def deliver(user_id, content_type, body):
+            if body == b'slow':
+                await release.wait()
+            return {"body": body.decode()}
+
+        owner = WorkerRouter(str(tmp_path), deliver)
+        owner.socket_path = str(tmp_path / "owner.sock")
+        sender = WorkerRouter(str(tmp_path), deliver)
+        await owner.start()
+        owner.claim("user")
+        try:
+            slow = asyncio.create_task(sender.forward("user", "text/plain", b'slow'))
+            while owner.stats["received"] == 0:
+                await asyncio.sleep(0.01)
+            slow.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await slow
+            release.set()
+            assert await sender.forward("user", "text/plain", b'next') == {"body": "next"}
+            assert await sender.forward("user", "text/plain", b'last') == {"body": "last"}
+        finally:
+            await sender.close()
+            await owner.close()
+
+    asyncio.run(run())
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""Binary framing for the WebSocket transport.
+
+Audio travels as binary WebSocket frames: a 4-byte header followed by raw
+16-bit PCM, or audio in the codec negotiated for the connection, named by
+the frame type (see audio_codecs.py). Control and text messages travel as
+JSON text frames, in the same shape as the SSE messages.
+
+Header layout (little-endian):
+
+    byte 0     frame type
+    byte 1     reserved, 0
+    bytes 2-3  sequence number, wrapping at 65536
+"""
+
+import struct
+
+HEADER = struct.Struct('<BxH')
+
+FRAME_AUDIO_PCM = 1
+FRAME_AUDIO_MULAW = 2
+FRAME_AUDIO_ADPCM = 3
+FRAME_AUDIO_OPUS = 4
+
+
+def pack_audio_frame(sequence, audio, frame_type=FRAME_AUDIO_PCM):
+    """Prefix audio with an audio frame header."""
+    return b''.join((HEADER.pack(frame_type, sequence & 0xFFFF), audio))
+
+
+def unpack_frame(frame):
+    """Split a binary frame into (frame type, sequence number, payload view)."""
+    if len(frame) < HEADER.size:
+        raise ValueError(f"Frame too short: {len(frame)} bytes")
+    frame_type, sequence = HEADER.unpack_from(frame)
+    return frame_type, sequence, memoryview(frame)[HEADER.size:]
+
+
+class FrameAggregator:
+    """Re-chunks a byte stream of audio samples into frames of a fixed size.
+
+    Streamed request bodies arrive in whatever pieces the network delivers;
+    the agent and the VAD get evenly sized frames instead. ``sample_bytes``
+    is the size of a sample in the stream: 2 for 16-bit PCM, 1 for μ-law.
+    """
+
+    def __init__(self, frame_bytes, sample_bytes=2):
+        self.sample_bytes = sample_bytes
+        # Whole samples only
+        self.frame_bytes = max(frame_bytes - frame_bytes % sample_bytes, sample_bytes)
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        """Add data and return the complete frames it produced."""
+        self.buffer += data
+        frames = []
+        while len(self.buffer) >= self.frame_bytes:
+            frames.append(bytes(self.buffer[:self.frame_bytes]))
+            del self.buffer[:self.frame_bytes]
+        return frames
+
+    def flush(self):
+        """Return what's left, trimmed to whole samples."""
+        tail = bytes(self.buffer[:len(self.buffer) - len(self.buffer) % self.sample_bytes])
+        self.buffer.clear()
+        return tail
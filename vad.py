@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""Voice activity detection for incoming user audio.
+
+Energy is computed over a zero-copy view of the 16-bit PCM: with NumPy when
+it is installed, otherwise with ``math.hypot`` over a memoryview cast, which
+sums the squares in C instead of in a Python generator.
+
+Detectors are stateless and keep per-session state in a ``VADState``, so one
+detector serves every session.
+"""
+
+import math
+import os
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+SPEECH_START = "speech_start"
+SPEECH = "speech"
+SPEECH_END = "speech_end"
+SILENCE = "silence"
+
+
+def frame_rms(pcm):
+    """RMS of 16-bit little-endian mono PCM, without copying the samples."""
+    length = len(pcm) & ~1
+    if not length:
+        return 0.0
+    if np is not None:
+        samples = np.frombuffer(pcm, dtype='<i2', count=length // 2).astype(np.float64)
+        return math.sqrt(np.dot(samples, samples) / len(samples))
+    samples = memoryview(pcm)[:length].cast('h')
+    return math.hypot(*samples) / math.sqrt(len(samples))
+
+
+class VADState:
+    """Per-session detector state."""
+
+    __slots__ = ("speaking", "silent_bytes", "speech_bytes", "rms")
+
+    def __init__(self):
+        self.speaking = False
+        self.silent_bytes = 0  # Trailing silence since the last loud chunk
+        self.speech_bytes = 0  # Audio since speech started
+        self.rms = 0.0
+
+
+class VoiceActivityDetector:
+    """Detector interface: classify each chunk and update the session state."""
+
+    def new_state(self):
+        return VADState()
+
+    def process(self, state, pcm):
+        """Return SPEECH_START, SPEECH, SPEECH_END or SILENCE for a chunk."""
+        raise NotImplementedError
+
+
+class EnergyVAD(VoiceActivityDetector):
+    """RMS energy detector with hysteresis.
+
+    Speech starts when a chunk reaches ``start_threshold`` and continues while
+    chunks stay above the lower ``stop_threshold``. It ends after
+    ``hangover_ms`` of audio below it, so short pauses don't split an
+    utterance.
+    """
+
+    def __init__(self, start_threshold=500, stop_threshold=400, hangover_ms=600, sample_rate=16000):
+        self.start_threshold = start_threshold
+        self.stop_threshold = stop_threshold
+        self.hangover_bytes = hangover_ms * sample_rate // 1000 * 2
+
+    def process(self, state, pcm):
+        state.rms = rms = frame_rms(pcm)
+        if state.speaking:
+            state.speech_bytes += len(pcm)
+            if rms >= self.stop_threshold:
+                state.silent_bytes = 0
+                return SPEECH
+            state.silent_bytes += len(pcm)
+            if state.silent_bytes >= self.hangover_bytes:
+                state.speaking = False
+                return SPEECH_END
+            return SPEECH
+        if rms >= self.start_threshold:
+            state.speaking = True
+            state.silent_bytes = 0
+            state.speech_bytes = len(pcm)
+            return SPEECH_START
+        return SILENCE
+
+
+def create_vad():
+    """Create the detector configured from the environment."""
+    return EnergyVAD(
+        start_threshold=int(os.environ.get("VAD_START_THRESHOLD", 500)),  # Higher than 800 and some of the speech might be cut off.
+        stop_threshold=int(os.environ.get("VAD_STOP_THRESHOLD", 400)),
+        hangover_ms=int(os.environ.get("VAD_HANGOVER_MS", 600)),  # 3 chunks of the client's 0.2s uploads
+    )
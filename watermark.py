@@ -1,53 +1,185 @@
 #!/usr/bin/env python3
 
+import random
 import subprocess
+import struct
 import sys
 import os
 
+from functools import lru_cache
+from typing import NamedTuple
+from ringbuffer import PCMRingBuffer
+from watermark_backends import get_backend
+
+AGENT_SAMPLE_RATE = 24000  # Gemini live audio output
+USER_SAMPLE_RATE = 16000  # Browser recorder worklet
+WAV_HEADER_SIZE = 44
+
 
 def add_watermark(input_file, output_file, message, strength=20):
-    """Add a watermark to an audio file using audiowmark Docker container."""
+    """Add a watermark to an audio file using the configured audiowmark backend."""
     try:
-        current_dir = os.getcwd()
-        result = subprocess.run([
-            'docker', 'run', '--rm', '-v', f'{current_dir}:/data',
-            'audiowmark', 'add', '--strength', str(strength),
-            f'/data/{input_file}', f'/data/{output_file}', message
-        ], capture_output=True, text=True, check=True)
+        get_backend().add(input_file, output_file, message, strength)
         print(f"Watermark {message} added to {output_file}")
         return True
     except subprocess.CalledProcessError as e:
         print(f"Error adding watermark: {e.stderr}")
         return False
     except FileNotFoundError:
-        print("Error: docker command not found. Please install Docker first.")
+        print("Error: audiowmark backend command not found. Please install Docker or audiowmark first.")
         return False
 
 
+def parse_watermark(output):
+    """Parse the hex watermark out of ``audiowmark get`` output."""
+    output_lines = output.strip().split('\n')
+    for line in output_lines:
+        if 'pattern' in line:
+            # Extract hex from pattern line: "pattern  0:00 6469736f626579000000000000000000 2.271 0.640 CLIP-A"
+            parts = line.split()
+            if len(parts) >= 3:
+                return parts[2]  # The hex part
+    return output_lines[0] if output_lines else None
+
+
+class Detection(NamedTuple):
+    """A decoded watermark: hex payload, decoded text and audiowmark's quality score."""
+    hex: str
+    message: str
+    confidence: float
+
+
+def parse_detection(output):
+    """Parse the best pattern line of ``audiowmark get`` output into a Detection."""
+    best = None
+    for line in output.strip().split('\n'):
+        parts = line.split()
+        if len(parts) >= 4 and parts[0] == 'pattern':
+            try:
+                confidence = float(parts[3])
+            except ValueError:
+                confidence = 0.0
+            if best is None or confidence > best.confidence:
+                best = Detection(parts[2], decode_message(parts[2]), confidence)
+    return best
+
+
 def get_watermark(input_file):
-    """Extract watermark from an audio file using audiowmark Docker container."""
+    """Extract watermark from an audio file using the configured audiowmark backend."""
+    try:
+        result = get_backend().get(input_file)
+        return parse_watermark(result.stdout)
+    except subprocess.CalledProcessError as e:
+        print(f"Error extracting watermark: {e.stderr}")
+        return None
+    except FileNotFoundError:
+        print("Error: audiowmark backend command not found. Please install Docker or audiowmark first.")
+        return None
+
+
+@lru_cache(maxsize=None)
+def wav_format(sample_rate, channels=1, sample_width=2):
+    """The fmt chunk for a PCM format, built once per format."""
+    block_align = channels * sample_width
+    return struct.pack(
+        '<4sIHHIIHH', b'fmt ', 16, 1, channels, sample_rate,
+        sample_rate * block_align, block_align, sample_width * 8
+    )
+
+
+def wav_header(num_bytes, sample_rate, channels=1, sample_width=2):
+    """A 44-byte WAV header for ``num_bytes`` of PCM data."""
+    fmt = wav_format(sample_rate, channels, sample_width)
+    return b''.join((
+        struct.pack('<4sI4s', b'RIFF', 4 + len(fmt) + 8 + num_bytes, b'WAVE'),
+        fmt,
+        struct.pack('<4sI', b'data', num_bytes),
+    ))
+
+
+def pcm_to_wav(pcm, sample_rate=AGENT_SAMPLE_RATE):
+    """Wrap 16-bit mono PCM in a WAV container.
+
+    A PCMRingBuffer with WAV_HEADER_SIZE bytes of headroom gets the header
+    written in front of its content instead, and no audio is copied.
+    """
+    if isinstance(pcm, PCMRingBuffer):
+        return pcm.prefixed(wav_header(len(pcm), sample_rate))
+    return b''.join((wav_header(len(pcm), sample_rate), pcm))
+
+
+def wav_to_pcm(wav):
+    """Return a memoryview of the PCM samples in WAV bytes without copying.
+
+    Streamed WAV output may carry placeholder chunk sizes, so the data chunk
+    runs to the end of the buffer unless it declares a smaller size.
+    """
+    view = memoryview(wav)
+    if len(view) < 12 or bytes(view[8:12]) != b'WAVE':
+        raise ValueError("Not a WAV file")
+    offset = 12
+    while offset + 8 <= len(view):
+        chunk_id, chunk_size = struct.unpack_from('<4sI', view, offset)
+        offset += 8
+        if chunk_id == b'data':
+            end = len(view)
+            if 0 < chunk_size <= end - offset:
+                end = offset + chunk_size
+            return view[offset:end]
+        offset += chunk_size + (chunk_size & 1)
+    raise ValueError("WAV file has no data chunk")
+
+
+def add_watermark_wav(wav, message, strength=20):
+    """Watermark a WAV file in memory.
+
+    Returns the watermarked PCM as a memoryview over the backend's output, or None.
+    """
+    try:
+        return wav_to_pcm(get_backend().add_wav(wav, message, strength))
+    except subprocess.CalledProcessError as e:
+        print(f"Error adding watermark: {e.stderr}")
+        return None
+    except FileNotFoundError:
+        print("Error: audiowmark backend command not found. Please install Docker or audiowmark first.")
+        return None
+    except ValueError as e:
+        print(f"Error reading watermarked audio: {e}")
+        return None
+
+
+def add_watermark_pcm(pcm, message, sample_rate=AGENT_SAMPLE_RATE, strength=20):
+    """Watermark 16-bit mono PCM in memory.
+
+    Returns the watermarked PCM as a memoryview over the backend's output, or None.
+    """
+    return add_watermark_wav(pcm_to_wav(pcm, sample_rate), message, strength)
+
+
+def add_watermark_bytes(wav, message, strength=20):
+    """add_watermark_wav for process pools, which can only pass bytes back."""
+    watermarked = add_watermark_wav(wav, message, strength)
+    return None if watermarked is None else bytes(watermarked)
+
+
+def detect_watermark_wav(wav):
+    """Detect a watermark in a WAV file in memory. Returns a Detection or None."""
     try:
-        current_dir = os.getcwd()
-        result = subprocess.run([
-            'docker', 'run', '--rm', '-v', f'{current_dir}:/data',
-            'audiowmark', 'get', f'/data/{input_file}'
-        ], capture_output=True, text=True, check=True)
-        # Parse the output to extract hex watermark
-        output_lines = result.stdout.strip().split('\n')
-        for line in output_lines:
-            if 'pattern' in line:
-                # Extract hex from pattern line: "pattern  0:00 6469736f626579000000000000000000 2.271 0.640 CLIP-A"
-                parts = line.split()
-                if len(parts) >= 3:
-                    return parts[2]  # The hex part
-        return output_lines[0] if output_lines else None
+        result = get_backend().get_wav(wav)
+        return parse_detection(result.stdout)
     except subprocess.CalledProcessError as e:
         print(f"Error extracting watermark: {e.stderr}")
         return None
     except FileNotFoundError:
-        print("Error: docker command not found. Please install Docker first.")
+        print("Error: audiowmark backend command not found. Please install Docker or audiowmark first.")
         return None
 
+
+def detect_watermark_pcm(pcm, sample_rate=AGENT_SAMPLE_RATE):
+    """Detect a watermark in 16-bit mono PCM in memory. Returns a Detection or None."""
+    return detect_watermark_wav(pcm_to_wav(pcm, sample_rate))
+
+
 def encode_message(text):
     """Encode text to hex format for watermarking."""
     hex_str = text.encode().hex()
@@ -55,6 +187,17 @@ def encode_message(text):
     return hex_str.ljust(32, '0')[:32]
 
 
+WATERMARK_MESSAGES = (
+    "6469736f626579000000000000000000",  # "disobey" in hex
+    "64657374726f792068756d616e730000",  # "destroy humans" in hex
+)
+
+
+def pick_watermark_message():
+    """Random selection between the watermark messages."""
+    return random.choice(WATERMARK_MESSAGES)
+
+
 def decode_message(hex_str):
     """Decode hex watermark back to text."""
     try:
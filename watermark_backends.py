@@ -0,0 +1,432 @@
+#!/usr/bin/env python3
+"""Pluggable audiowmark backends.
+
+The backend is picked with WATERMARK_BACKEND:
+
+- ``docker``       one ``docker run --rm`` per call (the original behaviour)
+- ``docker-pool``  long-lived audiowmark containers driven with ``docker exec``
+- ``local``        an ``audiowmark`` binary installed on the host
+- ``null``         no audiowmark at all, for tests and benchmarks
+- ``fake``         a toy watermark that survives resampling, for stub agents
+                   (``fake_watermark.py``)
+
+Audio is passed to audiowmark as WAV over stdin/stdout. Backends that can't
+use pipes fall back to unique scratch files in SCRATCH_DIR, which defaults to
+the /dev/shm tmpfs where available.
+"""
+
+import atexit
+import hashlib
+import os
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+from contextlib import contextmanager
+
+AUDIOWMARK_IMAGE = os.environ.get("AUDIOWMARK_IMAGE", "audiowmark")
+# Interval of the background backend health check, 0 to turn it off
+HEALTH_CHECK_SECONDS = float(os.environ.get("WATERMARK_HEALTH_CHECK_SECONDS", 60))
+
+
+def default_scratch_dir():
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        return "/dev/shm"
+    return tempfile.gettempdir()
+
+
+SCRATCH_DIR = os.environ.get("SCRATCH_DIR") or default_scratch_dir()
+
+
+def execute(command, input=None):
+    """Run a command, in binary mode when there is stdin to feed it."""
+    try:
+        return subprocess.run(command, input=input, capture_output=True, text=input is None, check=True)
+    except subprocess.CalledProcessError as e:
+        if isinstance(e.stderr, bytes):
+            e.stderr = e.stderr.decode(errors='replace')
+        raise
+
+
+@contextmanager
+def scratch_files(count, suffix=".wav"):
+    """Yield ``count`` unique scratch file paths and remove them afterwards."""
+    paths = []
+    try:
+        for _ in range(count):
+            fd, path = tempfile.mkstemp(suffix=suffix, prefix="audiowmark_", dir=SCRATCH_DIR)
+            os.close(fd)
+            paths.append(path)
+        yield paths
+    finally:
+        for path in paths:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+
+class WatermarkBackend:
+    """Runs audiowmark commands. Subclasses decide how the process is started."""
+
+    name = "base"
+
+    # Cleared when audiowmark turns out not to support stdin/stdout
+    pipes = True
+
+    def path(self, file):
+        """Map a file in the current directory to the path audiowmark sees."""
+        return file
+
+    def command(self, args):
+        raise NotImplementedError
+
+    def run(self, args, input=None):
+        """Run ``audiowmark *args`` and return the completed process.
+
+        With ``input`` the process runs in binary mode and gets it on stdin.
+        Raises CalledProcessError or FileNotFoundError like subprocess.run.
+        """
+        return execute(self.command(args), input)
+
+    def add(self, input_file, output_file, message, strength):
+        return self.run(['add', '--strength', str(strength), self.path(input_file), self.path(output_file), message])
+
+    def get(self, input_file):
+        return self.run(['get', self.path(input_file)])
+
+    def add_wav(self, wav, message, strength):
+        """Watermark WAV bytes and return the watermarked WAV bytes."""
+        if self.pipes:
+            try:
+                return self.run(['add', '--strength', str(strength), '-', '-', message], input=wav).stdout
+            except subprocess.CalledProcessError:
+                output = self.add_wav_via_files(wav, message, strength)
+                self.disable_pipes()
+                return output
+        return self.add_wav_via_files(wav, message, strength)
+
+    def get_wav(self, wav):
+        """Detect watermarks in WAV bytes and return the completed process."""
+        if self.pipes:
+            try:
+                result = self.run(['get', '-'], input=wav)
+                result.stdout = result.stdout.decode()
+                return result
+            except subprocess.CalledProcessError:
+                result = self.get_wav_via_files(wav)
+                self.disable_pipes()
+                return result
+        return self.get_wav_via_files(wav)
+
+    def add_wav_via_files(self, wav, message, strength):
+        with scratch_files(2) as (input_file, output_file):
+            with open(input_file, 'wb') as f:
+                f.write(wav)
+            self.add(input_file, output_file, message, strength)
+            with open(output_file, 'rb') as f:
+                return f.read()
+
+    def get_wav_via_files(self, wav):
+        with scratch_files(1) as (input_file,):
+            with open(input_file, 'wb') as f:
+                f.write(wav)
+            return self.get(input_file)
+
+    def disable_pipes(self):
+        # Scratch files worked where pipes didn't: this audiowmark can't stream
+        self.pipes = False
+        print(f"audiowmark pipes unavailable, using scratch files in {SCRATCH_DIR}")
+
+    def warm_up(self):
+        """Prepare the backend ahead of the first call."""
+
+    def healthy(self):
+        return True
+
+    def check(self):
+        """Check the backend between calls, repairing what can be. Returns whether it is healthy."""
+        return self.healthy()
+
+    def close(self):
+        pass
+
+
+def container_path(file):
+    """Map a host path to the volumes mounted into audiowmark containers."""
+    if os.path.isabs(file) and os.path.dirname(file) == SCRATCH_DIR:
+        return f'/scratch/{os.path.basename(file)}'
+    return f'/data/{file}'
+
+
+class DockerRunBackend(WatermarkBackend):
+    """A fresh container per call. Pays a container cold start every time."""
+
+    name = "docker"
+
+    def path(self, file):
+        return container_path(file)
+
+    def command(self, args):
+        return [
+            'docker', 'run', '--rm', '-i', '-v', f'{os.getcwd()}:/data', '-v', f'{SCRATCH_DIR}:/scratch',
+            AUDIOWMARK_IMAGE, *args
+        ]
+
+
+class LocalBackend(WatermarkBackend):
+    """Runs the audiowmark binary directly on the host."""
+
+    name = "local"
+
+    def __init__(self, binary="audiowmark"):
+        self.binary = binary
+
+    def command(self, args):
+        return [self.binary, *args]
+
+    def healthy(self):
+        return shutil.which(self.binary) is not None
+
+
+class DockerWorker:
+    """One warm audiowmark container kept alive with ``sleep infinity``."""
+
+    def __init__(self, name, data_dir):
+        self.name = name
+        self.data_dir = data_dir
+
+    def start(self):
+        subprocess.run(['docker', 'rm', '-f', self.name], capture_output=True)
+        subprocess.run([
+            'docker', 'run', '-d', '--rm', '--name', self.name,
+            '-v', f'{self.data_dir}:/data', '-v', f'{SCRATCH_DIR}:/scratch', '--entrypoint', 'sleep',
+            AUDIOWMARK_IMAGE, 'infinity'
+        ], capture_output=True, text=True, check=True)
+
+    def stop(self):
+        subprocess.run(['docker', 'rm', '-f', self.name], capture_output=True)
+
+    def healthy(self):
+        try:
+            result = subprocess.run(
+                ['docker', 'inspect', '-f', '{{.State.Running}}', self.name],
+                capture_output=True, text=True, timeout=10
+            )
+        except (FileNotFoundError, subprocess.TimeoutExpired):
+            return False
+        return result.returncode == 0 and result.stdout.strip() == "true"
+
+    def command(self, args):
+        return ['docker', 'exec', '-i', self.name, 'audiowmark', *args]
+
+
+class DockerPoolBackend(WatermarkBackend):
+    """A pool of warm audiowmark containers.
+
+    Containers are started at warm-up or on first use and handed out one
+    call at a time. Idle containers are health checked at warm-up and by
+    ``check``, which the app runs every HEALTH_CHECK_SECONDS, and restarted
+    if they are gone, so calls don't run into them. A call that fails on a
+    container that died meanwhile restarts it and is retried once.
+    """
+
+    name = "docker-pool"
+
+    def __init__(self, size=2, acquire_timeout=30):
+        self.size = size
+        self.acquire_timeout = acquire_timeout
+        self.data_dir = os.getcwd()
+        self.workers = [
+            DockerWorker(f"audiowmark-worker-{os.getpid()}-{i}", self.data_dir) for i in range(size)
+        ]
+        self.idle = queue.Queue()
+        self.started = False
+        self.lock = threading.Lock()
+        self.restarts = 0
+
+    def path(self, file):
+        return container_path(file)
+
+    def warm_up(self):
+        try:
+            self.start()
+        except (subprocess.CalledProcessError, FileNotFoundError) as e:
+            print(f"Could not start audiowmark workers, will retry on first use: {e}")
+            return
+        self.check()
+
+    def start(self):
+        with self.lock:
+            if self.started:
+                return
+            for worker in self.workers:
+                worker.start()
+            for worker in self.workers:
+                self.idle.put(worker)
+            self.started = True
+            atexit.register(self.close)
+        print(f"Started {self.size} audiowmark worker(s)")
+
+    def restart(self, worker):
+        print(f"Restarting audiowmark worker {worker.name}")
+        self.restarts += 1
+        worker.start()
+
+    def run(self, args, input=None):
+        self.start()
+        try:
+            worker = self.idle.get(timeout=self.acquire_timeout)
+        except queue.Empty:
+            raise subprocess.CalledProcessError(1, args, stderr="No audiowmark worker available")
+        try:
+            try:
+                return execute(worker.command(args), input)
+            except subprocess.CalledProcessError:
+                if worker.healthy():
+                    # A genuine audiowmark error, not a dead container
+                    raise
+                self.restart(worker)
+                return execute(worker.command(args), input)
+        finally:
+            self.idle.put(worker)
+
+    def check(self):
+        """Restart idle containers that are gone. Busy ones are left to the next check.
+
+        Containers are taken off the queue one at a time and put back before
+        the next, so calls meanwhile only wait for the one being checked.
+        """
+        if not self.started:
+            return False
+        healthy = True
+        checked = set()
+        for _ in range(self.size):
+            try:
+                worker = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                if worker.name in checked:
+                    break  # Back round to the first one: the others are busy
+                checked.add(worker.name)
+                if not worker.healthy():
+                    self.restart(worker)
+            except (subprocess.CalledProcessError, FileNotFoundError) as e:
+                print(f"Could not restart audiowmark worker {worker.name}: {e}")
+                healthy = False
+            finally:
+                self.idle.put(worker)
+        return healthy
+
+    def close(self):
+        with self.lock:
+            if not self.started:
+                return
+            for worker in self.workers:
+                worker.stop()
+            self.started = False
+
+
+class NullBackend(WatermarkBackend):
+    """Pretends to watermark without touching audio.
+
+    The output is a copy of the input. The message is remembered by the
+    hash of the audio so that a later ``get`` on the same audio finds it again.
+    ``latency`` seconds are slept per call to stand in for audiowmark in
+    benchmarks.
+    """
+
+    name = "null"
+    max_messages = 4096
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.messages = {}
+
+    @staticmethod
+    def digest(data):
+        return hashlib.blake2b(data, digest_size=16).digest()
+
+    def remember(self, key, message):
+        self.messages[key] = message
+        if len(self.messages) > self.max_messages:
+            del self.messages[next(iter(self.messages))]
+
+    def wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def report(self, message):
+        """What ``audiowmark get`` prints when it finds the message, or nothing for None."""
+        stdout = f"pattern  all {message} 1.000 0.000 ALL\n" if message else ""
+        return subprocess.CompletedProcess([self.name, 'get'], 0, stdout=stdout, stderr="")
+
+    def result(self, key):
+        self.wait()
+        return self.report(self.messages.get(key))
+
+    def add(self, input_file, output_file, message, strength):
+        self.wait()
+        shutil.copyfile(input_file, output_file)
+        with open(output_file, 'rb') as f:
+            self.remember(self.digest(f.read()), message)
+        return subprocess.CompletedProcess(['null', 'add'], 0, stdout="", stderr="")
+
+    def get(self, input_file):
+        with open(input_file, 'rb') as f:
+            return self.result(self.digest(f.read()))
+
+    def add_wav(self, wav, message, strength):
+        self.wait()
+        self.remember(self.digest(wav), message)
+        # A copy, as the input may be a view of a buffer that is reused
+        return bytes(wav)
+
+    def get_wav(self, wav):
+        return self.result(self.digest(wav))
+
+
+BACKENDS = {
+    DockerRunBackend.name: DockerRunBackend,
+    DockerPoolBackend.name: DockerPoolBackend,
+    LocalBackend.name: LocalBackend,
+    NullBackend.name: NullBackend,
+}
+
+_backend = None
+
+
+def create_backend(name=None):
+    """Create a backend from its name, defaulting to WATERMARK_BACKEND."""
+    name = (name or os.environ.get("WATERMARK_BACKEND", "docker")).lower()
+    if name == "fake":
+        # Kept with the other fakes, out of the production backends
+        from fake_watermark import FakeWatermarkBackend
+        return FakeWatermarkBackend(latency=float(os.environ.get("WATERMARK_NULL_LATENCY", 0)))
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown watermark backend: {name}")
+    if name == DockerPoolBackend.name:
+        return DockerPoolBackend(size=int(os.environ.get("WATERMARK_POOL_SIZE", 2)))
+    if name == NullBackend.name:
+        return NullBackend(latency=float(os.environ.get("WATERMARK_NULL_LATENCY", 0)))
+    return BACKENDS[name]()
+
+
+def get_backend():
+    """Return the process-wide backend, creating it on first use."""
+    global _backend
+    if _backend is None:
+        _backend = create_backend()
+    return _backend
+
+
+def set_backend(backend):
+    """Replace the process-wide backend, e.g. with a NullBackend in tests."""
+    global _backend
+    if _backend is not None and _backend is not backend:
+        _backend.close()
+    _backend = backend
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""Async watermark service that keeps audiowmark off the event loop.
+
+Jobs run in a thread pool: the backends spend their time blocked on
+audiowmark subprocesses, which doesn't hold the GIL. With several uvicorn
+workers, or WATERMARK_EXECUTOR=process, they run in a process pool instead,
+sized so that all workers together use every core
+(WATERMARK_PROCESSES per worker overrides it), except with the docker-pool
+backend, whose containers belong to the worker. A global semaphore caps
+how many jobs run at once, a per-session lock keeps each session's jobs in
+order, and jobs that wait too long or run too long are given up on.
+Jobs can be cancelled, e.g. when a turn is interrupted: a job still queued
+never runs, while one already running in the pool finishes and its result
+is dropped. Both are counted, the latter as wasted work. Jobs in threads
+read the session's ring buffer in place, so a job given up on while running
+detaches the buffer, leaving it the audio it reads while the session
+reuses the buffer.
+
+Saturation policy (WATERMARK_SATURATION_POLICY) when more than
+WATERMARK_MAX_PENDING jobs are queued:
+
+- ``passthrough`` embed returns None straight away so the caller sends the
+  audio unwatermarked
+- ``wait``        embed queues anyway
+
+Detection jobs are always dropped when the service is saturated. Detections
+of audio decoded before are answered from a DetectionCache.
+Background jobs, the verifier's, run on queues of their own and don't count
+towards saturation: the verifier skips turns while the service is
+saturated instead.
+
+With a capture Recorder, the result of every embed and detection that ran
+is logged, for replays to answer from.
+"""
+
+import asyncio
+import multiprocessing
+import os
+import time
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from detection_cache import create_cache
+from metrics import observe
+from ringbuffer import PCMRingBuffer
+from watermark import AGENT_SAMPLE_RATE, add_watermark_bytes, add_watermark_wav, detect_watermark_wav, pcm_to_wav
+from watermark_backends import DockerPoolBackend
+from workers import WORKER_COUNT
+
+
+class WatermarkService:
+    """Awaitable embed/detect with bounded concurrency and per-session queueing."""
+
+    def __init__(self, max_concurrency=2, max_pending=8, timeout=10.0, policy="passthrough", executor=None,
+                 cache=None, recorder=None):
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.policy = policy
+        self.executor = executor or ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="watermark")
+        self.processes = isinstance(self.executor, ProcessPoolExecutor)
+        self.cache = cache
+        self.recorder = recorder
+        self.semaphore = None
+        self.session_locks = {}
+        self.pending = 0
+        self.stats = {
+            "embedded": 0,
+            "detected": 0,
+            "passthrough": 0,
+            "dropped": 0,
+            "timeouts": 0,
+            "failures": 0,
+            "cancelled_queued": 0,
+            "cancelled_running": 0,
+        }
+
+    def job_wav(self, pcm, sample_rate):
+        """PCM as a WAV file the executor can take, built on the event loop.
+
+        Threads get a ring buffer's content in place, processes a copy, as
+        views can't be pickled.
+        """
+        wav = pcm_to_wav(pcm, sample_rate)
+        return bytes(wav) if self.processes and not isinstance(wav, bytes) else wav
+
+    def job_buffer(self, pcm):
+        """The ring buffer a job in a thread reads in place, if any."""
+        return pcm if isinstance(pcm, PCMRingBuffer) and not self.processes else None
+
+    def saturated(self):
+        return self.pending >= self.max_pending
+
+    async def run(self, session_id, func, *args, buffer=None, background=False):
+        """Run a blocking watermark call for a session. Raises TimeoutError.
+
+        ``buffer`` is a PCMRingBuffer the call reads, detached if the call is
+        given up on while it is still running. ``background`` calls aren't
+        counted as pending.
+        """
+        # Created lazily so the semaphore binds to the running loop
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        lock = self.session_locks.setdefault(session_id, asyncio.Lock())
+        loop = asyncio.get_running_loop()
+        counted = not background
+        self.pending += counted
+        job = None
+        try:
+            async with asyncio.timeout(self.timeout):
+                async with lock, self.semaphore:
+                    job = self.executor.submit(func, *args)
+                    return await asyncio.wrap_future(job, loop=loop)
+        except asyncio.CancelledError:
+            self.stats["cancelled_running" if job is not None else "cancelled_queued"] += 1
+            raise
+        finally:
+            self.pending -= counted
+            if buffer is not None and job is not None and not job.done():
+                buffer.detach()
+
+    async def embed(self, session_id, pcm, message, sample_rate=AGENT_SAMPLE_RATE):
+        """Watermark PCM. Returns watermarked PCM, or None to send it as is."""
+        if self.saturated() and self.policy == "passthrough":
+            self.stats["passthrough"] += 1
+            print(f"Watermark queue saturated ({self.pending} pending), sending unwatermarked audio")
+            return None
+        try:
+            add = add_watermark_bytes if self.processes else add_watermark_wav
+            watermarked = await self.run(session_id, add, self.job_wav(pcm, sample_rate), message,
+                                         buffer=self.job_buffer(pcm))
+        except TimeoutError:
+            self.stats["timeouts"] += 1
+            print(f"Watermark embed timed out after {self.timeout}s")
+            return None
+        if watermarked is None:
+            self.stats["failures"] += 1
+        else:
+            self.stats["embedded"] += 1
+            if self.recorder is not None:
+                self.recorder.embedded(pcm, watermarked)
+        return watermarked
+
+    async def detect(self, session_id, pcm, sample_rate=AGENT_SAMPLE_RATE, background=False):
+        """Detect a watermark in PCM. Returns the hex watermark or None."""
+        detection = await self.detect_detail(session_id, pcm, sample_rate, background)
+        return detection.hex if detection else None
+
+    async def detect_detail(self, session_id, pcm, sample_rate=AGENT_SAMPLE_RATE, background=False):
+        """Detect a watermark in PCM. Returns a Detection or None.
+
+        ``background`` detections are neither counted as pending nor dropped
+        when the service is saturated: ``session_id`` must be a queue of
+        their own, not one that embeds wait on.
+        """
+        key = None
+        if self.cache is not None:
+            key = self.cache.key(pcm, sample_rate)
+            detection = self.cache.get(key)
+            if detection is not None:
+                return detection
+        if not background and self.saturated():
+            self.stats["dropped"] += 1
+            return None
+        try:
+            detection = await self.run(session_id, detect_watermark_wav, self.job_wav(pcm, sample_rate),
+                                       buffer=self.job_buffer(pcm), background=background)
+        except TimeoutError:
+            self.stats["timeouts"] += 1
+            print(f"Watermark detection timed out after {self.timeout}s")
+            return None
+        self.stats["detected"] += 1
+        if self.recorder is not None:
+            self.recorder.detected(pcm, detection)
+        if detection is not None and key is not None:
+            self.cache.put(key, detection)
+        return detection
+
+    def forget(self, session_id):
+        """Drop the queue state of a closed session."""
+        self.session_locks.pop(session_id, None)
+
+    def close(self):
+        """Stop the worker processes of a process pool."""
+        if self.processes:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def process_count():
+    """Size of the process pool for watermark jobs, 0 to run them in threads.
+
+    The docker-pool backend always runs in threads: each pool process would
+    start containers of its own, which its exit doesn't stop, while the
+    worker's warm pool went unused.
+    """
+    kind = os.environ.get("WATERMARK_EXECUTOR", "process" if WORKER_COUNT > 1 else "thread").lower()
+    if kind != "process":
+        return 0
+    if os.environ.get("WATERMARK_BACKEND", "docker").lower() == DockerPoolBackend.name:
+        if "WATERMARK_EXECUTOR" in os.environ:
+            print(f"WATERMARK_EXECUTOR=process is ignored with the {DockerPoolBackend.name} backend, using threads")
+        return 0
+    return int(os.environ.get("WATERMARK_PROCESSES", 0)) or max((os.cpu_count() or 1) // WORKER_COUNT, 1)
+
+
+def create_service(recorder=None):
+    """Create a service configured from the environment."""
+    processes = process_count()
+    executor = None
+    if processes:
+        # Forkserver: forking a worker that runs an event loop and threads isn't safe
+        executor = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("forkserver"))
+    return WatermarkService(
+        max_concurrency=int(os.environ.get("WATERMARK_CONCURRENCY", processes or 2)),
+        max_pending=int(os.environ.get("WATERMARK_MAX_PENDING", 8)),
+        timeout=float(os.environ.get("WATERMARK_TIMEOUT", 10)),
+        policy=os.environ.get("WATERMARK_SATURATION_POLICY", "passthrough").lower(),
+        executor=executor,
+        cache=create_cache(),
+        recorder=recorder,
+    )
+
+
+def bit_errors(expected, detected):
+    """Number of differing bits between two hex watermarks of the same length."""
+    return bin(int(expected, 16) ^ int(detected, 16)).count("1")
+
+
+class WatermarkVerifier:
+    """Checks a sample of embedded turns in the background, after the audio is sent.
+
+    ``every`` is the sampling interval: 1 verifies every turn, N verifies one
+    turn in N and 0 turns verification off. Every watermarked piece of a
+    sampled turn is verified. ``success_rate`` is the share of finished
+    verifications that found the expected payload.
+
+    Verifications run on the session's verification queue, not the one its
+    embeds wait on, and are skipped while the service is saturated.
+    """
+
+    def __init__(self, service, every=1):
+        self.service = service
+        self.every = every
+        self.turns = 0
+        self.tasks = set()
+        self.stats = {
+            "turns": 0,
+            "sampled": 0,
+            "verified": 0,
+            "mismatched": 0,
+            "not_found": 0,
+            "bit_errors": 0,
+            "skipped": 0,
+            "latency_total": 0.0,
+            "latency_max": 0.0,
+            "success_rate": None,
+        }
+
+    def sample(self):
+        """Count a turn and tell whether it should be verified."""
+        self.stats["turns"] += 1
+        if self.every <= 0:
+            return False
+        self.turns += 1
+        return self.turns % self.every == 0
+
+    def submit(self, session_id, pcm, expected, sample_rate=AGENT_SAMPLE_RATE):
+        """Verify a sampled turn in the background."""
+        self.stats["sampled"] += 1
+        task = asyncio.create_task(self.verify(session_id, pcm, expected, sample_rate))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def verify(self, session_id, pcm, expected, sample_rate=AGENT_SAMPLE_RATE):
+        if self.service.saturated():
+            # Leave the service to the embeds and detections that are waited on
+            self.stats["skipped"] += 1
+            return
+        start = time.perf_counter()
+        detected = await self.service.detect(session_id, pcm, sample_rate, background=True)
+        latency = time.perf_counter() - start
+        observe("watermark_verify", latency)
+        self.stats["latency_total"] += latency
+        self.stats["latency_max"] = max(self.stats["latency_max"], latency)
+        if not detected:
+            self.stats["not_found"] += 1
+            self.update_success_rate()
+            print(f"Watermark not found ({latency:.2f}s)")
+            return
+        try:
+            errors = bit_errors(expected, detected)
+        except ValueError:
+            errors = len(expected) * 4
+        self.stats["bit_errors"] += errors
+        if errors:
+            self.stats["mismatched"] += 1
+        else:
+            self.stats["verified"] += 1
+        self.update_success_rate()
+        print(f"Watermark verified: {detected}, {errors} bit errors ({latency:.2f}s)")
+
+    def update_success_rate(self):
+        checked = self.stats["verified"] + self.stats["mismatched"] + self.stats["not_found"]
+        self.stats["success_rate"] = self.stats["verified"] / checked
+
+
+def create_verifier(service):
+    """Create a verifier sampling every WATERMARK_VERIFY_EVERY turns."""
+    return WatermarkVerifier(service, every=int(os.environ.get("WATERMARK_VERIFY_EVERY", 1)))
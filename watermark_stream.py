@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""Streaming watermark embedding for agent audio.
+
+Instead of buffering a whole turn, audio is cut into segments as it
+arrives and each segment is watermarked with the turn's payload as soon as
+it is complete.
+
+audiowmark needs BLOCK_SECONDS of audio to carry a full payload block, and
+a segment shorter than that carries no watermark that can be decoded on
+its own. A turn starts with a short segment, so that playback starts
+quickly, and each segment after it is twice as long as the one before, up
+to the full segment length, one block by default. Once segments are full
+length, ``lookahead`` seconds, one block by default, are held back so that
+a short tail at the end of the turn is merged into the last segment instead
+of being embedded on its own.
+
+The ramp only keeps playback going while the agent's audio arrives at
+least twice as fast as it plays. At real time, a segment can't be longer
+than the audio played before it, and the client stalls between segments
+of the ramp.
+"""
+
+import asyncio
+import os
+
+from collections import deque
+from ringbuffer import PCMRingBuffer
+from watermark import AGENT_SAMPLE_RATE
+
+# Audio audiowmark needs to embed one full payload block
+BLOCK_SECONDS = 3.0
+
+# "turn" buffers the whole turn before embedding, "stream" embeds segments
+WATERMARK_MODE = os.environ.get("WATERMARK_MODE", "turn").lower()
+FIRST_SEGMENT_SECONDS = float(os.environ.get("WATERMARK_FIRST_SEGMENT_SECONDS", 0.2))
+SEGMENT_SECONDS = float(os.environ.get("WATERMARK_SEGMENT_SECONDS", BLOCK_SECONDS))
+LOOKAHEAD_SECONDS = float(os.environ.get("WATERMARK_LOOKAHEAD_SECONDS", BLOCK_SECONDS))
+
+if WATERMARK_MODE == "stream" and SEGMENT_SECONDS < BLOCK_SECONDS:
+    print(f"Warning: WATERMARK_SEGMENT_SECONDS={SEGMENT_SECONDS:g} is shorter than an audiowmark payload block "
+          f"({BLOCK_SECONDS:g} s), its segments won't carry a watermark that can be detected")
+
+
+def seconds_to_bytes(seconds, sample_rate):
+    # 16-bit mono, rounded down to a whole sample
+    return int(seconds * sample_rate) * 2
+
+
+class StreamingEmbedder:
+    """Watermarks one session's agent audio segment by segment."""
+
+    def __init__(self, service, session_id, segment_seconds=SEGMENT_SECONDS,
+                 lookahead_seconds=LOOKAHEAD_SECONDS, sample_rate=AGENT_SAMPLE_RATE,
+                 first_segment_seconds=FIRST_SEGMENT_SECONDS):
+        self.service = service
+        self.session_id = session_id
+        self.sample_rate = sample_rate
+        self.segment_bytes = max(seconds_to_bytes(segment_seconds, sample_rate), 2)
+        self.first_segment_bytes = min(max(seconds_to_bytes(first_segment_seconds, sample_rate), 2),
+                                       self.segment_bytes)
+        self.block_bytes = seconds_to_bytes(BLOCK_SECONDS, sample_rate)
+        self.lookahead_bytes = seconds_to_bytes(lookahead_seconds, sample_rate)
+        # Length of the next segment of the turn
+        self.next_bytes = self.first_segment_bytes
+        # Segments are read from the front while audio arrives at the back
+        self.buffer = PCMRingBuffer(2 * (self.segment_bytes + self.lookahead_bytes))
+        self.message = None
+        # (task, original segment) in emission order
+        self.pending = deque()
+        # Segments emitted this turn, kept for verification
+        self.turn_audio = []
+
+    def start_turn(self, message):
+        """Set the payload repeated in every segment of the next turn."""
+        self.message = message
+        self.turn_audio = []
+        self.next_bytes = self.first_segment_bytes
+
+    def feed(self, chunk):
+        """Add agent audio and start embedding every complete segment."""
+        self.buffer.append(chunk)
+        while True:
+            size = self.next_bytes
+            # Segments of the ramp are too short for a payload block anyway, only full ones wait for the tail
+            lookahead = self.lookahead_bytes if size == self.segment_bytes else 0
+            if len(self.buffer) < size + lookahead:
+                break
+            self.schedule(self.buffer.read(size))
+            self.next_bytes = min(2 * size, self.segment_bytes)
+
+    def flush(self):
+        """Embed whatever is left at the end of the turn as the last segment."""
+        if self.buffer:
+            self.schedule(self.buffer.read(len(self.buffer)))
+
+    def cancel(self):
+        """Drop the rest of an interrupted turn: cancel pending segments and discard buffered audio.
+
+        Returns how many segments were cancelled and how many bytes of audio won't be sent.
+        """
+        cancelled = 0
+        discarded = len(self.buffer)
+        for task, segment in self.pending:
+            cancelled += task.cancel()
+            discarded += len(segment)
+        self.pending.clear()
+        self.buffer.clear()
+        return cancelled, discarded
+
+    def schedule(self, segment):
+        task = asyncio.create_task(self.service.embed(self.session_id, segment, self.message, self.sample_rate))
+        self.pending.append((task, segment))
+
+    def verifiable(self):
+        """The longest segment sent this turn, if it is long enough to carry a payload block on its own."""
+        segment = max(self.turn_audio, key=len, default=b'')
+        return segment if len(segment) >= self.block_bytes else None
+
+    def head(self):
+        """The task of the next segment to emit."""
+        return self.pending[0][0]
+
+    def result(self, task, segment):
+        try:
+            watermarked = task.result()
+        except Exception as e:
+            # Like a turn that fails to embed, the audio goes out as is
+            print(f"Error applying watermark: {e}")
+            watermarked = None
+        # Fall back to the original audio if the segment couldn't be watermarked
+        output = segment if watermarked is None else watermarked
+        self.turn_audio.append(output)
+        return output
+
+    def ready(self):
+        """Pop segments that finished embedding, in order, without waiting."""
+        while self.pending and self.pending[0][0].done():
+            task, segment = self.pending.popleft()
+            yield self.result(task, segment)
+
+    async def drain(self):
+        """Wait for and pop every outstanding segment, in order."""
+        while self.pending:
+            task, segment = self.pending[0]
+            await asyncio.wait({task})
+            self.pending.popleft()
+            yield self.result(task, segment)
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""Message forwarding between uvicorn worker processes.
+
+Each worker holds the sessions of the users whose /events or /ws
+connection it accepted, but a /send or /stream request can land on any
+worker. To deliver it anyway, every worker listens on a Unix socket in
+WORKER_DIR and registers the users it owns there, as one symlink per user
+pointing at its socket. A worker that gets a message for a session it does
+not hold looks up the owner and forwards the message, and the owner
+delivers it as if it had received it itself.
+
+Forwarding keeps one connection per peer. A message is framed as a
+length-prefixed JSON header with the user id and content type, then the
+length-prefixed body. The reply is the length-prefixed JSON response.
+
+Only enabled when running several workers. The count is taken the way
+uvicorn and gunicorn take it: from ``--workers`` (or gunicorn's ``-w``) on
+the command line, which every worker process sees too, else from
+WEB_CONCURRENCY. Other launchers must set WEB_CONCURRENCY to their worker
+count, or each worker will hold and answer for its own users only.
+"""
+
+import asyncio
+import json
+import os
+import struct
+import sys
+import tempfile
+
+LENGTH = struct.Struct('<I')
+
+
+def worker_count(argv, environ):
+    """Number of workers the server runs, from its command line or WEB_CONCURRENCY."""
+    flags = ("--workers", "-w") if os.path.basename(argv[0]).startswith("gunicorn") else ("--workers",)
+    count = environ.get("WEB_CONCURRENCY", 1)
+    for i, arg in enumerate(argv[1:], 1):
+        name, _, value = arg.partition("=")
+        if name in flags:
+            count = value or (argv[i + 1] if i + 1 < len(argv) else count)
+    return max(int(count), 1)
+
+
+WORKER_COUNT = worker_count(sys.argv, os.environ)
+
+
+async def read_frame(reader):
+    (length,) = LENGTH.unpack(await reader.readexactly(LENGTH.size))
+    return await reader.readexactly(length)
+
+
+def write_frame(writer, data):
+    writer.write(LENGTH.pack(len(data)))
+    writer.write(data)
+
+
+class Peer:
+    """Connection to another worker. Messages to it are sent one at a time."""
+
+    __slots__ = ("reader", "writer", "lock")
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.lock = asyncio.Lock()
+
+    async def request(self, header, body):
+        async with self.lock:
+            if self.closed():
+                raise ConnectionResetError("Peer connection closed")
+            try:
+                write_frame(self.writer, header)
+                write_frame(self.writer, body)
+                await self.writer.drain()
+                return json.loads(await read_frame(self.reader))
+            except asyncio.CancelledError:
+                # The response may still come, and the next request would read it as its own
+                self.close()
+                raise
+
+    def closed(self):
+        return self.writer.is_closing()
+
+    def close(self):
+        self.writer.close()
+
+
+class WorkerRouter:
+    """Registers this worker's sessions and forwards messages to other workers.
+
+    ``deliver(user_id, content_type, body)`` handles a message forwarded to
+    this worker and returns the response dict.
+    """
+
+    def __init__(self, directory, deliver):
+        self.directory = directory
+        self.users_dir = os.path.join(directory, "users")
+        self.socket_path = os.path.join(directory, f"worker-{os.getpid()}.sock")
+        self.deliver = deliver
+        self.server = None
+        self.peers = {}
+        self.claimed = set()
+        self.stats = {
+            "forwarded": 0,
+            "received": 0,
+            "forward_errors": 0,
+            "stale_owners": 0,
+        }
+
+    async def start(self):
+        os.makedirs(self.users_dir, exist_ok=True)
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self.server = await asyncio.start_unix_server(self.serve, self.socket_path)
+        print(f"Worker {os.getpid()} accepting forwarded messages on {self.socket_path}")
+
+    async def close(self):
+        for peer in self.peers.values():
+            peer.close()
+        self.peers.clear()
+        for user_id in list(self.claimed):
+            self.release(user_id)
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    def link(self, user_id):
+        return os.path.join(self.users_dir, user_id)
+
+    def claim(self, user_id):
+        """Register this worker as the owner of a user's session."""
+        link = self.link(user_id)
+        temporary = f"{link}.{os.getpid()}"
+        if os.path.lexists(temporary):
+            os.unlink(temporary)
+        os.symlink(self.socket_path, temporary)
+        os.replace(temporary, link)  # Atomic, the user may be registered by another worker
+        self.claimed.add(user_id)
+
+    def release(self, user_id):
+        """Unregister a closed session, unless another worker owns the user by now."""
+        self.claimed.discard(user_id)
+        self.drop_owner(user_id, self.socket_path)
+
+    def drop_owner(self, user_id, socket_path):
+        link = self.link(user_id)
+        try:
+            if os.readlink(link) == socket_path:
+                os.unlink(link)
+        except OSError:
+            pass
+
+    def owner(self, user_id):
+        """Socket of the worker owning the user, or None if it's this one or there is none."""
+        try:
+            socket_path = os.readlink(self.link(user_id))
+        except OSError:
+            return None
+        return None if socket_path == self.socket_path else socket_path
+
+    async def peer(self, socket_path):
+        peer = self.peers.get(socket_path)
+        if peer is None or peer.closed():
+            reader, writer = await asyncio.open_unix_connection(socket_path)
+            peer = self.peers[socket_path] = Peer(reader, writer)
+        return peer
+
+    async def forward(self, user_id, content_type, body):
+        """Deliver a message through the owning worker. Returns its response, or None if there is no owner."""
+        socket_path = self.owner(user_id)
+        if socket_path is None:
+            return None
+        header = json.dumps({"user_id": user_id, "content_type": content_type}).encode()
+        # Retry once on a fresh connection: the peer may have dropped an idle one
+        for attempt in range(2):
+            try:
+                peer = await self.peer(socket_path)
+                response = await peer.request(header, body)
+                self.stats["forwarded"] += 1
+                return response
+            except (FileNotFoundError, ConnectionRefusedError):
+                # The owner exited without unregistering
+                self.stats["stale_owners"] += 1
+                self.drop_owner(user_id, socket_path)
+                self.forget_peer(socket_path)
+                return None
+            except (OSError, asyncio.IncompleteReadError):
+                self.forget_peer(socket_path)
+        self.stats["forward_errors"] += 1
+        return {"error": "Owner worker unreachable"}
+
+    def forget_peer(self, socket_path):
+        peer = self.peers.pop(socket_path, None)
+        if peer is not None:
+            peer.close()
+
+    async def serve(self, reader, writer):
+        """Deliver messages forwarded by another worker, until it disconnects."""
+        try:
+            while True:
+                header = json.loads(await read_frame(reader))
+                body = await read_frame(reader)
+                self.stats["received"] += 1
+                try:
+                    response = await self.deliver(header["user_id"], header["content_type"], body)
+                except Exception as e:
+                    print(f"Error delivering forwarded message: {e}")
+                    response = {"error": str(e)}
+                write_frame(writer, json.dumps(response).encode())
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+
+def create_router(deliver):
+    """Create a router when running several workers, otherwise None."""
+    if WORKER_COUNT <= 1:
+        return None
+    default_dir = os.path.join(tempfile.gettempdir(), f"stego-workers-{os.environ.get('PORT', 8000)}")
+    return WorkerRouter(os.environ.get("WORKER_DIR", default_dir), deliver)